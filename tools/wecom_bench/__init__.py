@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for the WeChat Work synchronization, callback and messaging hot paths
+
+Runs against a test database with wecom_base installed and a local API simulator
+(tools.wecom_sim) started for each organization size:
+
+    python -m tools.wecom_bench run -c odoo.conf -d wecom_bench --sizes 1000,10000 -o after.json
+    python -m tools.wecom_bench compare before.json after.json --threshold 10
+
+Each scenario records wall time, SQL queries (total and per record), throughput and
+peak Python memory. Results are written as JSON so runs can be compared; compare exits
+with status 1 when a metric regressed by more than the threshold.
+
+The startup check imports wecom_base in fresh interpreters and exits with status 1 when
+the import time or resident memory exceeds its budget, or when a dependency meant to be
+imported on first use (requests, pycryptodome, xmltodict) is loaded at import time:
+
+    python -m tools.wecom_bench startup -c odoo.conf --max-import-ms 150 --max-rss-mb 15
+"""
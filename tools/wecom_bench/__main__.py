@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+import argparse
+import json
+import logging
+import sys
+
+from . import compare, startup
+
+
+def run(args):
+    import odoo
+    odoo.tools.config.parse_config(['-c', args.config, '-d', args.database] if args.config else ['-d', args.database])
+    from .runner import BenchmarkRunner
+    runner = BenchmarkRunner(
+        args.database,
+        sizes=[int(size) for size in args.sizes.split(',')],
+        callbacks=args.callbacks,
+        messages=args.messages,
+        trace_memory=not args.no_tracemalloc,
+        latency_ms=args.latency_ms,
+        seed=args.seed,
+    )
+    results = runner.run()
+    with open(args.output, 'w') as output:
+        json.dump(results, output, indent=2)
+    logging.info("Results written to %s", args.output)
+    return 0
+
+
+def diff(args):
+    rows, regressions = compare.compare(compare.load(args.baseline), compare.load(args.candidate), args.threshold)
+    print(compare.format_rows(rows))
+    if regressions:
+        print(f"\n{len(regressions)} metric(s) regressed by more than {args.threshold}%:")
+        print(compare.format_rows(regressions))
+        return 1
+    return 0
+
+
+def startup_budget(args):
+    odoo_args = ['-c', args.config] if args.config else []
+    if args.addons_path:
+        odoo_args += ['--addons-path', args.addons_path]
+    result = startup.measure(odoo_args, repeat=args.repeat)
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(result, output, indent=2)
+    failures = startup.check(result, args.max_import_ms, args.max_rss_mb)
+    for failure in failures:
+        print(f"Startup budget exceeded: {failure}")
+    return 1 if failures else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m tools.wecom_bench', description="WeChat Work benchmarks")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help="run the benchmarks against a test database")
+    run_parser.add_argument('-c', '--config', help="Odoo configuration file")
+    run_parser.add_argument('-d', '--database', required=True, help="test database with wecom_base installed")
+    run_parser.add_argument('--sizes', default='1000,10000', help="comma-separated numbers of users")
+    run_parser.add_argument('--callbacks', type=int, default=1000, help="callbacks per size")
+    run_parser.add_argument('--messages', type=int, default=200, help="messages sent per size")
+    run_parser.add_argument('--latency-ms', type=float, default=0, help="simulated API latency")
+    run_parser.add_argument('--seed', type=int, default=0)
+    run_parser.add_argument('--no-tracemalloc', action='store_true', help="skip peak memory, for cleaner timings")
+    run_parser.add_argument('-o', '--output', default='wecom_bench.json', help="JSON file to write")
+    run_parser.set_defaults(func=run)
+
+    compare_parser = subparsers.add_parser('compare', help="compare two result files")
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('candidate')
+    compare_parser.add_argument('--threshold', type=float, default=10.0,
+                                help="percentage above which a change is reported as a regression")
+    compare_parser.set_defaults(func=diff)
+
+    startup_parser = subparsers.add_parser('startup', help="measure the import time and memory of wecom_base")
+    startup_parser.add_argument('-c', '--config', help="Odoo configuration file")
+    startup_parser.add_argument('--addons-path', help="Odoo addons path, when not in the configuration file")
+    startup_parser.add_argument('--repeat', type=int, default=5, help="fresh interpreters, medians are reported")
+    startup_parser.add_argument('--max-import-ms', type=float, default=150.0, help="import time budget")
+    startup_parser.add_argument('--max-rss-mb', type=float, default=15.0, help="resident memory budget")
+    startup_parser.add_argument('-o', '--output', help="JSON file to write")
+    startup_parser.set_defaults(func=startup_budget)
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+# Metrics compared between runs; lower is better for all of them except throughput
+METRICS = ('wall_s', 'queries', 'queries_per_record', 'peak_mem_mb', 'throughput_per_s')
+HIGHER_IS_BETTER = {'throughput_per_s'}
+
+
+def load(path):
+    with open(path) as result_file:
+        return json.load(result_file)
+
+
+def compare(baseline, candidate, threshold=10.0):
+    """
+    Compare two benchmark runs
+    :param baseline: Results of the reference run
+    :param candidate: Results of the run to check
+    :param threshold: Relative change, in percent, above which a metric counts as a regression
+    :return: A tuple (rows, regressions), each row being
+             (scenario, size, metric, baseline value, candidate value, change in percent)
+    """
+    reference = {(result['scenario'], result['size']): result for result in baseline['results']}
+    rows = []
+    regressions = []
+    for result in candidate['results']:
+        base = reference.get((result['scenario'], result['size']))
+        if not base:
+            continue
+        for metric in METRICS:
+            old, new = base.get(metric), result.get(metric)
+            if old is None or new is None:
+                continue
+            change = (new - old) / old * 100 if old else 0.0
+            row = (result['scenario'], result['size'], metric, old, new, change)
+            rows.append(row)
+            worse = -change if metric in HIGHER_IS_BETTER else change
+            if worse > threshold:
+                regressions.append(row)
+    return rows, regressions
+
+
+def format_rows(rows):
+    lines = [f"{'scenario':<32} {'size':>8} {'metric':<20} {'baseline':>12} {'candidate':>12} {'change':>9}"]
+    for scenario, size, metric, old, new, change in rows:
+        lines.append(f"{scenario:<32} {size:>8} {metric:<20} {old:>12} {new:>12} {change:>+8.1f}%")
+    return '\n'.join(lines)
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+
+import gc
+import logging
+import platform
+import subprocess
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+
+from ..wecom_sim import SyntheticOrg, WeComSimulator
+
+_logger = logging.getLogger(__name__)
+
+CORP_ID = 'wwbenchmark'
+SECRET = 'benchmark-secret'
+AES_KEY = 'abcdefghijklmnopqrstuvwxyz0123456789ABCDEFG'
+
+
+def org_for_size(users, seed=0):
+    """Build the synthetic organization used for a benchmark size"""
+    return SyntheticOrg(
+        users=users,
+        departments=max(1, users // 10),
+        depth=min(12, max(2, len(str(users)) * 2)),
+        tags=max(5, users // 200),
+        seed=seed,
+    )
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Measurement(object):
+    """Wall time, SQL queries and peak Python memory of a block of code"""
+
+    def __init__(self, cr, trace_memory=True):
+        self.cr = cr
+        self.trace_memory = trace_memory
+        self.wall_s = 0.0
+        self.queries = 0
+        self.peak_mem_mb = None
+
+    @contextmanager
+    def measure(self):
+        gc.collect()
+        if self.trace_memory:
+            tracemalloc.start()
+        queries = self.cr.sql_log_count
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.wall_s = time.perf_counter() - start
+            self.queries = self.cr.sql_log_count - queries
+            if self.trace_memory:
+                self.peak_mem_mb = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+                tracemalloc.stop()
+
+
+class BenchmarkRunner(object):
+    """
+    Run the WeChat Work benchmarks against a test database and a local API simulator
+    Every scenario runs in its own transaction, rolled back at the end, so the database
+    is left untouched and each size starts from the same state.
+    """
+
+    def __init__(self, dbname, sizes, callbacks=1000, messages=200, trace_memory=True, latency_ms=0, seed=0):
+        self.dbname = dbname
+        self.sizes = sizes
+        self.callbacks = callbacks
+        self.messages = messages
+        self.trace_memory = trace_memory
+        self.latency_ms = latency_ms
+        self.seed = seed
+        self.results = []
+
+    def run(self):
+        import odoo
+        # Keep every scenario in one transaction, see the class docstring
+        threading.current_thread().testing = True
+        registry = odoo.registry(self.dbname)
+        for size in self.sizes:
+            org = org_for_size(size, seed=self.seed)
+            simulator = WeComSimulator(org, latency_ms=self.latency_ms, seed=self.seed)
+            server, base_url = simulator.serve_in_thread()
+            try:
+                for scenario in (self.bench_sync, self.bench_callbacks, self.bench_send):
+                    with registry.cursor() as cr:
+                        try:
+                            env = odoo.api.Environment(cr, odoo.SUPERUSER_ID, {})
+                            company = self._setup(env, base_url)
+                            scenario(env, company, org, size)
+                        finally:
+                            cr.rollback()
+            finally:
+                server.shutdown()
+                server.server_close()
+        return {
+            'meta': {
+                'timestamp': datetime.utcnow().isoformat(),
+                'git_revision': git_revision(),
+                'python': platform.python_version(),
+                'odoo': odoo.release.version,
+                'database': self.dbname,
+                'sizes': self.sizes,
+                'latency_ms': self.latency_ms,
+                'trace_memory': self.trace_memory,
+            },
+            'results': self.results,
+        }
+
+    def _setup(self, env, base_url):
+        """Point the module at the simulator and create an integrated company with its application"""
+        env['ir.config_parameter'].set_param('wecom.api_base_url', base_url)
+        company = env['res.company'].create({
+            'name': f"WeCom Benchmark {time.time_ns()}",
+            'is_wecom_integrated': True,
+            'wecom_corp_id': CORP_ID,
+            'wecom_agent_id': '1000001',
+            'wecom_secret': SECRET,
+            'wecom_token': 'benchmark-token',
+            'wecom_aes_key': AES_KEY,
+        })
+        app_type = env['wecom.app.type'].search([], limit=1) or env['wecom.app.type'].create({
+            'name': 'Benchmark', 'code': 'BENCH',
+        })
+        env['wecom.application'].create({
+            'app_name': 'Benchmark',
+            'company_id': company.id,
+            'type_id': app_type.id,
+            'agent_id': 1000001,
+            'secret': SECRET,
+        })
+        env.flush_all()
+        return company
+
+    def _record(self, scenario, size, measurement, records):
+        result = {
+            'scenario': scenario,
+            'size': size,
+            'records': records,
+            'wall_s': round(measurement.wall_s, 4),
+            'queries': measurement.queries,
+            'queries_per_record': round(measurement.queries / records, 3) if records else None,
+            'throughput_per_s': round(records / measurement.wall_s, 1) if measurement.wall_s else None,
+            'peak_mem_mb': round(measurement.peak_mem_mb, 2) if measurement.peak_mem_mb is not None else None,
+        }
+        _logger.info("%(scenario)s[%(size)s]: %(wall_s)ss, %(queries)s queries, %(peak_mem_mb)s MB", result)
+        self.results.append(result)
+
+    def bench_sync(self, env, company, org, size):
+        """Full sync into an empty company, then an incremental sync with nothing changed"""
+        departments = env['wecom.department'].with_company(company)
+        users = env['wecom.user'].with_company(company)
+        tags = env['wecom.tag'].with_company(company)
+        records = len(org.parent) + len(org.user_departments) + len(org.tag_users)
+        for kind in ('full', 'incremental'):
+            steps = [
+                ('departments', departments.sync_departments, len(org.parent)),
+                ('users', users.sync_users, len(org.user_departments)),
+                ('tags', tags.sync_tags, len(org.tag_users)),
+            ]
+            total = Measurement(env.cr, trace_memory=False)
+            with total.measure():
+                for name, sync, count in steps:
+                    measurement = Measurement(env.cr, self.trace_memory)
+                    with measurement.measure():
+                        sync()
+                        env.flush_all()
+                    self._record(f"sync_{kind}_{name}", size, measurement, count)
+            self._record(f"sync_{kind}", size, total, records)
+
+    def bench_callbacks(self, env, company, org, size):
+        """Signature check, decryption, parsing and dispatch of contact change callbacks"""
+        from odoo.addons.wecom_base.controllers.main import WeComController
+        from odoo.addons.wecom_base.models.wecom_utils import (
+            calculate_signature, decrypt_message, dict_to_xml, encrypt_message, generate_random_string,
+            parse_xml_to_dict,
+        )
+        payloads = []
+        for index in range(self.callbacks):
+            xml = dict_to_xml({
+                'ToUserName': CORP_ID,
+                'FromUserName': 'sys',
+                'CreateTime': 1700000000 + index,
+                'MsgType': 'event',
+                'Event': 'change_contact',
+                'ChangeType': 'update_user',
+                'UserID': org.userid(index % max(1, len(org.user_departments))),
+                'Position': 'Engineer',
+            })
+            encrypted = encrypt_message(generate_random_string(16) + xml, AES_KEY)
+            payloads.append((str(1700000000 + index), str(index), encrypted))
+        signatures = [calculate_signature(company.wecom_token, timestamp, nonce, encrypted)
+                      for timestamp, nonce, encrypted in payloads]
+
+        controller = WeComController()
+        measurement = Measurement(env.cr, self.trace_memory)
+        with measurement.measure():
+            for (timestamp, nonce, encrypted), signature in zip(payloads, signatures):
+                if calculate_signature(company.wecom_token, timestamp, nonce, encrypted) != signature:
+                    raise AssertionError("Invalid benchmark signature")
+                message = parse_xml_to_dict(decrypt_message(encrypted, AES_KEY))
+                controller._process_message(company, message)
+            # Batchable callbacks are queued, apply them as the dispatch cron would
+            env['wecom.callback.event'].cron_dispatch_events()
+            env.flush_all()
+        self._record('callbacks', size, measurement, self.callbacks)
+
+    def bench_send(self, env, company, org, size):
+        """Create and send text messages to batches of users"""
+        batch = [org.userid(index) for index in range(min(100, len(org.user_departments)))]
+        messages = env['wecom.message'].create([{
+            'company_id': company.id,
+            'message_type': 'text',
+            'content': f"Benchmark message {index}",
+            'recipient_type': 'user',
+            'recipient_ids': '|'.join(batch),
+        } for index in range(self.messages)])
+        env.flush_all()
+        measurement = Measurement(env.cr, self.trace_memory)
+        with measurement.measure():
+            for message in messages:
+                message.action_send()
+            env.flush_all()
+        self._record('send', size, measurement, self.messages)
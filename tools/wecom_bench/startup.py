@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+import json
+import logging
+import statistics
+import subprocess
+import sys
+
+_logger = logging.getLogger(__name__)
+
+# Dependencies wecom_base imports on first use only, loading them at import time fails the check
+LAZY_MODULES = ('requests', 'Crypto', 'xmltodict')
+
+# Run in a fresh interpreter, so nothing is imported or cached beforehand; wecom_base/tests/test_startup.py runs it too
+PROBE = r'''
+import json
+import os
+import resource
+import sys
+import time
+
+
+def rss_kb():
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+import odoo
+from odoo.modules.module import initialize_sys_path
+
+odoo.tools.config.parse_config(sys.argv[1:])
+initialize_sys_path()
+before = set(sys.modules)
+rss = rss_kb()
+start = time.perf_counter()
+import odoo.addons.wecom_base
+import odoo.addons.wecom_base.controllers.main
+import_ms = (time.perf_counter() - start) * 1000
+print(json.dumps({
+    'import_ms': import_ms,
+    'rss_mb': (rss_kb() - rss) / 1024,
+    'modules': sorted(set(sys.modules) - before),
+}))
+'''
+
+
+def probe(odoo_args):
+    """
+    Import wecom_base in a new interpreter
+    :param odoo_args: Odoo command line arguments, for the addons path
+    :return: A dictionary with import_ms, rss_mb and the newly imported modules
+    """
+    output = subprocess.check_output([sys.executable, '-c', PROBE] + odoo_args)
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def measure(odoo_args, repeat=5):
+    """
+    Measure the import time and resident memory of the wecom_base module tree
+    :param odoo_args: Odoo command line arguments, for the addons path
+    :param repeat: Number of fresh interpreters, the medians are reported
+    :return: The measurement, with the lazy dependencies that were imported anyway
+    """
+    probes = [probe(odoo_args) for _index in range(repeat)]
+    modules = probes[-1]['modules']
+    return {
+        'import_ms': round(statistics.median(result['import_ms'] for result in probes), 2),
+        'rss_mb': round(statistics.median(result['rss_mb'] for result in probes), 2),
+        'module_count': len(modules),
+        'eager_dependencies': sorted({
+            module.split('.')[0] for module in modules if module.split('.')[0] in LAZY_MODULES
+        }),
+    }
+
+
+def check(result, max_import_ms, max_rss_mb):
+    """
+    Compare a measurement with the startup budget
+    :param result: Result of measure
+    :param max_import_ms: Import time budget, in milliseconds
+    :param max_rss_mb: Resident memory budget, in megabytes
+    :return: The list of exceeded budgets, empty when the startup is within budget
+    """
+    failures = []
+    if result['import_ms'] > max_import_ms:
+        failures.append(f"import time {result['import_ms']} ms exceeds {max_import_ms} ms")
+    if result['rss_mb'] > max_rss_mb:
+        failures.append(f"resident memory {result['rss_mb']} MB exceeds {max_rss_mb} MB")
+    if result['eager_dependencies']:
+        failures.append(f"imported at load time: {', '.join(result['eager_dependencies'])}")
+    return failures
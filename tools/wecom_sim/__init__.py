@@ -0,0 +1,15 @@
+# -*- coding: utf-8 -*-
+"""
+Local WeChat Work API simulator for load testing
+
+Serves a deterministic synthetic organization over HTTP, so the synchronization and
+messaging code can be exercised at realistic scale without qyapi.weixin.qq.com:
+
+    python -m tools.wecom_sim --users 100000 --departments 10000 --depth 12 --tags 500 --port 8900
+
+then set the system parameter wecom.api_base_url to http://127.0.0.1:8900/cgi-bin/.
+Only the standard library is used, so it runs outside of the Odoo environment.
+"""
+
+from .generator import SyntheticOrg
+from .server import WeComSimulator
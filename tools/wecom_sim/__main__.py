@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+
+import argparse
+import logging
+import time
+
+from .generator import SyntheticOrg
+from .server import WeComSimulator
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m tools.wecom_sim', description="Local WeChat Work API simulator")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--departments', type=int, default=100)
+    parser.add_argument('--depth', type=int, default=5)
+    parser.add_argument('--tags', type=int, default=50)
+    parser.add_argument('--max-tag-users', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--latency-ms', type=float, default=0, help="latency added to every call")
+    parser.add_argument('--jitter-ms', type=float, default=0, help="random extra latency of up to this value")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="share of calls answered with an error")
+    parser.add_argument('--error-codes', default='-1', help="comma-separated errcodes to inject")
+    parser.add_argument('--rate-limit', type=float, default=None, help="calls per second per access token")
+    parser.add_argument('--corpid', default=None, help="only accept this corpid")
+    parser.add_argument('--corpsecret', default=None, help="only accept this secret")
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO,
+                        format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    started = time.perf_counter()
+    org = SyntheticOrg(users=args.users, departments=args.departments, depth=args.depth, tags=args.tags,
+                       max_tag_users=args.max_tag_users, seed=args.seed)
+    logging.info("Generated %s users, %s departments and %s tags in %.2fs",
+                 args.users, args.departments, args.tags, time.perf_counter() - started)
+    simulator = WeComSimulator(
+        org, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, error_rate=args.error_rate,
+        error_codes=[int(code) for code in args.error_codes.split(',') if code],
+        rate_limit=args.rate_limit, corpid=args.corpid, corpsecret=args.corpsecret, seed=args.seed,
+    )
+    server = simulator.make_server(args.host, args.port)
+    logging.info("Serving the WeChat Work API on http://%s:%s/cgi-bin/", *server.server_address[:2])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
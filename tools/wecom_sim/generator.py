@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+
+import random
+
+POSITIONS = ['Engineer', 'Senior Engineer', 'Manager', 'Director', 'Analyst', 'Designer', 'Sales', 'Support']
+
+
+class SyntheticOrg(object):
+    """
+    Deterministic synthetic WeChat Work organization
+    The same parameters and seed always produce the same departments, users and tags.
+    Only the structure (department tree, memberships) is kept in memory; user details
+    are derived from the user index on demand, so large organizations stay cheap.
+    """
+
+    def __init__(self, users=1000, departments=100, depth=5, tags=50, max_tag_users=200, seed=0):
+        """
+        :param users: Number of users
+        :param departments: Number of departments, including the root department 1
+        :param depth: Maximum depth of the department tree, the root being at depth 1
+        :param tags: Number of tags
+        :param max_tag_users: Maximum number of users per tag
+        :param seed: Seed of the generator
+        """
+        if departments < 1 or depth < 1:
+            raise ValueError("An organization needs at least the root department")
+        self.seed = seed
+        rng = random.Random(seed)
+
+        # Departments: ids 1..n, a chain first so the requested depth is reached
+        self.parent = {1: 0}
+        self.depth = {1: 1}
+        self.children = {1: []}
+        for dept_id in range(2, departments + 1):
+            if dept_id <= depth:
+                parent_id = dept_id - 1
+            else:
+                parent_id = rng.randint(1, dept_id - 1)
+                while self.depth[parent_id] >= depth:
+                    parent_id = self.parent[parent_id]
+            self.parent[dept_id] = parent_id
+            self.depth[dept_id] = self.depth[parent_id] + 1
+            self.children[dept_id] = []
+            self.children[parent_id].append(dept_id)
+
+        # Users: one main department, one in ten also belongs to a second one
+        self.user_departments = []
+        self.department_users = {dept_id: [] for dept_id in self.parent}
+        for index in range(users):
+            dept_ids = [rng.randint(1, departments)]
+            if departments > 1 and rng.random() < 0.1:
+                other = rng.randint(1, departments)
+                if other != dept_ids[0]:
+                    dept_ids.append(other)
+            self.user_departments.append(dept_ids)
+            for dept_id in dept_ids:
+                self.department_users[dept_id].append(index)
+        self.leaders = {dept_id: members[0] for dept_id, members in self.department_users.items() if members}
+        self.userids = {self.userid(index): index for index in range(users)}
+
+        # Tags: a random sample of users and a few departments each
+        self.tag_users = {}
+        self.tag_departments = {}
+        for tagid in range(1, tags + 1):
+            self.tag_users[tagid] = set(rng.sample(range(users), min(users, rng.randint(0, max_tag_users))))
+            self.tag_departments[tagid] = set(rng.sample(range(1, departments + 1),
+                                                         min(departments, rng.randint(0, 3))))
+
+    @staticmethod
+    def userid(index):
+        return f"user{index:06d}"
+
+    def subtree(self, dept_id):
+        """Get a department and all its descendants, parents before children"""
+        if dept_id not in self.parent:
+            return []
+        result = [dept_id]
+        for current in result:
+            result.extend(self.children[current])
+        return result
+
+    def department(self, dept_id):
+        leader = self.leaders.get(dept_id)
+        return {
+            'id': dept_id,
+            'name': 'Company' if dept_id == 1 else f"Department {dept_id}",
+            'name_en': 'Company' if dept_id == 1 else f"Department {dept_id}",
+            'department_leader': [self.userid(leader)] if leader is not None else [],
+            'parentid': self.parent[dept_id],
+            'order': 100000000 - dept_id,
+        }
+
+    def user(self, index):
+        rng = random.Random(self.seed * 1000003 + index)
+        dept_ids = self.user_departments[index]
+        userid = self.userid(index)
+        return {
+            'userid': userid,
+            'name': f"User {index}",
+            'department': dept_ids,
+            'order': [0] * len(dept_ids),
+            'position': rng.choice(POSITIONS),
+            'mobile': f"138{index:08d}",
+            'gender': str(rng.randint(1, 2)),
+            'email': f"{userid}@example.com",
+            'is_leader_in_dept': [int(self.leaders.get(dept_id) == index) for dept_id in dept_ids],
+            'direct_leader': [],
+            'avatar': f"https://wework.qpic.cn/wwhead/{index % 50}/0",
+            'thumb_avatar': f"https://wework.qpic.cn/wwhead/{index % 50}/100",
+            'telephone': '',
+            'alias': '',
+            'status': 1,
+            'address': '',
+            'main_department': dept_ids[0],
+            'extattr': {'attrs': []},
+            'qr_code': f"https://open.work.weixin.qq.com/wwopen/userQRCode?vcode={userid}",
+            'external_position': '',
+            'external_profile': {'external_corp_name': '', 'external_attr': []},
+        }
+
+    def simple_user(self, index):
+        return {
+            'userid': self.userid(index),
+            'name': f"User {index}",
+            'department': self.user_departments[index],
+        }
+
+    def users_in(self, dept_id, fetch_child=False):
+        """Get the indexes of the users of a department, optionally including its sub-departments"""
+        dept_ids = self.subtree(dept_id) if fetch_child else [dept_id]
+        seen = set()
+        result = []
+        for current in dept_ids:
+            for index in self.department_users.get(current, ()):
+                if index not in seen:
+                    seen.add(index)
+                    result.append(index)
+        return result
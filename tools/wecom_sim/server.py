@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+
+import json
+import logging
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+_logger = logging.getLogger(__name__)
+
+TOKEN_EXPIRES_IN = 7200
+
+ERRMSGS = {
+    -1: 'system busy',
+    40013: 'invalid corpid',
+    40014: 'invalid access_token',
+    41001: 'access_token missing',
+    42001: 'access_token expired',
+    45009: 'api freq out of limit',
+    60003: 'department not found',
+    60111: 'userid not found',
+    40068: 'invalid tagid',
+    301002: 'not allow operate another agent',
+}
+
+
+class TokenBucket(object):
+    """Token bucket allowing `rate` calls per second with bursts of up to `rate` calls"""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class WeComSimulator(object):
+    """
+    Local stand-in for the WeChat Work API, serving a SyntheticOrg
+    Supported endpoints: gettoken, department/list, user/list, user/simplelist, user/list_id,
+    user/get, tag/list, tag/get and message/send, under the /cgi-bin/ prefix like the real API.
+    Latency, random errcodes and a per-token rate limit can be injected.
+    Call counters are served as JSON under /_sim/stats.
+    """
+
+    def __init__(self, org, latency_ms=0, jitter_ms=0, error_rate=0.0, error_codes=(-1,), rate_limit=None,
+                 corpid=None, corpsecret=None, seed=0):
+        """
+        :param org: The SyntheticOrg to serve
+        :param latency_ms: Latency added to every response, in milliseconds
+        :param jitter_ms: Random extra latency of up to this many milliseconds
+        :param error_rate: Probability of answering a call with one of error_codes instead of a result
+        :param error_codes: The errcodes injected at random
+        :param rate_limit: Calls per second allowed per access token, answered with 45009 beyond that
+        :param corpid: Accepted corpid, any when not set
+        :param corpsecret: Accepted corpsecret, any when not set
+        :param seed: Seed of the latency and error injection
+        """
+        self.org = org
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.error_codes = tuple(error_codes)
+        self.rate_limit = rate_limit
+        self.corpid = corpid
+        self.corpsecret = corpsecret
+        self.tokens = {}
+        self.buckets = {}
+        self.stats = Counter()
+        self.sent_messages = 0
+        self.lock = threading.Lock()
+        self.rng = random.Random(seed)
+        self.routes = {
+            'gettoken': self.gettoken,
+            'department/list': self.department_list,
+            'user/list': self.user_list,
+            'user/simplelist': self.user_simplelist,
+            'user/list_id': self.user_list_id,
+            'user/get': self.user_get,
+            'tag/list': self.tag_list,
+            'tag/get': self.tag_get,
+            'message/send': self.message_send,
+        }
+
+    # ------------------------------------------------------------------
+    # Dispatch
+    # ------------------------------------------------------------------
+
+    def handle(self, endpoint, query, body):
+        """
+        Answer one API call
+        :param endpoint: Path after /cgi-bin/
+        :param query: Query string parameters, one value each
+        :param body: Decoded JSON body, or None
+        :return: The response dictionary
+        """
+        with self.lock:
+            self.stats[endpoint] += 1
+            inject = self.error_rate and self.rng.random() < self.error_rate
+            errcode = self.rng.choice(self.error_codes) if inject else 0
+            delay = self.latency_ms + (self.rng.uniform(0, self.jitter_ms) if self.jitter_ms else 0)
+        if delay:
+            time.sleep(delay / 1000.0)
+
+        route = self.routes.get(endpoint)
+        if route is None:
+            return self.error(404, f"unsupported endpoint {endpoint}")
+        if endpoint != 'gettoken':
+            error = self.check_token(query.get('access_token'))
+            if error:
+                return error
+        if errcode:
+            with self.lock:
+                self.stats['injected_errors'] += 1
+            return self.error(errcode)
+        return route(query, body or {})
+
+    def check_token(self, access_token):
+        if not access_token:
+            return self.error(41001)
+        expires_at = self.tokens.get(access_token)
+        if expires_at is None:
+            return self.error(40014)
+        if expires_at < time.time():
+            return self.error(42001)
+        if self.rate_limit:
+            bucket = self.buckets.setdefault(access_token, TokenBucket(self.rate_limit))
+            if not bucket.take():
+                with self.lock:
+                    self.stats['throttled'] += 1
+                return self.error(45009)
+        return None
+
+    @staticmethod
+    def error(errcode, errmsg=None):
+        return {'errcode': errcode, 'errmsg': errmsg or ERRMSGS.get(errcode, 'error')}
+
+    @staticmethod
+    def ok(**values):
+        return dict(errcode=0, errmsg='ok', **values)
+
+    # ------------------------------------------------------------------
+    # Endpoints
+    # ------------------------------------------------------------------
+
+    def gettoken(self, query, body):
+        if not query.get('corpid') or (self.corpid and query['corpid'] != self.corpid):
+            return self.error(40013)
+        if self.corpsecret and query.get('corpsecret') != self.corpsecret:
+            return self.error(40001, 'invalid credential')
+        access_token = uuid.uuid4().hex
+        self.tokens[access_token] = time.time() + TOKEN_EXPIRES_IN
+        return self.ok(access_token=access_token, expires_in=TOKEN_EXPIRES_IN)
+
+    def department_list(self, query, body):
+        dept_id = int(query.get('id') or 1)
+        dept_ids = self.org.subtree(dept_id)
+        if not dept_ids:
+            return self.error(60003)
+        return self.ok(department=[self.org.department(current) for current in dept_ids])
+
+    def user_list(self, query, body):
+        dept_id = int(query.get('department_id') or 0)
+        if dept_id not in self.org.parent:
+            return self.error(60003)
+        indexes = self.org.users_in(dept_id, query.get('fetch_child') == '1')
+        return self.ok(userlist=[self.org.user(index) for index in indexes])
+
+    def user_simplelist(self, query, body):
+        dept_id = int(query.get('department_id') or 0)
+        if dept_id not in self.org.parent:
+            return self.error(60003)
+        indexes = self.org.users_in(dept_id, query.get('fetch_child') == '1')
+        return self.ok(userlist=[self.org.simple_user(index) for index in indexes])
+
+    def user_list_id(self, query, body):
+        start = int(body.get('cursor') or 0)
+        limit = min(int(body.get('limit') or 10000), 10000)
+        end = min(start + limit, len(self.org.user_departments))
+        dept_user = [
+            {'userid': self.org.userid(index), 'department': dept_id}
+            for index in range(start, end)
+            for dept_id in self.org.user_departments[index]
+        ]
+        return self.ok(next_cursor=str(end) if end < len(self.org.user_departments) else '', dept_user=dept_user)
+
+    def user_get(self, query, body):
+        index = self.org.userids.get(query.get('userid'))
+        if index is None:
+            return self.error(60111)
+        return self.ok(**self.org.user(index))
+
+    def tag_list(self, query, body):
+        return self.ok(taglist=[{'tagid': tagid, 'tagname': f"Tag {tagid}"} for tagid in self.org.tag_users])
+
+    def tag_get(self, query, body):
+        tagid = int(query.get('tagid') or 0)
+        if tagid not in self.org.tag_users:
+            return self.error(40068)
+        return self.ok(
+            tagname=f"Tag {tagid}",
+            userlist=[{'userid': self.org.userid(index), 'name': f"User {index}"}
+                      for index in sorted(self.org.tag_users[tagid])],
+            partylist=sorted(self.org.tag_departments[tagid]),
+        )
+
+    def message_send(self, query, body):
+        if not body.get('msgtype') or not body.get('agentid'):
+            return self.error(40008, 'invalid message type')
+        touser = [userid for userid in (body.get('touser') or '').split('|') if userid]
+        toparty = [party for party in str(body.get('toparty') or '').split('|') if party]
+        totag = [tag for tag in str(body.get('totag') or '').split('|') if tag]
+        invaliduser = [] if touser == ['@all'] else [u for u in touser if u not in self.org.userids]
+        invalidparty = [p for p in toparty if not p.isdigit() or int(p) not in self.org.parent]
+        invalidtag = [t for t in totag if not t.isdigit() or int(t) not in self.org.tag_users]
+        with self.lock:
+            self.sent_messages += 1
+        return self.ok(
+            invaliduser='|'.join(invaliduser),
+            invalidparty='|'.join(invalidparty),
+            invalidtag='|'.join(invalidtag),
+            unlicenseduser='',
+            msgid=uuid.uuid4().hex,
+            response_code='',
+        )
+
+    # ------------------------------------------------------------------
+    # HTTP server
+    # ------------------------------------------------------------------
+
+    def make_server(self, host='127.0.0.1', port=0):
+        """
+        Build the HTTP server, not started yet
+        :param host: Interface to listen on
+        :param port: Port to listen on, 0 to pick a free one
+        :return: A ThreadingHTTPServer, its base URL being http://host:port/cgi-bin/
+        """
+        simulator = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                self._dispatch(None)
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                raw = self.rfile.read(length) if length else b''
+                try:
+                    body = json.loads(raw) if raw else {}
+                except ValueError:
+                    self._reply(simulator.error(47001, 'data format error'))
+                    return
+                self._dispatch(body)
+
+            def _dispatch(self, body):
+                url = urlparse(self.path)
+                query = {key: values[0] for key, values in parse_qs(url.query).items()}
+                if url.path == '/_sim/stats':
+                    with simulator.lock:
+                        stats = dict(simulator.stats, sent_messages=simulator.sent_messages)
+                    self._reply(stats)
+                elif url.path.startswith('/cgi-bin/'):
+                    self._reply(simulator.handle(url.path[len('/cgi-bin/'):], query, body))
+                else:
+                    self._reply(simulator.error(404, 'not found'), status=404)
+
+            def _reply(self, payload, status=200):
+                data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json; charset=utf-8')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                _logger.debug(format, *args)
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        return server
+
+    def serve_in_thread(self, host='127.0.0.1', port=0):
+        """
+        Start the HTTP server in a daemon thread
+        :return: A tuple (server, base URL to configure as wecom.api_base_url)
+        """
+        server = self.make_server(host, port)
+        thread = threading.Thread(target=server.serve_forever, name='wecom-simulator', daemon=True)
+        thread.start()
+        return server, f"http://{server.server_address[0]}:{server.server_address[1]}/cgi-bin/"
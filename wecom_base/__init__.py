@@ -1,12 +1,15 @@
 # -*- coding: utf-8 -*-
 
+from odoo import api, SUPERUSER_ID
+
 from . import models
 from . import controllers
 
 def post_init_hook(cr, registry):
     """Post-install script"""
-    # 这里可以添加模块安装后需要执行的任何初始化代码
-    pass
+    env = api.Environment(cr, SUPERUSER_ID, {})
+    env['wecom.api.registry'].init_wecom_apis()
+    env['wecom.sync.job']._setup_worker_crons()
 
 def uninstall_hook(cr, registry):
     """Uninstall script"""
@@ -14,7 +14,7 @@
     "author": "Fred Gao",
     "website": "https://github.com/RyanGf/wecom_suite",
     "category": "WeChat Work/Core",
-    "version": "16.0.0.1",
+    "version": "16.0.0.2",
     "depends": ["base_setup", "wecom_widget", "wecom_api"],
     "data": [
         "security/wecom_security.xml",
@@ -1,9 +1,12 @@
 # -*- coding: utf-8 -*-
 
+import hmac
 import json
 import logging
 from odoo import http, _
 from odoo.http import request
+from odoo.tools import config
+from ..models.wecom_metrics import metrics
 from ..models.wecom_utils import calculate_signature, decrypt_message, parse_xml_to_dict, is_valid_wecom_ip
 
 _logger = logging.getLogger(__name__)
@@ -71,65 +74,38 @@ class WeComController(http.Controller):
             _logger.error(f"Error handling POST request: {str(e)}")
             return 'Internal server error', 500
 
+    @http.route('/wecom/metrics', type='http', auth='none', csrf=False, methods=['GET'])
+    def wecom_metrics(self, format=None, **kwargs):
+        """
+        Export the in-process API, sync and callback metrics of this worker
+        Prometheus text by default, JSON with ?format=json. The wecom_metrics_token server
+        option must be given as a Bearer token, never in the URL, which access logs record.
+        Without that option the endpoint is disabled: behind a reverse proxy every client
+        looks like a loopback client.
+        """
+        expected = config.get('wecom_metrics_token')
+        if not expected:
+            return request.make_response('Not Found', status=404)
+        authorization = request.httprequest.headers.get('Authorization', '')
+        given = authorization[7:] if authorization.startswith('Bearer ') else ''
+        if not given or not hmac.compare_digest(given.encode(), expected.encode()):
+            return request.make_response('Forbidden', status=403)
+
+        if format == 'json':
+            return request.make_json_response(metrics.to_dict())
+        return request.make_response(metrics.to_prometheus(), headers=[
+            ('Content-Type', 'text/plain; version=0.0.4; charset=utf-8'),
+        ])
+
     def _process_message(self, company, message):
+        """
+        Dispatch a callback message to its handler registered in callback_handlers
+        Batchable callbacks, such as update_user, are queued and applied in bulk by a cron.
+        """
         message_type = message.get('MsgType')
         event = message.get('Event')
 
-        if message_type == 'event':
-            if event == 'change_contact':
-                self._handle_contact_change_event(company, message)
-            elif event == 'change_external_contact':
-                self._handle_external_contact_change_event(company, message)
-            # Add more event handlers as needed
-        elif message_type == 'text':
-            self._handle_text_message(company, message)
-        # Add more message type handlers as needed
-
-    def _handle_contact_change_event(self, company, message):
-        change_type = message.get('ChangeType')
-        if change_type == 'create_user':
-            self._sync_new_user(company, message)
-        elif change_type == 'update_user':
-            self._update_user(company, message)
-        elif change_type == 'delete_user':
-            self._delete_user(company, message)
-        # Add more contact change event handlers as needed
-
-    def _handle_external_contact_change_event(self, company, message):
-        change_type = message.get('ChangeType')
-        if change_type == 'add_external_contact':
-            self._add_external_contact(company, message)
-        elif change_type == 'edit_external_contact':
-            self._edit_external_contact(company, message)
-        elif change_type == 'del_external_contact':
-            self._delete_external_contact(company, message)
-        # Add more external contact change event handlers as needed
-
-    def _handle_text_message(self, company, message):
-        # Process text messages
-        # You might want to create a record, trigger an action, or send a response
-        pass
-
-    def _sync_new_user(self, company, message):
-        # Sync new user to Odoo
-        pass
-
-    def _update_user(self, company, message):
-        # Update existing user in Odoo
-        pass
-
-    def _delete_user(self, company, message):
-        # Handle user deletion in Odoo
-        pass
-
-    def _add_external_contact(self, company, message):
-        # Add new external contact to Odoo
-        pass
-
-    def _edit_external_contact(self, company, message):
-        # Update existing external contact in Odoo
-        pass
-
-    def _delete_external_contact(self, company, message):
-        # Handle external contact deletion in Odoo
-        pass
\ No newline at end of file
+        with metrics.track('callback', company.env.cr, msg_type=message_type or '', event=event or ''):
+            handler = company.env['wecom.callback.event'].dispatch(company, message)
+            if handler is None:
+                _logger.debug(f"Unhandled WeChat Work callback: {message_type}/{event}/{message.get('ChangeType')}")
@@ -0,0 +1,13 @@
+# -*- coding: utf-8 -*-
+
+from odoo import api, SUPERUSER_ID
+
+
+def migrate(cr, version):
+    if not version:
+        return
+    env = api.Environment(cr, SUPERUSER_ID, {})
+    # Flag the GET write APIs of the catalogue
+    env['wecom.api.registry'].init_wecom_apis()
+    # The default workers are data records, add the ones configured beyond them
+    env['wecom.sync.job']._setup_worker_crons()
@@ -1,12 +1,26 @@
 from . import wecom_base
+from . import wecom_config
+from . import wecom_app_type
+from . import wecom_app_category
 from . import wecom_application
+from . import wecom_app_settings
+from . import wecom_app_webhook
+from . import wecom_media
 from . import wecom_department
 from . import wecom_user
 from . import wecom_tag
 from . import wecom_message
+from . import wecom_campaign
+from . import wecom_callback
 from . import wecom_api_service
 from . import wecom_api_error
+from . import wecom_api_log
+from . import wecom_api_stat
 from . import wecom_api_registry
+from . import wecom_sync_profile
+from . import wecom_sync_run
+from . import wecom_sync_job
+from . import wecom_sync_pipeline
 from . import res_config_settings
 from . import res_company
 
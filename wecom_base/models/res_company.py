@@ -1,9 +1,12 @@
 # -*- coding: utf-8 -*-
 
 from odoo import api, fields, models, _
-from odoo.exceptions import ValidationError
+from odoo.exceptions import UserError, ValidationError
 import logging
 
+from .wecom_sync_profile import profiled
+from .wecom_sync_run import COMMIT_CONTEXT_KEY
+
 
 _logger = logging.getLogger(__name__)
 
@@ -54,6 +57,18 @@ class ResCompany(models.Model):
                 if not (company.wecom_corp_id and company.wecom_agent_id and company.wecom_secret):
                     raise ValidationError(_("CorpID, AgentID, and Secret are required for WeChat Work integration."))
 
+    def _get_wecom_application(self):
+        """
+        Get the WeChat Work application used for this company's API calls
+        Prefers the application matching the company AgentID, then the first application of the company.
+        :return: A wecom.application record
+        """
+        self.ensure_one()
+        apps = self.env['wecom.application'].sudo().search([('company_id', '=', self.id)])
+        if not apps:
+            raise ValidationError(_("No WeChat Work application configured for company %s.") % self.name)
+        return apps.filtered(lambda app: str(app.agent_id) == self.wecom_agent_id)[:1] or apps[0]
+
     def action_test_wecom_connection(self):
         self.ensure_one()
         if not self.is_wecom_integrated:
@@ -79,27 +94,44 @@ class ResCompany(models.Model):
         if not self.is_wecom_integrated:
             raise ValidationError(_("WeChat Work integration is not enabled for this company."))
 
-        # TODO: Implement the actual data synchronization
-        # This should sync users, departments, and other relevant data from WeChat Work
-        # For now, we'll just update the last sync time
-
-        self.wecom_last_sync_time = fields.Datetime.now()
+        try:
+            summary = self.env['wecom.sync.pipeline'].sync_company(self)
+        except Exception as e:
+            _logger.error(f"Failed to sync WeChat Work data for company {self.name}: {str(e)}")
+            raise UserError(_("Failed to sync WeChat Work data: %s") % str(e))
+
+        stage_names = {
+            'departments': _("Departments"),
+            'users': _("Users"),
+            'tags': _("Tags"),
+            'tag_members': _("Tag members"),
+        }
+        lines = [
+            _("%(stage)s: %(count)s fetched in %(fetch).2fs, applied in %(apply).2fs") % {
+                'stage': stage_names[stage['stage']],
+                'count': stage['count'],
+                'fetch': stage['fetch_time'],
+                'apply': stage['apply_time'],
+            }
+            for stage in summary['stages']
+        ]
+        lines.append(_("Total: %.2fs") % summary['total_time'])
         return {
             'type': 'ir.actions.client',
             'tag': 'display_notification',
             'params': {
                 'title': _("Synchronization"),
-                'message': _(
-                    "Data synchronization functionality is not fully implemented yet. Last sync time updated."),
-                'sticky': False,
-                'type': 'warning',
+                'message': '\n'.join(lines),
+                'sticky': True,
+                'type': 'success',
             }
         }
 
     @api.model
+    @profiled
     def cron_sync_wecom_data(self):
         companies = self.search([('is_wecom_integrated', '=', True)])
-        for company in companies:
+        for company in companies.with_context(**{COMMIT_CONTEXT_KEY: True}):
             try:
                 company.action_sync_wecom_data()
             except Exception as e:
@@ -109,6 +141,10 @@ class ResCompany(models.Model):
         res = super(ResCompany, self).write(vals)
         if 'is_wecom_integrated' in vals or 'wecom_sync_interval' in vals:
             self._update_wecom_cron()
+        if 'wecom_corp_id' in vals:
+            apps = self.env['wecom.application'].sudo().search([('company_id', 'in', self.ids)])
+            apps.write({'access_token': False, 'token_expiration_time': False})
+            self.env['wecom.api.service']._invalidate_access_token(apps.ids)
         return res
 
     def _update_wecom_cron(self):
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 
 from odoo import api, fields, models
+from .wecom_config import DEFAULT_API_BASE_URL
 
 class ResConfigSettings(models.TransientModel):
     _inherit = 'res.config.settings'
@@ -14,7 +15,7 @@ class ResConfigSettings(models.TransientModel):
     wecom_api_base_url = fields.Char(
         string="WeChat Work API Base URL",
         config_parameter='wecom.api_base_url',
-        default='https://qyapi.weixin.qq.com/cgi-bin/'
+        default=DEFAULT_API_BASE_URL
     )
 
     wecom_enable_user_sync = fields.Boolean(
@@ -42,6 +43,13 @@ class ResConfigSettings(models.TransientModel):
         config_parameter='wecom.enable_message_push'
     )
 
+    wecom_sync_workers = fields.Integer(
+        string="Sync Workers",
+        config_parameter='wecom.sync_workers',
+        default=4,
+        help="Number of sync jobs run at the same time, one worker cron each"
+    )
+
     wecom_log_level = fields.Selection([
         ('error', 'Error'),
         ('warning', 'Warning'),
@@ -52,38 +60,30 @@ class ResConfigSettings(models.TransientModel):
     @api.model
     def get_values(self):
         res = super(ResConfigSettings, self).get_values()
-        get_param = self.env['ir.config_parameter'].sudo().get_param
+        config = self.env['wecom.config']._get_snapshot()
         res.update(
-            wecom_corp_id=get_param('wecom.corp_id'),
-            wecom_agent_id=get_param('wecom.agent_id'),
-            wecom_secret=get_param('wecom.secret'),
-            wecom_token=get_param('wecom.token'),
-            wecom_aes_key=get_param('wecom.aes_key'),
-            wecom_api_base_url=get_param('wecom.api_base_url', 'https://qyapi.weixin.qq.com/cgi-bin/'),
-            wecom_enable_user_sync=get_param('wecom.enable_user_sync', False),
-            wecom_user_sync_interval=int(get_param('wecom.user_sync_interval', 24)),
-            wecom_enable_department_sync=get_param('wecom.enable_department_sync', False),
-            wecom_department_sync_interval=int(get_param('wecom.department_sync_interval', 24)),
-            wecom_enable_message_push=get_param('wecom.enable_message_push', False),
-            wecom_log_level=get_param('wecom.log_level', 'error'),
+            wecom_corp_id=config.corp_id,
+            wecom_agent_id=config.agent_id,
+            wecom_secret=config.secret,
+            wecom_token=config.token,
+            wecom_aes_key=config.aes_key,
+            wecom_api_base_url=config.api_base_url,
+            wecom_enable_user_sync=config.enable_user_sync,
+            wecom_user_sync_interval=config.user_sync_interval,
+            wecom_enable_department_sync=config.enable_department_sync,
+            wecom_department_sync_interval=config.department_sync_interval,
+            wecom_enable_message_push=config.enable_message_push,
+            wecom_log_level=config.log_level,
+            wecom_sync_workers=config.sync_workers,
         )
         return res
 
     def set_values(self):
+        # The config_parameter fields are saved by super(); every changed parameter
+        # clears the ormcache of the wecom.config snapshot
         super(ResConfigSettings, self).set_values()
-        set_param = self.env['ir.config_parameter'].sudo().set_param
-        set_param('wecom.corp_id', self.wecom_corp_id)
-        set_param('wecom.agent_id', self.wecom_agent_id)
-        set_param('wecom.secret', self.wecom_secret)
-        set_param('wecom.token', self.wecom_token)
-        set_param('wecom.aes_key', self.wecom_aes_key)
-        set_param('wecom.api_base_url', self.wecom_api_base_url)
-        set_param('wecom.enable_user_sync', self.wecom_enable_user_sync)
-        set_param('wecom.user_sync_interval', self.wecom_user_sync_interval)
-        set_param('wecom.enable_department_sync', self.wecom_enable_department_sync)
-        set_param('wecom.department_sync_interval', self.wecom_department_sync_interval)
-        set_param('wecom.enable_message_push', self.wecom_enable_message_push)
-        set_param('wecom.log_level', self.wecom_log_level)
+        # Add or archive worker crons for the new worker count
+        self.env['wecom.sync.job']._setup_worker_crons()
 
     @api.onchange('wecom_enable_user_sync')
     def _onchange_wecom_enable_user_sync(self):
@@ -103,13 +103,4 @@ class ResConfigSettings(models.TransientModel):
         }
 
     def action_wecom_sync_now(self):
-        # TODO: Implement immediate sync
-        return {
-            'type': 'ir.actions.client',
-            'tag': 'display_notification',
-            'params': {
-                'title': 'Sync',
-                'message': 'Immediate sync not implemented yet.',
-                'sticky': False,
-            }
-        }
\ No newline at end of file
+        return self.env.company.action_sync_wecom_data()
\ No newline at end of file
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+
+import logging
+
+from odoo import _
+from odoo.exceptions import UserError
+
+_logger = logging.getLogger(__name__)
+
+
+class WeComApiClient(object):
+    """
+    Registry-driven WeChat Work API client
+    Every API registered in wecom.api.registry is available as a method named after it,
+    taking the application id followed by the API parameters as keyword arguments:
+
+        env['wecom.api.service'].client.user_list(app_id, department_id=1, fetch_child=1)
+
+    Method and endpoint are resolved once per registry index build, not per call,
+    required parameters are checked before any HTTP call, and deprecated APIs are
+    transparently routed to their alternative.
+    """
+
+    def __init__(self, service):
+        self._service = service
+        self._methods = {}
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        method = self._methods.get(name)
+        if method is None:
+            method = self._methods[name] = self._bind(name)
+        return method
+
+    def __dir__(self):
+        return sorted(self._service.env['wecom.api.registry']._get_api_index()[0])
+
+    def _bind(self, name):
+        """Build the method calling an API, resolved from the registry index"""
+        descriptor = self._service.env['wecom.api.registry']._resolve_descriptor(name)
+        if not descriptor:
+            raise AttributeError(_("Unknown WeChat Work API: %s") % name)
+        service = self._service
+
+        def call(app_id, **kwargs):
+            missing = [param for param in descriptor.required_params if kwargs.get(param) is None]
+            if missing:
+                raise UserError(_("Missing required parameters for WeChat Work API %(api)s: %(params)s") % {
+                    'api': descriptor.name,
+                    'params': ', '.join(missing),
+                })
+            if descriptor.method == 'GET':
+                return service.call_api(app_id, descriptor.endpoint, method='GET', params=kwargs,
+                                        needs_access_token=descriptor.needs_access_token)
+            return service.call_api(app_id, descriptor.endpoint, method=descriptor.method, data=kwargs,
+                                    needs_access_token=descriptor.needs_access_token)
+
+        call.__name__ = name
+        call.__doc__ = descriptor.description
+        return call
@@ -1,7 +1,10 @@
 # -*- coding: utf-8 -*-
 
+from datetime import timedelta
+
 from odoo import api, fields, models, _
 from odoo.exceptions import UserError
+from .wecom_api_log import purge_rows
 
 class WeComApiError(models.Model):
     _name = 'wecom.api.error'
@@ -15,13 +18,13 @@ class WeComApiError(models.Model):
     api_endpoint = fields.Char(string='API Endpoint')
     request_data = fields.Text(string='Request Data')
     response_data = fields.Text(string='Response Data')
-    create_date = fields.Datetime(string='Error Time', default=fields.Datetime.now, readonly=True)
+    create_date = fields.Datetime(string='Error Time', default=fields.Datetime.now, readonly=True, index=True)
     state = fields.Selection([
         ('new', 'New'),
         ('in_progress', 'In Progress'),
         ('resolved', 'Resolved'),
         ('ignored', 'Ignored')
-    ], string='Status', default='new', required=True)
+    ], string='Status', default='new', required=True, index=True)
     resolution_note = fields.Text(string='Resolution Note')
     user_id = fields.Many2one('res.users', string='Assigned To')
 
@@ -41,27 +44,29 @@ class WeComApiError(models.Model):
     def action_set_ignored(self):
         self.write({'state': 'ignored'})
 
-    @api.model
-    def create(self, vals):
-        record = super(WeComApiError, self).create(vals)
-        self._notify_new_error(record)
-        return record
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super(WeComApiError, self).create(vals_list)
+        self._notify_new_error(records)
+        return records
 
-    def _notify_new_error(self, error):
+    def _notify_new_error(self, errors):
         # 发送通知给管理员或相关用户
         # 这里只是一个示例，你可能需要根据实际情况调整
         admin_group = self.env.ref('base.group_system')
         admin_partners = admin_group.users.mapped('partner_id')
-        error.message_subscribe(partner_ids=admin_partners.ids)
-        error.message_post(
-            body=_("New WeChat Work API error recorded: [%(code)s] %(message)s") % {
-                'code': error.error_code,
-                'message': error.error_message
-            },
-            subject=_("New WeChat Work API Error"),
-            message_type='notification',
-            subtype_xmlid='mail.mt_comment',
-        )
+        # 一次订阅所有新错误
+        errors.message_subscribe(partner_ids=admin_partners.ids)
+        for error in errors:
+            error.message_post(
+                body=_("New WeChat Work API error recorded: [%(code)s] %(message)s") % {
+                    'code': error.error_code,
+                    'message': error.error_message
+                },
+                subject=_("New WeChat Work API Error"),
+                message_type='notification',
+                subtype_xmlid='mail.mt_comment',
+            )
 
     @api.model
     def log_error(self, app, error_code, error_message, api_endpoint, request_data, response_data):
@@ -75,14 +80,41 @@ class WeComApiError(models.Model):
             'response_data': response_data,
         })
 
-    def get_error_statistics(self):
+    def get_error_statistics(self, date_from=None):
+        # Error counts per endpoint over time are served by get_failed_calls_by_endpoint;
+        # this only counts errors per state, optionally for recent errors only
+        domain = [('create_date', '>=', date_from)] if date_from else []
         stats = self.read_group(
-            [],
+            domain,
             ['state'],
             ['state']
         )
         return {item['state']: item['state_count'] for item in stats}
 
+    @api.model
+    def get_failed_calls_by_endpoint(self, date_from=None):
+        """
+        Count the failed API calls per endpoint, read from the wecom.api.stat daily rollups
+        :param date_from: Only count calls from this datetime
+        :return: A dictionary {endpoint: failed calls}
+        """
+        endpoints = {}
+        for stat in self.env['wecom.api.stat'].get_statistics('daily', date_from=date_from):
+            if stat['error_count']:
+                endpoints[stat['endpoint']] = endpoints.get(stat['endpoint'], 0) + stat['error_count']
+        return endpoints
+
+    @api.autovacuum
+    def _gc_closed_errors(self):
+        # Open errors are kept until someone deals with them
+        config = self.env['wecom.config']._get_snapshot()
+        if config.api_error_retention_days <= 0:
+            return
+        cutoff = fields.Datetime.now() - timedelta(days=config.api_error_retention_days)
+        # Deleted through unlink, so their chatter messages and followers go with them
+        purge_rows(self.env, self._table, "state IN ('resolved', 'ignored') AND create_date < %s", [cutoff],
+                   archive=config.api_log_archive, batch_size=1000, model=self._name)
+
 class WeComApiErrorResolve(models.TransientModel):
     _name = 'wecom.api.error.resolve'
     _description = 'Resolve WeChat Work API Error'
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+
+import gzip
+import json
+import logging
+import os
+import threading
+from datetime import timedelta
+
+from odoo import api, fields, models, tools
+
+_logger = logging.getLogger(__name__)
+
+PURGE_BATCH_SIZE = 10000
+
+
+def _auto_commit(cr):
+    """Commit between batches unless running inside the test suite"""
+    if not getattr(threading.current_thread(), 'testing', False):
+        cr.commit()
+
+
+def _archive_rows(env, table, rows):
+    """
+    Append rows to a gzip-compressed JSON-lines archive
+    One file per table and day, stored under the data directory of the database.
+    :param env: Odoo environment
+    :param table: The table the rows come from
+    :param rows: The rows to archive, as dictionaries
+    """
+    archive_dir = os.path.join(tools.config['data_dir'], 'wecom_archive', env.cr.dbname, table)
+    os.makedirs(archive_dir, exist_ok=True)
+    path = os.path.join(archive_dir, f"{fields.Date.to_string(fields.Date.today())}.jsonl.gz")
+    # gzip members can be concatenated, so appending keeps the file readable
+    with gzip.open(path, 'at', encoding='utf-8') as archive:
+        for row in rows:
+            archive.write(json.dumps(row, default=str, ensure_ascii=False))
+            archive.write('\n')
+
+
+def purge_rows(env, table, where_clause, params, archive=False, batch_size=PURGE_BATCH_SIZE, model=None):
+    """
+    Delete rows matching a condition in batches, optionally archiving them first
+    Each batch is committed separately so a large purge never holds long locks.
+    :param env: Odoo environment
+    :param table: The table to purge
+    :param where_clause: SQL condition selecting the rows to delete
+    :param params: Parameters for the condition
+    :param archive: Whether to archive the rows to compressed files before deletion
+    :param batch_size: Number of rows deleted per batch
+    :param model: Delete the rows through this model's unlink instead of SQL, for models whose
+                  records own other rows (chatter messages, followers, attachments)
+    :return: The number of deleted rows
+    """
+    cr = env.cr
+    total = 0
+    while True:
+        cr.execute(f"SELECT id FROM {table} WHERE {where_clause} ORDER BY id LIMIT %s", params + [batch_size])
+        ids = [row[0] for row in cr.fetchall()]
+        if not ids:
+            break
+        if archive:
+            cr.execute(f"SELECT * FROM {table} WHERE id = ANY(%s) ORDER BY id", [ids])
+            _archive_rows(env, table, cr.dictfetchall())
+        if model:
+            env[model].browse(ids).unlink()
+        else:
+            cr.execute(f"DELETE FROM {table} WHERE id = ANY(%s)", [ids])
+        total += len(ids)
+        _auto_commit(cr)
+    if total:
+        _logger.info(f"Purged {total} rows from {table}")
+    return total
+
+
+class WeComApiLog(models.Model):
+    """
+    WeChat Work API Call Log
+    One lightweight row per API call, used to maintain the hourly and daily rollups.
+    Rows older than the retention period are purged by the autovacuum.
+    """
+    _name = 'wecom.api.log'
+    _description = 'WeChat Work API Call Log'
+    _order = 'call_time desc, id desc'
+    _log_access = False
+
+    api_name = fields.Char(string='API Name')
+    app_id = fields.Many2one('wecom.application', string='WeChat Work App', ondelete='set null')
+    endpoint = fields.Char(string='API Endpoint', index=True)
+    method = fields.Char(string='HTTP Method')
+    errcode = fields.Integer(string='Error Code', help="WeChat Work errcode, -1 for network errors")
+    duration_ms = fields.Float(string='Duration (ms)')
+    request_bytes = fields.Integer(string='Request Size')
+    response_bytes = fields.Integer(string='Response Size')
+    params = fields.Text(string='Parameters')
+    response = fields.Text(string='Response')
+    call_time = fields.Datetime(string='Call Time', default=fields.Datetime.now, index=True)
+
+    @api.model
+    def _record_call(self, vals):
+        """
+        Record an API call
+        Failed calls are written through a separate cursor, since the caller usually
+        rolls back its transaction after the error is raised.
+        :param vals: The values of the log row
+        """
+        vals.setdefault('call_time', fields.Datetime.now())
+        if vals.get('errcode') == 0:
+            return self.sudo().create(vals)
+        with self.pool.cursor() as cr:
+            self.with_env(self.env(cr=cr, su=True)).create(vals)
+
+    @api.autovacuum
+    def _gc_api_logs(self):
+        """Roll up closed periods, then purge logs older than the retention period"""
+        self.env['wecom.api.stat']._update_rollups()
+        config = self.env['wecom.config']._get_snapshot()
+        if config.api_log_retention_days <= 0:
+            return
+        cutoff = fields.Datetime.now() - timedelta(days=config.api_log_retention_days)
+        purge_rows(self.env, self._table, "call_time < %s", [cutoff], archive=config.api_log_archive)
@@ -1,8 +1,128 @@
 # -*- coding: utf-8 -*-
 
-from odoo import api, fields, models, _
+import logging
+import re
+from collections import namedtuple
+
+from odoo import api, fields, models, tools, _
 from odoo.exceptions import ValidationError
 
+_logger = logging.getLogger(__name__)
+
+# Compiled, immutable view of a registry record, shared by every request of the worker
+ApiDescriptor = namedtuple('ApiDescriptor', [
+    'id', 'name', 'endpoint', 'method', 'description', 'required_params', 'optional_params',
+    'response_format', 'is_deprecated', 'deprecated_reason', 'alternative_api', 'category',
+    'version', 'rate_limit', 'needs_access_token', 'is_cacheable', 'cache_ttl', 'is_write',
+])
+
+# Deprecated APIs already reported by this process, (database, API name)
+_reported_deprecations = set()
+
+_TOKEN_SPLIT = re.compile(r'[^0-9a-z]+')
+_PARAM_SPLIT = re.compile(r'[\s,;]+')
+
+
+def _tokenize(text):
+    return [token for token in _TOKEN_SPLIT.split((text or '').lower()) if token]
+
+
+def _split_params(text):
+    return tuple(param for param in _PARAM_SPLIT.split(text or '') if param)
+
+
+def _catalogue_entry(name, endpoint, method, category, description, required_params='', **extra):
+    return dict(name=name, endpoint=endpoint, method=method, category=category, description=description,
+                required_params=required_params or False, **extra)
+
+
+# APIs registered by init_wecom_apis, see https://developer.work.weixin.qq.com/document/path/90664
+WECOM_API_CATALOGUE = [
+    # Base
+    _catalogue_entry('get_access_token', 'gettoken', 'GET', 'base', 'Get access token for WeChat Work API',
+                     'corpid, corpsecret', needs_access_token=False),
+    _catalogue_entry('get_api_domain_ip', 'get_api_domain_ip', 'GET', 'base',
+                     'Get the IP ranges of the WeChat Work API servers',
+                     is_cacheable=True, cache_ttl=3600),
+    _catalogue_entry('getcallbackip', 'getcallbackip', 'GET', 'base',
+                     'Get the IP ranges WeChat Work sends callbacks from',
+                     is_cacheable=True, cache_ttl=3600),
+    # Users
+    _catalogue_entry('user_create', 'user/create', 'POST', 'user', 'Create a member', 'userid, name'),
+    _catalogue_entry('user_get', 'user/get', 'GET', 'user', 'Read a member', 'userid',
+                     is_cacheable=True, cache_ttl=60),
+    _catalogue_entry('user_update', 'user/update', 'POST', 'user', 'Update a member', 'userid'),
+    _catalogue_entry('user_delete', 'user/delete', 'GET', 'user', 'Delete a member', 'userid',
+                     is_write=True),
+    _catalogue_entry('user_batchdelete', 'user/batchdelete', 'POST', 'user', 'Delete several members',
+                     'useridlist'),
+    _catalogue_entry('user_simplelist', 'user/simplelist', 'GET', 'user',
+                     'List the members of a department (userid and name only)', 'department_id',
+                     is_cacheable=True, cache_ttl=60),
+    _catalogue_entry('user_list', 'user/list', 'GET', 'user', 'List the members of a department with details',
+                     'department_id', is_cacheable=True, cache_ttl=30),
+    _catalogue_entry('user_list_id', 'user/list_id', 'POST', 'user',
+                     'List the userids of all members, paginated by cursor'),
+    _catalogue_entry('user_convert_to_openid', 'user/convert_to_openid', 'POST', 'user',
+                     'Convert a userid to an openid', 'userid'),
+    _catalogue_entry('user_convert_to_userid', 'user/convert_to_userid', 'POST', 'user',
+                     'Convert an openid to a userid', 'openid'),
+    _catalogue_entry('user_authsucc', 'user/authsucc', 'GET', 'user', 'Confirm the second-step authentication',
+                     'userid', is_write=True),
+    _catalogue_entry('user_getuserid', 'user/getuserid', 'POST', 'user', 'Get a userid by mobile number',
+                     'mobile'),
+    _catalogue_entry('user_get_userid_by_email', 'user/get_userid_by_email', 'POST', 'user',
+                     'Get a userid by email', 'email'),
+    _catalogue_entry('batch_invite', 'batch/invite', 'POST', 'user', 'Invite members to join WeChat Work'),
+    # Departments
+    _catalogue_entry('department_create', 'department/create', 'POST', 'department', 'Create a department',
+                     'name, parentid'),
+    _catalogue_entry('department_update', 'department/update', 'POST', 'department', 'Update a department',
+                     'id'),
+    _catalogue_entry('department_delete', 'department/delete', 'GET', 'department', 'Delete a department',
+                     'id', is_write=True),
+    _catalogue_entry('department_list', 'department/list', 'GET', 'department',
+                     'List a department and its sub-departments with details',
+                     is_cacheable=True, cache_ttl=60),
+    _catalogue_entry('department_simplelist', 'department/simplelist', 'GET', 'department',
+                     'List the ids of a department and its sub-departments',
+                     is_cacheable=True, cache_ttl=60),
+    _catalogue_entry('department_get', 'department/get', 'GET', 'department', 'Read a department', 'id',
+                     is_cacheable=True, cache_ttl=60),
+    # Tags
+    _catalogue_entry('tag_create', 'tag/create', 'POST', 'tag', 'Create a tag', 'tagname'),
+    _catalogue_entry('tag_update', 'tag/update', 'POST', 'tag', 'Rename a tag', 'tagid, tagname'),
+    _catalogue_entry('tag_delete', 'tag/delete', 'GET', 'tag', 'Delete a tag', 'tagid', is_write=True),
+    _catalogue_entry('tag_get', 'tag/get', 'GET', 'tag', 'List the members of a tag', 'tagid',
+                     is_cacheable=True, cache_ttl=60),
+    _catalogue_entry('tag_addtagusers', 'tag/addtagusers', 'POST', 'tag',
+                     'Add members and departments to a tag', 'tagid'),
+    _catalogue_entry('tag_deltagusers', 'tag/deltagusers', 'POST', 'tag',
+                     'Remove members and departments from a tag', 'tagid'),
+    _catalogue_entry('tag_list', 'tag/list', 'GET', 'tag', 'List all tags',
+                     is_cacheable=True, cache_ttl=60),
+    # Messages
+    _catalogue_entry('send_text_message', 'message/send', 'POST', 'message',
+                     'Send a text message to WeChat Work users', 'msgtype, agentid'),
+    _catalogue_entry('message_send', 'message/send', 'POST', 'message', 'Send an application message',
+                     'msgtype, agentid'),
+    _catalogue_entry('message_recall', 'message/recall', 'POST', 'message', 'Recall an application message',
+                     'msgid'),
+    _catalogue_entry('message_update_taskcard', 'message/update_taskcard', 'POST', 'message',
+                     'Update the buttons of a task card message', 'userids, agentid, task_id, clicked_key'),
+    _catalogue_entry('message_update_template_card', 'message/update_template_card', 'POST', 'message',
+                     'Update a template card message', 'agentid, response_code'),
+    _catalogue_entry('message_get_statistics', 'message/get_statistics', 'POST', 'message',
+                     'Get the message sending statistics of the applications'),
+    _catalogue_entry('appchat_create', 'appchat/create', 'POST', 'message', 'Create a group chat', 'userlist'),
+    _catalogue_entry('appchat_update', 'appchat/update', 'POST', 'message', 'Update a group chat', 'chatid'),
+    _catalogue_entry('appchat_get', 'appchat/get', 'GET', 'message', 'Read a group chat', 'chatid',
+                     is_cacheable=True, cache_ttl=60),
+    _catalogue_entry('appchat_send', 'appchat/send', 'POST', 'message', 'Send a message to a group chat',
+                     'chatid, msgtype'),
+]
+
+
 class WeComApiRegistry(models.Model):
     _name = 'wecom.api.registry'
     _description = 'WeChat Work API Registry'
@@ -29,6 +149,7 @@ class WeComApiRegistry(models.Model):
         ('message', 'Message'),
         ('department', 'Department'),
         ('user', 'User'),
+        ('tag', 'Tag'),
         ('media', 'Media'),
         ('oauth', 'OAuth'),
         ('external_contact', 'External Contact'),
@@ -38,6 +159,13 @@ class WeComApiRegistry(models.Model):
     rate_limit = fields.Char(string='Rate Limit', help="Rate limit information for the API")
     needs_access_token = fields.Boolean(string='Needs Access Token', default=True,
                                         help="Whether this API requires an access token")
+    is_cacheable = fields.Boolean(string='Cacheable', default=False,
+                                  help="Cache the responses of this read-only GET API in each worker")
+    cache_ttl = fields.Integer(string='Cache TTL (s)', default=60,
+                               help="Seconds a cached response is served before it is fetched again")
+    is_write = fields.Boolean(string='Write API', default=False,
+                              help="This GET API changes data: cached responses of its family are dropped "
+                                   "after a call, as after any POST API")
 
     _sql_constraints = [
         ('name_unique', 'UNIQUE(name)', 'API name must be unique!')
@@ -58,9 +186,124 @@ class WeComApiRegistry(models.Model):
             result.append((record.id, name))
         return result
 
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super(WeComApiRegistry, self).create(vals_list)
+        self.clear_caches()
+        return records
+
+    def write(self, vals):
+        res = super(WeComApiRegistry, self).write(vals)
+        self.clear_caches()
+        return res
+
+    def unlink(self):
+        res = super(WeComApiRegistry, self).unlink()
+        self.clear_caches()
+        return res
+
+    @api.model
+    @tools.ormcache()
+    def _get_api_index(self):
+        """
+        Build the in-memory index of the registry
+        :return: A tuple (descriptors by name, names by lowercase token, lowercase haystack by name)
+        """
+        self.flush_model()
+        self.env.cr.execute("""
+            SELECT api.id, api.name, api.endpoint, api.method, api.description, api.required_params,
+                   api.optional_params, api.response_format, api.is_deprecated, api.deprecated_reason,
+                   alt.name, api.category, api.version, api.rate_limit, api.needs_access_token,
+                   api.is_cacheable, api.cache_ttl, api.is_write
+              FROM wecom_api_registry api
+         LEFT JOIN wecom_api_registry alt ON alt.id = api.alternative_api_id
+          ORDER BY api.name
+        """)
+        descriptors = {}
+        tokens = {}
+        haystacks = {}
+        for row in self.env.cr.fetchall():
+            descriptor = ApiDescriptor(*row)._replace(
+                required_params=_split_params(row[5]),
+                optional_params=_split_params(row[6]),
+                alternative_api=row[10] or False,
+            )
+            descriptors[descriptor.name] = descriptor
+            haystacks[descriptor.name] = '\0'.join(
+                (descriptor.name or '', descriptor.description or '', descriptor.endpoint or '')).lower()
+            for token in _tokenize(haystacks[descriptor.name]):
+                tokens.setdefault(token, set()).add(descriptor.name)
+        tokens = {token: frozenset(names) for token, names in tokens.items()}
+        return descriptors, tokens, haystacks
+
+    @api.model
+    @tools.ormcache()
+    def _get_cacheable_endpoints(self):
+        """
+        Get the endpoints whose GET responses are cached
+        :return: A dictionary {endpoint: time to live in seconds}
+        """
+        return {
+            descriptor.endpoint: descriptor.cache_ttl
+            for descriptor in self._get_api_index()[0].values()
+            if descriptor.is_cacheable and descriptor.method == 'GET' and descriptor.cache_ttl > 0
+        }
+
+    @api.model
+    @tools.ormcache()
+    def _get_write_endpoints(self):
+        """
+        Get the GET endpoints that change data, their calls invalidate cached responses like POST calls
+        :return: A frozenset of endpoints
+        """
+        return frozenset(
+            descriptor.endpoint
+            for descriptor in self._get_api_index()[0].values()
+            if descriptor.is_write and descriptor.method == 'GET'
+        )
+
+    @api.model
+    def _get_descriptor(self, api_name):
+        """Get the compiled descriptor of an API by name, served from memory"""
+        return self._get_api_index()[0].get(api_name)
+
+    @api.model
+    @tools.ormcache()
+    def _get_resolved_apis(self):
+        """
+        Resolve every API once per index build, following alternatives of deprecated APIs
+        :return: A dictionary {API name: (descriptor to call, names of the deprecated APIs followed)}
+        """
+        descriptors = self._get_api_index()[0]
+        resolved = {}
+        for api_name in descriptors:
+            descriptor = descriptors[api_name]
+            followed = []
+            while descriptor and descriptor.is_deprecated and descriptor.alternative_api:
+                if descriptor.name in followed:
+                    raise ValidationError(_("Circular alternative APIs for %s.") % api_name)
+                followed.append(descriptor.name)
+                descriptor = descriptors.get(descriptor.alternative_api)
+            resolved[api_name] = (descriptor, tuple(followed))
+        return resolved
+
+    @api.model
+    def _resolve_descriptor(self, api_name):
+        """
+        Get the descriptor to call for an API, following alternatives of deprecated APIs
+        The use of a deprecated API is logged once per process.
+        :param api_name: Name of the API
+        :return: The descriptor of the API or of its non-deprecated alternative, None if unknown
+        """
+        descriptor, followed = self._get_resolved_apis().get(api_name, (None, ()))
+        if followed and (self.env.cr.dbname, api_name) not in _reported_deprecations:
+            _reported_deprecations.add((self.env.cr.dbname, api_name))
+            _logger.warning(f"WeChat Work API {api_name} is deprecated, using {descriptor and descriptor.name} instead")
+        return descriptor
+
     @api.model
     def get_api_details(self, api_name):
-        api = self.search([('name', '=', api_name)], limit=1)
+        api = self._get_descriptor(api_name)
         if not api:
             return False
         return {
@@ -68,16 +311,19 @@ class WeComApiRegistry(models.Model):
             'endpoint': api.endpoint,
             'method': api.method,
             'description': api.description,
-            'required_params': api.required_params,
-            'optional_params': api.optional_params,
+            'required_params': '\n'.join(api.required_params) or False,
+            'optional_params': '\n'.join(api.optional_params) or False,
             'response_format': api.response_format,
             'is_deprecated': api.is_deprecated,
             'deprecated_reason': api.deprecated_reason,
-            'alternative_api': api.alternative_api_id.name if api.alternative_api_id else False,
+            'alternative_api': api.alternative_api,
             'category': api.category,
             'version': api.version,
             'rate_limit': api.rate_limit,
             'needs_access_token': api.needs_access_token,
+            'is_cacheable': api.is_cacheable,
+            'cache_ttl': api.cache_ttl,
+            'is_write': api.is_write,
         }
 
     @api.model
@@ -108,11 +354,21 @@ class WeComApiRegistry(models.Model):
 
     @api.model
     def search_apis(self, keyword):
-        return self.search([
-            '|', '|',
-            ('name', 'ilike', keyword),
-            ('description', 'ilike', keyword),
-            ('endpoint', 'ilike', keyword)
+        # Same matches as an ilike on name, description and endpoint, without touching the table:
+        # each alphanumeric run of the keyword lies inside one token of a matching API
+        descriptors, tokens, haystacks = self._get_api_index()
+        keyword = (keyword or '').lower()
+        parts = _tokenize(keyword)
+        if parts:
+            longest = max(parts, key=len)
+            candidates = set()
+            for token, names in tokens.items():
+                if longest in token:
+                    candidates |= names
+        else:
+            candidates = haystacks.keys()
+        return self.browse([
+            descriptors[name].id for name in sorted(candidates) if keyword in haystacks[name]
         ])
 
     def copy(self, default=None):
@@ -123,26 +379,17 @@ class WeComApiRegistry(models.Model):
     @api.model
     def init_wecom_apis(self):
         # This method can be called to initialize or update the API registry
-        apis_to_register = [
-            {
-                'name': 'get_access_token',
-                'endpoint': 'gettoken',
-                'method': 'GET',
-                'description': 'Get access token for WeChat Work API',
-                'category': 'base',
-                'needs_access_token': False,
-            },
-            {
-                'name': 'send_text_message',
-                'endpoint': 'message/send',
-                'method': 'POST',
-                'description': 'Send a text message to WeChat Work users',
-                'category': 'message',
-            },
-            # Add more APIs here
-        ]
-        for api in apis_to_register:
-            self.register_api(api)
+        names = [vals['name'] for vals in WECOM_API_CATALOGUE]
+        existing = {api.name: api for api in self.search([('name', 'in', names)])}
+        to_create = []
+        for vals in WECOM_API_CATALOGUE:
+            api = existing.get(vals['name'])
+            if not api:
+                to_create.append(vals)
+            elif any(api[field] != value for field, value in vals.items()):
+                api.write(vals)
+        if to_create:
+            self.create(to_create)
 
     def action_view_api_calls(self):
         # This method could be used to view API calls related to this API
@@ -1,91 +1,209 @@
 # -*- coding: utf-8 -*-
 
-import requests
 import json
 import logging
-from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import timedelta
 from odoo import api, fields, models, _
 from odoo.exceptions import UserError
+from .wecom_api_client import WeComApiClient
+from .wecom_cache import response_cache, token_cache
+from .wecom_http import (
+    DEFAULT_LANE, LANE_WEIGHTS, WeComHttpError, WeComResponseError, get_rate_limiter, make_session, send_request,
+    send_with_retry,
+)
+from .wecom_metrics import metrics
 
 _logger = logging.getLogger(__name__)
 
+# 令牌无效 / 令牌过期
+TOKEN_ERRCODES = (40014, 42001)
+# 提前刷新令牌的秒数
+TOKEN_EXPIRY_MARGIN = 300
+# 接口调用超过频率限制
+THROTTLED_ERRCODE = 45009
+
 
 class WeComApiService(models.AbstractModel):
     _name = 'wecom.api.service'
     _description = 'WeChat Work API Service'
 
+    @property
+    def client(self):
+        """
+        基于 API 注册表的 WeChat Work API 客户端，如 service.client.user_list(app_id, department_id=1)
+        API 的解析结果缓存在注册表索引中，读取客户端不会重复解析
+        """
+        return WeComApiClient(self)
+
     @api.model
     def _get_access_token(self, app_id):
         """
         获取访问令牌
+        优先使用进程内令牌缓存，其次使用数据库中未过期的令牌，最后向企业微信请求新令牌
         :param app_id: WeChat Work 应用的ID
         :return: 访问令牌
         """
-        app = self.env['wecom.application'].browse(app_id)
-        if not app:
+        dbname = self.env.cr.dbname
+        access_token = token_cache.get(dbname, app_id)
+        if access_token:
+            return access_token
+
+        app = self.env['wecom.application'].sudo().browse(app_id)
+        if not app.exists():
             raise UserError(_("WeChat Work application not found."))
 
-        if app.access_token and app.token_expiration_time > fields.Datetime.now():
-            return app.access_token
+        now = fields.Datetime.now()
+        if app.access_token and app.token_expiration_time and app.token_expiration_time > now:
+            ttl = (app.token_expiration_time - now).total_seconds() - TOKEN_EXPIRY_MARGIN
+            if ttl > 0:
+                token_cache.set(dbname, app_id, app.access_token, ttl=ttl)
+                return app.access_token
 
-        url = "https://qyapi.weixin.qq.com/cgi-bin/gettoken"
+        url = self._get_api_url("gettoken")
         params = {
             "corpid": app.company_id.wecom_corp_id,
             "corpsecret": app.secret
         }
 
         try:
-            response = requests.get(url, params=params)
-            response.raise_for_status()
-            result = response.json()
+            result, _stats = send_request(url, params=params)
 
             if result.get("errcode") == 0:
                 access_token = result.get("access_token")
                 expires_in = result.get("expires_in", 7200)
+                # 令牌字段的写入不会清除任何缓存，见 wecom.application 的 write
                 app.write({
                     'access_token': access_token,
-                    'token_expiration_time': fields.Datetime.now() + timedelta(seconds=expires_in)
+                    'token_expiration_time': now + timedelta(seconds=expires_in)
                 })
+                token_cache.set(dbname, app_id, access_token, ttl=max(expires_in - TOKEN_EXPIRY_MARGIN, 0))
                 return access_token
             else:
                 raise UserError(_("Failed to get access token: %s") % result.get("errmsg"))
-        except requests.RequestException as e:
+        except WeComHttpError as e:
             _logger.error("Error while getting access token: %s", str(e))
             raise UserError(_("Network error while getting access token."))
 
     @api.model
-    def call_api(self, app_id, endpoint, method='GET', params=None, data=None):
+    def _get_api_url(self, endpoint):
+        """
+        获取 API 的完整 URL，基于配置的 API 基础地址（可指向本地模拟服务器）
+        :param endpoint: API 端点
+        :return: 完整 URL
+        """
+        base_url = self.env['wecom.config']._get_snapshot().api_base_url
+        return f"{base_url.rstrip('/')}/{endpoint}"
+
+    @api.model
+    def _get_rate_limiter(self, app_id):
+        """
+        获取应用的限流器，进程内同一应用（agent）的所有调用共用 wecom.api_rate_limit 的额度
+        :param app_id: WeChat Work 应用的ID
+        :return: wecom_http.RateLimiter
+        """
+        rate = self.env['wecom.config']._get_snapshot().api_rate_limit
+        return get_rate_limiter((self.env.cr.dbname, app_id), rate)
+
+    @api.model
+    def _get_lane(self):
+        """
+        获取当前调用的优先级通道，由上下文键 wecom_lane 指定
+        interactive（默认）：用户操作；alerting：告警消息；bulk：批量发送；sync：同步任务
+        :return: LANE_WEIGHTS 中的通道名
+        """
+        lane = self.env.context.get('wecom_lane') or DEFAULT_LANE
+        if lane not in LANE_WEIGHTS:
+            raise UserError(_("Unknown WeChat Work priority lane: %s") % lane)
+        return lane
+
+    @api.model
+    def _invalidate_access_token(self, app_ids):
+        """
+        使应用的访问令牌失效，仅影响这些应用
+        :param app_ids: WeChat Work 应用的ID列表
+        """
+        dbname = self.env.cr.dbname
+        for app_id in app_ids:
+            token_cache.invalidate(dbname, app_id)
+
+    @api.model
+    def call_api(self, app_id, endpoint, method='GET', params=None, data=None, needs_access_token=True):
         """
         调用 WeChat Work API
+        令牌无效或过期时（其他进程已刷新令牌等），清除缓存的令牌并重试一次。
+        注册表中标记为可缓存的 GET 接口的响应在进程内缓存 cache_ttl 秒，见 wecom_cache.ResponseCache
         :param app_id: WeChat Work 应用的ID
         :param endpoint: API 端点
         :param method: HTTP 方法 ('GET' 或 'POST')
         :param params: URL 参数
         :param data: POST 数据
+        :param needs_access_token: 是否需要附加访问令牌
         :return: API 响应
         """
-        access_token = self._get_access_token(app_id)
-        url = f"https://qyapi.weixin.qq.com/cgi-bin/{endpoint}"
-        headers = {'Content-Type': 'application/json'}
+        params = dict(params or {})
+        dbname = self.env.cr.dbname
+        ttl = method.upper() == 'GET' and self.env['wecom.api.registry']._get_cacheable_endpoints().get(endpoint)
+        cache_size = self.env['wecom.config']._get_snapshot().api_cache_size
+        if ttl and cache_size > 0:
+            # 同一进程内相同的并发请求合并为一次调用；缓存大小在加载配置快照时设置，见 wecom.config
+            key = (app_id, endpoint, json.dumps(params, sort_keys=True, default=str))
+            result, status = response_cache.get_or_fetch(
+                dbname, key, ttl,
+                lambda: self._call_api(app_id, endpoint, method, params, data, needs_access_token))
+            metrics.inc('api_cache_total', endpoint=endpoint, result=status)
+            return result
+        result = self._call_api(app_id, endpoint, method, params, data, needs_access_token)
+        if self._is_write_call(endpoint, method):
+            self._invalidate_responses(app_id, endpoint)
+        return result
 
-        if params is None:
-            params = {}
-        params['access_token'] = access_token
+    @api.model
+    def _is_write_call(self, endpoint, method):
+        """
+        调用是否可能修改数据：POST 接口，以及注册表中标记为写接口的 GET 接口（如 user/delete）
+        :param endpoint: API 端点
+        :param method: HTTP 方法
+        """
+        return method.upper() != 'GET' or endpoint in self.env['wecom.api.registry']._get_write_endpoints()
 
-        try:
-            if method.upper() == 'GET':
-                response = requests.get(url, params=params, headers=headers)
-            elif method.upper() == 'POST':
-                response = requests.post(url, params=params, data=json.dumps(data), headers=headers)
-            else:
-                raise UserError(_("Unsupported HTTP method: %s") % method)
+    @api.model
+    def _invalidate_responses(self, app_id, endpoint):
+        """
+        调用写接口后，丢弃该应用同类接口（如 user/*）的缓存响应
+        其他进程的缓存响应在过期后更新
+        :param app_id: WeChat Work 应用的ID
+        :param endpoint: 调用的 API 端点
+        """
+        family = endpoint.split('/')[0]
+        response_cache.invalidate(self.env.cr.dbname,
+                                  lambda key: key[0] == app_id and key[1].split('/')[0] == family)
 
-            response.raise_for_status()
-            result = response.json()
+    def _call_api(self, app_id, endpoint, method, params, data, needs_access_token):
+        """
+        调用 WeChat Work API，不经过响应缓存，参数见 call_api
+        """
+        params = dict(params)
+        # 耗时和 SQL 查询数包含令牌获取和重试
+        with metrics.track('api_call', self.env.cr, endpoint=endpoint):
+            for attempt in range(2):
+                if needs_access_token:
+                    params['access_token'] = self._get_access_token(app_id)
+                result = self._send_request(app_id, endpoint, method, params, data)
 
-            if result.get("errcode") == 0:
-                return result
-            else:
+                if result.get("errcode") == 0:
+                    return result
+                if result.get("errcode") == THROTTLED_ERRCODE:
+                    metrics.inc('api_throttled_total', endpoint=endpoint)
+                if needs_access_token and attempt == 0 and result.get("errcode") in TOKEN_ERRCODES:
+                    _logger.info("WeChat Work access token rejected for app %s, refreshing", app_id)
+                    metrics.inc('api_retries_total', endpoint=endpoint, reason='token')
+                    self._invalidate_access_token([app_id])
+                    self.env['wecom.application'].sudo().browse(app_id).write({
+                        'access_token': False,
+                        'token_expiration_time': False,
+                    })
+                    continue
                 error_msg = _("WeChat Work API Error: [%(code)s] %(msg)s") % {
                     'code': result.get("errcode"),
                     'msg': result.get("errmsg")
@@ -93,9 +211,173 @@ class WeComApiService(models.AbstractModel):
                 _logger.error(error_msg)
                 raise UserError(error_msg)
 
-        except requests.RequestException as e:
+    @api.model
+    def call_api_many(self, app_id, requests, method='GET', stream=False):
+        """
+        并发调用多个 WeChat Work API
+        所有请求共用一个访问令牌、连接池和应用的限流器，并发数为 wecom.api_max_workers；
+        系统繁忙、超过频率限制和网络错误时按退避策略重试，令牌失效的请求在刷新令牌后重试一次。
+        单个请求的失败不影响其他请求。请求在限流器中使用当前上下文的优先级通道，见 _get_lane。
+        :param app_id: WeChat Work 应用的ID
+        :param requests: (端点, URL 参数) 或 (端点, URL 参数, POST 数据) 列表
+        :param method: HTTP 方法 ('GET' 或 'POST')
+        :param stream: 为 True 时返回生成器，按完成顺序产生 (序号, API 响应, 异常)
+        :return: 与 requests 顺序一致的 (API 响应, 异常) 列表，成功时异常为 None；
+                 失败时异常为 WeComResponseError 或 WeComHttpError
+        """
+        method = method.upper()
+        if method not in ('GET', 'POST'):
+            raise UserError(_("Unsupported HTTP method: %s") % method)
+        calls = self._iter_api_many(app_id, requests, method)
+        if stream:
+            return calls
+        results = [(None, None)] * len(requests)
+        for index, result, error in calls:
+            results[index] = (result, error)
+        return results
+
+    def _iter_api_many(self, app_id, requests, method):
+        """
+        call_api_many 的实现，按完成顺序产生 (序号, API 响应, 异常)
+        HTTP 请求在线程池中发送，调用日志和指标在当前线程中记录
+        """
+        pending = [(index, request[0], dict(request[1] or {}), request[2] if len(request) > 2 else None)
+                   for index, request in enumerate(requests)]
+        if not pending:
+            return
+        config = self.env['wecom.config']._get_snapshot()
+        limiter = self._get_rate_limiter(app_id)
+        lane = self._get_lane()
+        session = make_session(config.api_max_workers)
+        try:
+            for attempt in range(2):
+                access_token = self._get_access_token(app_id)
+                rejected = []
+                executor = ThreadPoolExecutor(max_workers=max(1, min(config.api_max_workers, len(pending))))
+                try:
+                    futures = {}
+                    for call in pending:
+                        _index, endpoint, params, data = call
+                        future = executor.submit(send_with_retry, self._get_api_url(endpoint), method,
+                                                 dict(params, access_token=access_token), data, session, limiter,
+                                                 lane=lane)
+                        futures[future] = call
+                    for future in as_completed(futures):
+                        index, endpoint, params, data = call = futures[future]
+                        result, attempts, error = future.result()
+                        # 与 call_api 一致：只有写接口的调用丢弃同类缓存响应
+                        if self._is_write_call(endpoint, method):
+                            self._invalidate_responses(app_id, endpoint)
+                        for stats in attempts:
+                            self._record_http_call(app_id, endpoint, method, stats, params, data, result)
+                        for stats in attempts[1:]:
+                            reason = 'throttled' if stats.get('errcode') == THROTTLED_ERRCODE else 'busy'
+                            metrics.inc('api_retries_total', endpoint=endpoint, reason=reason)
+                        if error is None and result.get('errcode') != 0:
+                            if attempt == 0 and result.get('errcode') in TOKEN_ERRCODES:
+                                rejected.append(call)
+                                continue
+                            error = WeComResponseError(endpoint, result)
+                        yield index, result if error is None else None, error
+                finally:
+                    executor.shutdown(wait=True, cancel_futures=True)
+                if not rejected:
+                    break
+                _logger.info("WeChat Work access token rejected for app %s, refreshing", app_id)
+                self._invalidate_access_token([app_id])
+                self.env['wecom.application'].sudo().browse(app_id).write({
+                    'access_token': False,
+                    'token_expiration_time': False,
+                })
+                pending = rejected
+        finally:
+            session.close()
+
+    def _send_request(self, app_id, endpoint, method, params, data):
+        """
+        发送 HTTP 请求并记录调用日志
+        :param app_id: WeChat Work 应用的ID
+        :param endpoint: API 端点
+        :param method: HTTP 方法 ('GET' 或 'POST')
+        :param params: URL 参数
+        :param data: POST 数据
+        :return: 解析后的 API 响应
+        """
+        url = self._get_api_url(endpoint)
+        method = method.upper()
+        if method not in ('GET', 'POST'):
+            raise UserError(_("Unsupported HTTP method: %s") % method)
+
+        lane = self._get_lane()
+        wait = self._get_rate_limiter(app_id).acquire(lane)
+        metrics.observe('api_queue_wait_ms', wait * 1000, lane=lane)
+
+        result = None
+        stats = {}
+        try:
+            result, stats = send_request(url, method, params=params, data=data)
+            return result
+        except WeComHttpError as e:
+            stats = e.stats
             _logger.error("Error while calling WeChat Work API: %s", str(e))
             raise UserError(_("Network error while calling WeChat Work API."))
+        finally:
+            self._record_http_call(app_id, endpoint, method, stats, params, data, result)
+
+    def _record_http_call(self, app_id, endpoint, method, stats, params=None, data=None, result=None):
+        """
+        记录一次 HTTP 请求的指标和调用日志，也用于在其他线程中发送的请求
+        :param app_id: WeChat Work 应用的ID
+        :param endpoint: API 端点
+        :param method: HTTP 方法
+        :param stats: wecom_http.send_request 返回的请求统计
+        :param params: URL 参数
+        :param data: POST 数据
+        :param result: API 响应
+        """
+        log_vals = {
+            'app_id': app_id,
+            'api_name': endpoint,
+            'endpoint': endpoint,
+            'method': method.upper(),
+            'errcode': -1,
+            'duration_ms': 0.0,
+        }
+        log_vals.update(stats)
+        self._record_metrics(log_vals)
+        self._log_api_call(log_vals, params or {}, data, result)
+
+    def _record_metrics(self, log_vals):
+        """
+        记录单次 HTTP 请求的进程内指标，通过 /wecom/metrics 导出
+        :param log_vals: 日志字段值
+        """
+        endpoint = log_vals['endpoint']
+        errcode = log_vals['errcode']
+        status = 'ok' if errcode == 0 else ('network_error' if errcode == -1 else 'api_error')
+        metrics.inc('api_requests_total', endpoint=endpoint, status=status)
+        metrics.observe('api_request_duration_ms', log_vals['duration_ms'], endpoint=endpoint)
+        metrics.inc('api_request_bytes_total', log_vals.get('request_bytes', 0), endpoint=endpoint)
+        metrics.inc('api_response_bytes_total', log_vals.get('response_bytes', 0), endpoint=endpoint)
+
+    def _log_api_call(self, log_vals, params, data, result):
+        """
+        记录 API 调用日志，用于统计汇总
+        仅在日志级别为 debug 时记录请求和响应内容
+        :param log_vals: 日志字段值
+        :param params: URL 参数
+        :param data: POST 数据
+        :param result: API 响应
+        """
+        if self.env['wecom.config']._get_snapshot().log_level == 'debug':
+            request = {k: v for k, v in params.items() if k != 'access_token'}
+            if data is not None:
+                request = {'params': request, 'data': data}
+            log_vals.update(
+                params=json.dumps(request, ensure_ascii=False),
+                response=json.dumps(result, ensure_ascii=False) if result is not None else False,
+            )
+        self.env['wecom.api.log']._record_call(log_vals)
 
     @api.model
     def send_text_message(self, app_id, agent_id, content, to_user=None, to_party=None, to_tag=None):
@@ -120,7 +402,7 @@ class WeComApiService(models.AbstractModel):
             },
             "safe": 0
         }
-        return self.call_api(app_id, "message/send", method="POST", data=data)
+        return self.client.send_text_message(app_id, **data)
 
     # 可以添加更多特定的 API 调用方法，如发送其他类型的消息、管理部门、用户等
 
@@ -131,7 +413,7 @@ class WeComApiService(models.AbstractModel):
         :param app_id: WeChat Work 应用的ID
         :return: 同步结果
         """
-        result = self.call_api(app_id, "department/list", method="GET")
+        result = self.client.department_list(app_id)
         departments = result.get('department', [])
 
         # TODO: 实现部门同步逻辑
@@ -146,10 +428,11 @@ class WeComApiService(models.AbstractModel):
         :param app_id: WeChat Work 应用的ID
         :return: 同步结果
         """
-        result = self.call_api(app_id, "user/list", method="GET", params={"department_id": 1, "fetch_child": 1})
+        result = self.client.user_list(app_id, department_id=1, fetch_child=1)
         users = result.get('userlist', [])
 
         # TODO: 实现用户同步逻辑
         # 这里你需要将获取到的用户信息与 Odoo 中的用户进行比对和更新
 
-        return len(users)
\ No newline at end of file
+        return len(users)
+
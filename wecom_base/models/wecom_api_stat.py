@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+
+import logging
+from datetime import timedelta
+
+from odoo import api, fields, models
+
+_logger = logging.getLogger(__name__)
+
+PERIOD_STEPS = {
+    'hourly': ('hour', timedelta(hours=1)),
+    'daily': ('day', timedelta(days=1)),
+}
+# Buckets overlapping this recent window are aggregated again at each rollup, so calls
+# committed after their bucket was first rolled up, e.g. by a long sync, are counted
+ROLLUP_LOOKBACK = timedelta(hours=2)
+
+
+class WeComApiStat(models.Model):
+    """
+    WeChat Work API Statistics Rollup
+    Calls, errors and latency percentiles per endpoint, aggregated per hour and per day.
+    Rollups are maintained incrementally from wecom.api.log: each closed period is
+    aggregated when it closes and again while within ROLLUP_LOOKBACK, so dashboards
+    never scan the raw logs.
+    """
+    _name = 'wecom.api.stat'
+    _description = 'WeChat Work API Statistics'
+    _order = 'bucket desc, endpoint'
+    _log_access = False
+
+    period = fields.Selection([
+        ('hourly', 'Hourly'),
+        ('daily', 'Daily'),
+    ], string='Period', required=True, index=True)
+    bucket = fields.Datetime(string='Period Start', required=True, index=True)
+    endpoint = fields.Char(string='API Endpoint', required=True, default='')
+    call_count = fields.Integer(string='Calls')
+    error_count = fields.Integer(string='Errors')
+    duration_avg = fields.Float(string='Average Duration (ms)')
+    duration_p50 = fields.Float(string='Median Duration (ms)')
+    duration_p95 = fields.Float(string='95th Percentile (ms)')
+    duration_p99 = fields.Float(string='99th Percentile (ms)')
+    duration_max = fields.Float(string='Max Duration (ms)')
+    request_bytes = fields.Integer(string='Bytes Sent')
+    response_bytes = fields.Integer(string='Bytes Received')
+
+    _sql_constraints = [
+        ('period_bucket_endpoint_uniq', 'unique(period, bucket, endpoint)',
+         'Only one rollup per period, bucket and endpoint is allowed!')
+    ]
+
+    @api.model
+    def _update_rollups(self):
+        """Aggregate every closed hour and day not rolled up yet"""
+        for period in PERIOD_STEPS:
+            self._rollup_period(period)
+
+    def _rollup_period(self, period):
+        """
+        Aggregate the closed buckets of a period since the last rollup, and the recent ones again
+        :param period: 'hourly' or 'daily'
+        """
+        unit, step = PERIOD_STEPS[period]
+        cr = self.env.cr
+        cr.execute("SELECT max(bucket) FROM wecom_api_stat WHERE period = %s", [period])
+        last_bucket = cr.fetchone()[0]
+        if last_bucket:
+            cr.execute("SELECT date_trunc(%s, now() AT TIME ZONE 'UTC' - %s)", [unit, ROLLUP_LOOKBACK])
+            start = min(last_bucket + step, cr.fetchone()[0])
+        else:
+            cr.execute("SELECT date_trunc(%s, min(call_time)) FROM wecom_api_log", [unit])
+            start = cr.fetchone()[0]
+        if not start:
+            return
+        cr.execute("SELECT date_trunc(%s, now() AT TIME ZONE 'UTC')", [unit])
+        end = cr.fetchone()[0]
+        if start >= end:
+            return
+        cr.execute("""
+            INSERT INTO wecom_api_stat (period, bucket, endpoint, call_count, error_count,
+                                        duration_avg, duration_p50, duration_p95, duration_p99, duration_max,
+                                        request_bytes, response_bytes)
+            SELECT %(period)s, date_trunc(%(unit)s, call_time), COALESCE(endpoint, ''),
+                   count(*), count(*) FILTER (WHERE errcode <> 0),
+                   avg(duration_ms),
+                   percentile_cont(0.5) WITHIN GROUP (ORDER BY duration_ms),
+                   percentile_cont(0.95) WITHIN GROUP (ORDER BY duration_ms),
+                   percentile_cont(0.99) WITHIN GROUP (ORDER BY duration_ms),
+                   max(duration_ms),
+                   COALESCE(sum(request_bytes), 0), COALESCE(sum(response_bytes), 0)
+              FROM wecom_api_log
+             WHERE call_time >= %(start)s AND call_time < %(end)s
+          GROUP BY 2, 3
+            ON CONFLICT (period, bucket, endpoint) DO UPDATE
+               SET call_count = EXCLUDED.call_count,
+                   error_count = EXCLUDED.error_count,
+                   duration_avg = EXCLUDED.duration_avg,
+                   duration_p50 = EXCLUDED.duration_p50,
+                   duration_p95 = EXCLUDED.duration_p95,
+                   duration_p99 = EXCLUDED.duration_p99,
+                   duration_max = EXCLUDED.duration_max,
+                   request_bytes = EXCLUDED.request_bytes,
+                   response_bytes = EXCLUDED.response_bytes
+        """, {'period': period, 'unit': unit, 'start': start, 'end': end})
+        _logger.debug(f"Rolled up {cr.rowcount} {period} WeChat Work API buckets from {start} to {end}")
+        self.invalidate_model()
+
+    @api.model
+    def cron_update_rollups(self):
+        """Cron job to keep the rollups up to date"""
+        self._update_rollups()
+
+    @api.model
+    def get_statistics(self, period='daily', date_from=None, date_to=None, endpoint=None):
+        """
+        Get API statistics per endpoint for dashboards, read from the rollups only
+        Reads never write: the rollups are maintained by the hourly cron and the log autovacuum.
+        :param period: 'hourly' or 'daily'
+        :param date_from: Only include buckets starting at or after this datetime
+        :param date_to: Only include buckets starting before this datetime
+        :param endpoint: Restrict the statistics to one endpoint
+        :return: A list of dictionaries, one per bucket and endpoint
+        """
+        domain = [('period', '=', period)]
+        if date_from:
+            domain.append(('bucket', '>=', date_from))
+        if date_to:
+            domain.append(('bucket', '<', date_to))
+        if endpoint:
+            domain.append(('endpoint', '=', endpoint))
+        return self.search_read(domain, [
+            'bucket', 'endpoint', 'call_count', 'error_count', 'duration_avg',
+            'duration_p50', 'duration_p95', 'duration_p99', 'duration_max',
+        ])
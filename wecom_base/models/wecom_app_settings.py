@@ -1,7 +1,15 @@
 # -*- coding: utf-8 -*-
 
 from odoo import api, fields, models, _
+from odoo.exceptions import ValidationError
+from .wecom_cache import freeze, settings_cache
 import json
+import logging
+
+_logger = logging.getLogger(__name__)
+
+# Key of the applications whose settings changed in the current transaction, in cr.precommit.data
+DIRTY_APPS_KEY = 'wecom.app.settings.dirty'
 
 class WeComAppSettings(models.Model):
     """
@@ -27,42 +35,130 @@ class WeComAppSettings(models.Model):
         ('app_key_uniq', 'unique (app_id, key)', _("Settings key must be unique per application!"))
     ]
 
-    @api.model
-    def create(self, vals):
+    @api.model_create_multi
+    def create(self, vals_list):
         """Override create to convert value based on value_type"""
-        vals = self._convert_value(vals)
-        return super(WeComAppSettings, self).create(vals)
+        settings = super(WeComAppSettings, self).create([self._convert_value(vals) for vals in vals_list])
+        self._invalidate_app_snapshots(settings.app_id.ids)
+        return settings
 
     def write(self, vals):
         """Override write to convert value based on value_type"""
-        vals = self._convert_value(vals)
-        return super(WeComAppSettings, self).write(vals)
+        app_ids = set(self.app_id.ids)
+        if 'value' in vals and 'value_type' not in vals:
+            # Convert the new value with the type of each setting
+            res = True
+            for value_type in set(self.mapped('value_type')):
+                settings = self.filtered(lambda s: s.value_type == value_type)
+                res = super(WeComAppSettings, settings).write(self._convert_value(dict(vals, value_type=value_type)))
+        else:
+            res = super(WeComAppSettings, self).write(self._convert_value(vals))
+        self._invalidate_app_snapshots(app_ids | set(self.app_id.ids))
+        return res
+
+    def unlink(self):
+        """Override unlink to drop the settings snapshot of the applications"""
+        app_ids = self.app_id.ids
+        res = super(WeComAppSettings, self).unlink()
+        self._invalidate_app_snapshots(app_ids)
+        return res
 
     def _convert_value(self, vals):
-        """Convert value based on value_type"""
-        if 'value' in vals and 'value_type' in vals:
-            if vals['value_type'] == 'integer':
-                vals['value'] = int(vals['value'])
-            elif vals['value_type'] == 'float':
-                vals['value'] = float(vals['value'])
-            elif vals['value_type'] == 'boolean':
-                vals['value'] = bool(vals['value'])
-            elif vals['value_type'] == 'json':
-                try:
-                    json.loads(vals['value'])  # Validate JSON
-                except json.JSONDecodeError:
-                    raise ValueError(_("Invalid JSON format"))
+        """Convert value to its text representation based on value_type"""
+        if 'value' in vals:
+            vals = dict(vals, value=self._normalize_value(vals['value'], vals.get('value_type') or 'string'))
         return vals
 
+    @api.model
+    def _normalize_value(self, value, value_type):
+        """
+        Get the text stored for a value
+        :param value: The value, either native or as text
+        :param value_type: Type of the setting value
+        :return: The text representation, readable by _decode_value
+        """
+        try:
+            if value_type == 'integer':
+                return str(int(value))
+            elif value_type == 'float':
+                return str(float(value))
+            elif value_type == 'boolean':
+                if isinstance(value, str):
+                    value = value.lower() in ('true', '1', 'yes')
+                return 'true' if value else 'false'
+            elif value_type == 'json':
+                if isinstance(value, str):
+                    json.loads(value)  # Validate JSON
+                    return value
+                return json.dumps(value)
+        except (TypeError, ValueError):
+            raise ValidationError(_("Invalid %(type)s value: %(value)s") % {'type': value_type, 'value': value})
+        return str(value)
+
+    @api.model
+    def _decode_value(self, value, value_type):
+        """Convert a stored text value to its native type"""
+        if value_type == 'integer':
+            return int(value)
+        elif value_type == 'float':
+            return float(value)
+        elif value_type == 'boolean':
+            return value.lower() in ('true', '1', 'yes')
+        elif value_type == 'json':
+            return json.loads(value)
+        return value
+
     def get_value(self):
         """Get the converted value based on value_type"""
         self.ensure_one()
-        if self.value_type == 'integer':
-            return int(self.value)
-        elif self.value_type == 'float':
-            return float(self.value)
-        elif self.value_type == 'boolean':
-            return self.value.lower() in ('true', '1', 'yes')
-        elif self.value_type == 'json':
-            return json.loads(self.value)
-        return self.value
\ No newline at end of file
+        return self._decode_value(self.value, self.value_type)
+
+    @api.model
+    def _get_app_snapshot(self, app_id):
+        """
+        Get the decoded settings of an application
+        Loaded in one query and kept in the per-process settings cache until a setting
+        of the application is changed, so hot paths read settings without DB or parse cost.
+        Values are deeply read-only, since the snapshot is shared; values that cannot be decoded
+        are logged and left out. Settings changed in the
+        current transaction are read but not cached until it commits.
+        :param app_id: ID of the WeChat Work application
+        :return: A read-only mapping of setting key to native value
+        """
+        dbname = self.env.cr.dbname
+        snapshot = settings_cache.get(dbname, app_id)
+        if snapshot is None:
+            self.flush_model(['app_id', 'key', 'value', 'value_type', 'active'])
+            self.env.cr.execute("""
+                SELECT key, value, value_type
+                  FROM wecom_app_settings
+                 WHERE app_id = %s AND active
+            """, [app_id])
+            values = {}
+            for key, value, value_type in self.env.cr.fetchall():
+                try:
+                    values[key] = self._decode_value(value, value_type)
+                except (AttributeError, TypeError, ValueError) as e:
+                    # Left out, so readers fall back to their default instead of failing for every key
+                    _logger.error(f"Invalid {value_type} WeChat Work setting {key} of application {app_id}: {str(e)}")
+            snapshot = freeze(values)
+            if app_id not in self.env.cr.precommit.data.get(DIRTY_APPS_KEY, ()):
+                settings_cache.set(dbname, app_id, snapshot)
+        return snapshot
+
+    @api.model
+    def _invalidate_app_snapshots(self, app_ids):
+        """
+        Drop the settings snapshots of the given applications, now and once the transaction commits
+        Until then, snapshots other requests cache hold the previous committed values.
+        """
+        dbname = self.env.cr.dbname
+        app_ids = set(app_ids)
+        self.env.cr.precommit.data.setdefault(DIRTY_APPS_KEY, set()).update(app_ids)
+        for app_id in app_ids:
+            settings_cache.invalidate(dbname, app_id)
+
+        @self.env.cr.postcommit.add
+        def invalidate():
+            for app_id in app_ids:
+                settings_cache.invalidate(dbname, app_id)
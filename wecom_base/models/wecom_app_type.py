@@ -21,12 +21,11 @@ class WeComAppType(models.Model):
         ("code_uniq", "unique (code)", _("The type code must be unique!"))
     ]
 
-    @api.model
-    def create(self, vals):
+    @api.model_create_multi
+    def create(self, vals_list):
         """Override create to ensure code is uppercase"""
-        if vals.get('code'):
-            vals['code'] = vals['code'].upper()
-        return super(WeComAppType, self).create(vals)
+        vals_list = [dict(vals, code=vals['code'].upper()) if vals.get('code') else vals for vals in vals_list]
+        return super(WeComAppType, self).create(vals_list)
 
     def write(self, vals):
         """Override write to ensure code is uppercase"""
@@ -112,15 +112,15 @@ class WeComAppWebhook(models.Model):
         # according to WeChat Work's encryption specifications
         pass
 
-    @api.model
-    def create(self, vals):
+    @api.model_create_multi
+    def create(self, vals_list):
         """Override create to generate webhook URL if not provided"""
-        if 'url' not in vals:
-            # Create the record first to get an ID
-            record = super(WeComAppWebhook, self).create(vals)
-            record.url = record.generate_webhook_url()
-            return record
-        return super(WeComAppWebhook, self).create(vals)
+        records = super(WeComAppWebhook, self).create(vals_list)
+        # The URL contains the ID, it is generated once the records exist
+        for record, vals in zip(records, vals_list):
+            if 'url' not in vals:
+                record.url = record.generate_webhook_url()
+        return records
 
     def toggle_active(self):
         """Toggle the active status of the webhook"""
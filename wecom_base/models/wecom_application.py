@@ -2,7 +2,9 @@
 
 from odoo import api, fields, models, _
 from odoo.exceptions import ValidationError
-from odoo.tools.cache import ormcache
+
+# Fields an access token depends on; writing any other field keeps the cached token
+TOKEN_CREDENTIAL_FIELDS = {'secret', 'company_id'}
 
 class WeComApplication(models.Model):
     """
@@ -22,6 +24,9 @@ class WeComApplication(models.Model):
     agent_id = fields.Integer(required=True, help="WeChat Work agent ID")
     secret = fields.Char(required=True, help="Application secret")
     sequence = fields.Integer(default=10, help="Sequence for ordering")
+    access_token = fields.Char(copy=False, groups="base.group_system", help="Current access token")
+    token_expiration_time = fields.Datetime(copy=False, groups="base.group_system",
+                                            help="Expiration time of the current access token")
 
     webhook_ids = fields.One2many("wecom.app.webhook", "app_id", string="Webhooks", help="Webhooks associated with this application")
     setting_ids = fields.One2many("wecom.app.settings", "app_id", string="Settings", help="Settings for this application")
@@ -44,27 +49,35 @@ class WeComApplication(models.Model):
             if app.agent_id <= 0:
                 raise ValidationError(_("Agent ID must be a positive integer."))
 
-    @api.model
-    def create(self, vals):
-        """Override create to clear cache"""
-        res = super(WeComApplication, self).create(vals)
-        self.clear_caches()
-        return res
-
     def write(self, vals):
-        """Override write to clear cache"""
+        """Override write to invalidate the access token of these applications only when credentials change"""
+        if TOKEN_CREDENTIAL_FIELDS.intersection(vals):
+            vals = dict(vals, access_token=False, token_expiration_time=False)
         res = super(WeComApplication, self).write(vals)
-        self.clear_caches()
+        if TOKEN_CREDENTIAL_FIELDS.intersection(vals):
+            self.env['wecom.api.service']._invalidate_access_token(self.ids)
         return res
 
-    @ormcache('self.id')
+    def unlink(self):
+        """Override unlink to drop the cached access tokens"""
+        app_ids = self.ids
+        res = super(WeComApplication, self).unlink()
+        self.env['wecom.api.service']._invalidate_access_token(app_ids)
+        return res
+
+    @property
+    def settings(self):
+        """Read-only mapping of the decoded settings of this application, e.g. app.settings['key']"""
+        self.ensure_one()
+        return self.env['wecom.app.settings']._get_app_snapshot(self.id)
+
     def get_access_token(self):
         """
         Get the access token for this application
-        This method is cached for performance
+        Served from the per-application token cache of wecom.api.service
         """
-        # TODO: Implement actual token retrieval logic
-        return "sample_token"
+        self.ensure_one()
+        return self.env['wecom.api.service']._get_access_token(self.id)
 
     def refresh_app_info(self):
         """Refresh application information from WeChat Work"""
@@ -4,6 +4,8 @@ import logging
 from odoo import api, fields, models, _
 from odoo.exceptions import ValidationError
 
+from .wecom_config import CREDENTIAL_PARAMETERS
+
 _logger = logging.getLogger(__name__)
 
 
@@ -24,15 +26,15 @@ class WeComBase(models.AbstractModel):
         """
         _logger.error(f"{self._name}: {error_message}")
 
-    @api.model
-    def create(self, vals):
+    @api.model_create_multi
+    def create(self, vals_list):
         """
         Override create method to add error logging
-        :param vals: The values to create the record with
-        :return: The created record
+        :param vals_list: The values to create the records with
+        :return: The created records
         """
         try:
-            return super(WeComBase, self).create(vals)
+            return super(WeComBase, self).create(vals_list)
         except Exception as e:
             self.log_error(f"Create failed: {str(e)}")
             raise
@@ -52,10 +54,14 @@ class WeComBase(models.AbstractModel):
     def get_wecom_config(self):
         """
         Get WeChat Work configuration
+        The credentials are only included for settings administrators.
         :return: A dictionary containing WeChat Work configuration
         """
-        # TODO: Implement configuration retrieval logic
-        return {}
+        config = self.env['wecom.config']._get_snapshot()._asdict()
+        if not self.env.user.has_group('base.group_system'):
+            for attribute in CREDENTIAL_PARAMETERS:
+                config.pop(attribute)
+        return config
 
     @api.model
     def format_wecom_response(self, response):
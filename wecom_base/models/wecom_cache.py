@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+
+import json
+import threading
+import time
+from collections import OrderedDict
+from types import MappingProxyType
+
+
+def freeze(value):
+    """
+    Get a read-only copy of a decoded JSON value, to share it between requests and threads
+    Dictionaries become read-only mappings and lists tuples, at every level.
+    """
+    if isinstance(value, dict):
+        return MappingProxyType({key: freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+class ScopedCache(object):
+    """
+    Per-process cache scoped by database name and key, with expiry and LRU eviction
+    Unlike ormcache, an entry can be invalidated on its own, without signaling a
+    registry-wide cache clear to every worker. Other workers pick up a change at the
+    latest when their own entry expires, so values must tolerate that staleness.
+    """
+
+    def __init__(self, max_entries=1024, ttl=None):
+        """
+        :param max_entries: Maximum number of entries, least recently used ones are evicted first
+        :param ttl: Default time to live in seconds, None for no expiry
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+
+    def get(self, dbname, key, default=None):
+        """
+        Get a cached value
+        :param dbname: The database the value belongs to
+        :param key: The key of the value
+        :param default: Returned when the value is missing or expired
+        """
+        with self._lock:
+            entry = self._entries.get((dbname, key))
+            if entry is None:
+                return default
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._entries[(dbname, key)]
+                return default
+            self._entries.move_to_end((dbname, key))
+            return value
+
+    def set(self, dbname, key, value, ttl=None):
+        """
+        Cache a value
+        :param dbname: The database the value belongs to
+        :param key: The key of the value
+        :param value: The value to cache
+        :param ttl: Time to live in seconds, defaults to the cache ttl
+        """
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            self._entries[(dbname, key)] = (value, expires_at)
+            self._entries.move_to_end((dbname, key))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, dbname, key):
+        """Drop the cached value of a key"""
+        with self._lock:
+            self._entries.pop((dbname, key), None)
+
+    def clear(self, dbname=None):
+        """Drop every cached value, or only those of one database"""
+        with self._lock:
+            if dbname is None:
+                self._entries.clear()
+            else:
+                for cache_key in [cache_key for cache_key in self._entries if cache_key[0] == dbname]:
+                    del self._entries[cache_key]
+
+
+class ResponseCache(object):
+    """
+    Per-process cache of API responses, with per-entry expiry and LRU eviction by size
+    Responses are kept as JSON text: the size of an entry is known and every hit gets its
+    own copy. Concurrent misses of the same key are coalesced, only the first caller
+    fetches the response while the others wait for it.
+    """
+
+    def __init__(self, max_bytes=32 * 1024 * 1024, wait_timeout=60):
+        """
+        :param max_bytes: Maximum total size of the cached responses
+        :param wait_timeout: Seconds a coalesced caller waits before fetching on its own
+        """
+        self.max_bytes = max_bytes
+        self.wait_timeout = wait_timeout
+        self.size = 0
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def _lookup(self, cache_key):
+        # Called with the lock held
+        entry = self._entries.get(cache_key)
+        if entry is None:
+            return None
+        text, expires_at = entry
+        if expires_at <= time.monotonic():
+            self._discard(cache_key)
+            return None
+        self._entries.move_to_end(cache_key)
+        return text
+
+    def _discard(self, cache_key):
+        # Called with the lock held
+        entry = self._entries.pop(cache_key, None)
+        if entry is not None:
+            self.size -= len(entry[0])
+
+    def _store(self, cache_key, text, ttl):
+        with self._lock:
+            self._discard(cache_key)
+            if len(text) > self.max_bytes:
+                return
+            self._entries[cache_key] = (text, time.monotonic() + ttl)
+            self.size += len(text)
+            self._evict()
+
+    def _evict(self):
+        # Called with the lock held
+        while self.size > self.max_bytes:
+            self._discard(next(iter(self._entries)))
+
+    def resize(self, max_bytes):
+        """
+        Change the maximum total size, the least recently used responses beyond it are dropped at once
+        :param max_bytes: Maximum total size of the cached responses
+        """
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def get_or_fetch(self, dbname, key, ttl, fetch):
+        """
+        Get a cached response, fetching it on a miss
+        Errors are not cached: when fetch raises, waiting callers fetch on their own.
+        :param dbname: The database the response belongs to
+        :param key: The key of the response, hashable
+        :param ttl: Time to live in seconds of a fetched response
+        :param fetch: Callable returning the response, a JSON-serializable dictionary
+        :return: A tuple (response, status), status being 'hit', 'coalesced' or 'miss'
+        """
+        cache_key = (dbname, key)
+        with self._lock:
+            text = self._lookup(cache_key)
+            if text is not None:
+                return json.loads(text), 'hit'
+            flight = self._inflight.get(cache_key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[cache_key] = threading.Event()
+        if not leader:
+            flight.wait(self.wait_timeout)
+            with self._lock:
+                text = self._lookup(cache_key)
+            if text is not None:
+                return json.loads(text), 'coalesced'
+            return fetch(), 'miss'
+        try:
+            response = fetch()
+            self._store(cache_key, json.dumps(response), ttl)
+            return response, 'miss'
+        finally:
+            with self._lock:
+                self._inflight.pop(cache_key, None)
+            flight.set()
+
+    def invalidate(self, dbname, predicate=None):
+        """
+        Drop cached responses of a database
+        :param dbname: The database of the responses
+        :param predicate: Called with the key of each response, only matching ones are dropped
+        """
+        with self._lock:
+            for cache_key in [cache_key for cache_key in self._entries
+                              if cache_key[0] == dbname and (predicate is None or predicate(cache_key[1]))]:
+                self._discard(cache_key)
+
+
+# Access tokens per application id
+token_cache = ScopedCache(max_entries=4096)
+
+# Decoded settings per application id; other workers pick up changes within a minute
+settings_cache = ScopedCache(max_entries=1024, ttl=60)
+
+# Responses of the cacheable GET APIs per (application id, endpoint, parameters), see wecom.api.registry
+response_cache = ResponseCache()
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+
+import json
+import logging
+import time
+from collections import namedtuple
+from datetime import timedelta
+
+from odoo import api, fields, models
+
+from .wecom_api_log import _auto_commit
+
+_logger = logging.getLogger(__name__)
+
+# Batchable callbacks are queued this long, so bursts are applied as one bulk operation
+COALESCE_WINDOW = 2
+
+# Last dispatch cron trigger per database in this worker, at most one per window
+_last_triggers = {}
+
+CallbackHandler = namedtuple('CallbackHandler', ['key', 'model', 'method', 'batchable', 'entity_key'])
+
+
+def _handler_key(msg_type, event=None, change_type=None):
+    return msg_type or '', event or '', change_type or ''
+
+
+class CallbackRegistry(object):
+    """
+    Callback handlers keyed by (MsgType, Event, ChangeType)
+    A handler is a model method called with a list of callback messages. Lookups fall back
+    from (MsgType, Event, ChangeType) to (MsgType, Event) then MsgType, each one dictionary
+    lookup. Batchable handlers receive the messages queued within COALESCE_WINDOW seconds,
+    merged into one per entity.
+    """
+
+    def __init__(self):
+        self._handlers = {}
+
+    def register(self, msg_type, event=None, change_type=None, model=None, method=None,
+                 batchable=False, entity_key=None):
+        """
+        Register the handler of a callback, replacing any previous one
+        :param msg_type: MsgType of the callback
+        :param event: Event of the callback, None for any
+        :param change_type: ChangeType of the callback, None for any
+        :param model: Model of the handler
+        :param method: Name of the model method called with the list of messages
+        :param batchable: Queue the messages and apply them in bulk, after COALESCE_WINDOW seconds
+        :param entity_key: Message field identifying the entity of a batchable callback,
+                           its messages within the window are merged, later fields winning
+        """
+        if batchable and not entity_key:
+            raise ValueError("Batchable callback handlers need an entity_key")
+        key = _handler_key(msg_type, event, change_type)
+        self._handlers[key] = CallbackHandler('/'.join(key), model, method, batchable, entity_key)
+
+    def unregister(self, msg_type, event=None, change_type=None):
+        self._handlers.pop(_handler_key(msg_type, event, change_type), None)
+
+    def resolve(self, message):
+        """
+        Get the handler of a callback message
+        :param message: Decrypted callback message
+        :return: A CallbackHandler, or None when the callback is not handled
+        """
+        msg_type, event, change_type = _handler_key(
+            message.get('MsgType'), message.get('Event'), message.get('ChangeType'))
+        handlers = self._handlers
+        return (handlers.get((msg_type, event, change_type))
+                or handlers.get((msg_type, event, ''))
+                or handlers.get((msg_type, '', '')))
+
+    def get(self, key):
+        """Get a handler by its 'MsgType/Event/ChangeType' key"""
+        return self._handlers.get(tuple(key.split('/')))
+
+
+callback_handlers = CallbackRegistry()
+
+
+class WeComCallbackEvent(models.Model):
+    """
+    WeChat Work Callback Event
+    A batchable callback waiting to be applied. There is one row per handler and entity:
+    a later callback for the same entity is merged into the queued one, its fields winning,
+    so a burst of updates of one user is applied once, with all its changes.
+    """
+    _name = 'wecom.callback.event'
+    _description = 'WeChat Work Callback Event'
+    _order = 'write_date, id'
+
+    company_id = fields.Many2one('res.company', string='Company', required=True, ondelete='cascade')
+    handler = fields.Char(string='Handler', required=True, help="MsgType/Event/ChangeType of the handler")
+    entity_key = fields.Char(string='Entity', required=True)
+    payload = fields.Text(string='Message', required=True)
+
+    _sql_constraints = [
+        ('entity_uniq', 'unique(company_id, handler, entity_key)',
+         'Only one callback event may be queued per entity!')
+    ]
+
+    @api.model
+    def dispatch(self, company, message):
+        """
+        Apply a callback message with its registered handler, or queue it when the handler is batchable
+        :param company: Company receiving the callback
+        :param message: Decrypted callback message
+        :return: The handler, or None when the callback is not handled
+        """
+        handler = callback_handlers.resolve(message)
+        if handler is None:
+            return None
+        if handler.batchable:
+            self._enqueue(company, handler, message)
+        else:
+            getattr(self.env[handler.model].with_company(company), handler.method)([message])
+        return handler
+
+    @api.model
+    def _enqueue(self, company, handler, message):
+        """
+        Queue a batchable callback, merged into the one queued for the same entity
+        Callbacks such as update_user only carry the changed fields: the later fields win,
+        the fields only in the earlier callbacks are kept.
+        """
+        entity = message.get(handler.entity_key)
+        if not entity:
+            _logger.warning(f"WeChat Work callback {handler.key} without {handler.entity_key}, ignored")
+            return
+        self.env.cr.execute("""
+            INSERT INTO wecom_callback_event (company_id, handler, entity_key, payload,
+                                              create_uid, create_date, write_uid, write_date)
+            VALUES (%(company)s, %(handler)s, %(entity)s, %(payload)s,
+                    %(uid)s, now() AT TIME ZONE 'UTC', %(uid)s, now() AT TIME ZONE 'UTC')
+            ON CONFLICT (company_id, handler, entity_key)
+            DO UPDATE SET payload = (wecom_callback_event.payload::jsonb || EXCLUDED.payload::jsonb)::text,
+                          write_uid = EXCLUDED.write_uid, write_date = EXCLUDED.write_date
+        """, {'company': company.id, 'handler': handler.key, 'entity': entity,
+              'payload': json.dumps(message), 'uid': self.env.uid})
+        self._trigger_dispatch()
+
+    @api.model
+    def _trigger_dispatch(self):
+        dbname = self.env.cr.dbname
+        now = time.monotonic()
+        if now - _last_triggers.get(dbname, -COALESCE_WINDOW) < COALESCE_WINDOW:
+            return
+        cron = self.env.ref('wecom_base.ir_cron_dispatch_callback_events', raise_if_not_found=False)
+        if cron:
+            cron.sudo()._trigger(at=fields.Datetime.now() + timedelta(seconds=COALESCE_WINDOW))
+            _last_triggers[dbname] = now
+
+    @api.model
+    def cron_dispatch_events(self):
+        """
+        Apply the queued callbacks, one handler call per company and handler
+        When a handler fails its callbacks stay queued, and are applied by the next run.
+        """
+        self.flush_model()
+        self.env.cr.execute("SELECT DISTINCT company_id, handler FROM wecom_callback_event")
+        for company_id, handler_key in self.env.cr.fetchall():
+            handler = callback_handlers.get(handler_key)
+            try:
+                with self.env.cr.savepoint():
+                    # Deleting locks the rows: callbacks for these entities wait for the commit, then queue new rows
+                    self.env.cr.execute("""
+                        DELETE FROM wecom_callback_event WHERE company_id = %s AND handler = %s
+                        RETURNING payload, write_date, id
+                    """, [company_id, handler_key])
+                    events = sorted(self.env.cr.fetchall(), key=lambda event: event[1:])
+                    if handler is None:
+                        _logger.warning(f"No WeChat Work callback handler {handler_key}, {len(events)} events dropped")
+                    elif events:
+                        company = self.env['res.company'].browse(company_id)
+                        getattr(self.env[handler.model].with_company(company), handler.method)(
+                            [json.loads(payload) for payload, _write_date, _event_id in events])
+            except Exception as e:
+                _logger.error(f"Failed to apply WeChat Work callbacks {handler_key}, kept queued: {str(e)}")
+            _auto_commit(self.env.cr)
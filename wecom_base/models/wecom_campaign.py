@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+
+import base64
+import json
+import logging
+import re
+
+from odoo import api, fields, models, _
+from odoo.exceptions import UserError, ValidationError
+
+from .wecom_message import MAX_DUPLICATE_CHECK_INTERVAL
+
+_logger = logging.getLogger(__name__)
+
+# Per-recipient delivery status, one byte each in status_data
+STATUS_QUEUED = 0
+STATUS_SENT = 1
+STATUS_INVALID = 2
+STATUS_FAILED = 3
+STATUS_COUNTERS = {
+    STATUS_QUEUED: 'queued_count',
+    STATUS_SENT: 'sent_count',
+    STATUS_INVALID: 'invalid_count',
+    STATUS_FAILED: 'failed_count',
+}
+# Recipients per message/send call: touser accepts 1000 users, toparty 100 departments
+CHUNK_SIZES = {'user': 1000, 'party': 100}
+_RECIPIENT_SPLIT = re.compile(r'[|,\s]+')
+
+
+class WeComCampaign(models.Model):
+    """
+    WeChat Work Campaign
+    A broadcast to many recipients stored as one record: the content is stored once, the
+    recipients as one '|'-separated list and their delivery status as one byte each, in
+    recipient order. The counters are updated with the status, so delivery statistics
+    never scan the recipients.
+    """
+    _name = 'wecom.campaign'
+    _description = 'WeChat Work Campaign'
+    _order = 'id desc'
+
+    name = fields.Char(string='Campaign', required=True)
+    company_id = fields.Many2one('res.company', string='Company', required=True, default=lambda self: self.env.company)
+    message_type = fields.Selection([
+        ('text', 'Text'),
+        ('markdown', 'Markdown'),
+        ('textcard', 'Text Card'),
+        ('news', 'News'),
+        ('mpnews', 'MP News'),
+    ], string='Message Type', required=True, default='text')
+    content = fields.Text(string='Content', required=True,
+                          help="Text of the message, or its JSON content for cards and news")
+    recipient_type = fields.Selection([
+        ('user', 'User'),
+        ('party', 'Department'),
+    ], string='Recipient Type', required=True, default='user')
+    recipient_data = fields.Text(string='Recipients', help="UserIDs or department IDs, separated by |")
+    status_data = fields.Binary(string='Delivery Status', attachment=False, readonly=True,
+                                help="One status byte per recipient, in recipient order")
+    priority = fields.Selection([
+        ('alerting', 'Alert'),
+        ('interactive', 'Normal'),
+        ('bulk', 'Bulk'),
+    ], string='Priority', required=True, default='bulk')
+    state = fields.Selection([
+        ('draft', 'Draft'),
+        ('done', 'Sent'),
+    ], string='Status', default='draft', readonly=True)
+    enable_duplicate_check = fields.Boolean(string='Duplicate Check', default=True,
+                                            help="Let WeChat Work drop a chunk sent again within the interval, "
+                                                 "e.g. failed recipients retried after a timeout")
+    duplicate_check_interval = fields.Integer(string='Duplicate Check Interval (s)', default=1800)
+    send_time = fields.Datetime(string='Send Time', readonly=True)
+    recipient_count = fields.Integer(string='Recipients', readonly=True)
+    queued_count = fields.Integer(string='Queued', readonly=True)
+    sent_count = fields.Integer(string='Sent', readonly=True)
+    invalid_count = fields.Integer(string='Invalid', readonly=True)
+    failed_count = fields.Integer(string='Failed', readonly=True)
+    delivery_rate = fields.Float(string='Delivery Rate (%)', compute='_compute_delivery_rate')
+    error_message = fields.Text(string='Error Message', readonly=True)
+
+    @api.constrains('duplicate_check_interval')
+    def _check_duplicate_check_interval(self):
+        for campaign in self:
+            if not 0 < campaign.duplicate_check_interval <= MAX_DUPLICATE_CHECK_INTERVAL:
+                raise ValidationError(_("The duplicate check interval must be between 1 and %s seconds.")
+                                      % MAX_DUPLICATE_CHECK_INTERVAL)
+
+    @api.depends('recipient_count', 'sent_count')
+    def _compute_delivery_rate(self):
+        for campaign in self:
+            campaign.delivery_rate = (100.0 * campaign.sent_count / campaign.recipient_count
+                                      if campaign.recipient_count else 0.0)
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        return super(WeComCampaign, self).create([self._prepare_recipients(vals) for vals in vals_list])
+
+    def write(self, vals):
+        if 'recipient_data' in vals and any(campaign.state != 'draft' for campaign in self):
+            raise UserError(_("The recipients of a sent campaign cannot be changed."))
+        return super(WeComCampaign, self).write(self._prepare_recipients(vals))
+
+    @api.model
+    def _prepare_recipients(self, vals):
+        """Normalize the recipients of the values and reset their status to queued"""
+        if 'recipient_data' not in vals:
+            return vals
+        recipients = list(dict.fromkeys(
+            recipient for recipient in _RECIPIENT_SPLIT.split(vals['recipient_data'] or '') if recipient))
+        return dict(
+            vals,
+            recipient_data='|'.join(recipients),
+            status_data=base64.b64encode(bytes(len(recipients))),
+            recipient_count=len(recipients),
+            queued_count=len(recipients),
+            sent_count=0,
+            invalid_count=0,
+            failed_count=0,
+        )
+
+    def _get_recipients(self):
+        self.ensure_one()
+        return self.recipient_data.split('|') if self.recipient_data else []
+
+    def _get_status(self):
+        """
+        Get the delivery status of the recipients
+        :return: A bytearray with one status byte per recipient
+        """
+        self.ensure_one()
+        data = self.with_context(bin_size=False).status_data
+        return bytearray(base64.b64decode(data)) if data else bytearray(self.recipient_count)
+
+    def _set_status(self, status, **vals):
+        """Store the delivery status of the recipients, with the counters, in one write"""
+        self.ensure_one()
+        vals.update({counter: status.count(code) for code, counter in STATUS_COUNTERS.items()})
+        vals['status_data'] = base64.b64encode(bytes(status))
+        self.write(vals)
+
+    def get_recipients_by_status(self, code):
+        """
+        Get the recipients with a delivery status
+        :param code: One of the STATUS_* codes
+        :return: The list of UserIDs or department IDs
+        """
+        status = self._get_status()
+        return [recipient for recipient, value in zip(self._get_recipients(), status) if value == code]
+
+    def _prepare_message_data(self, agent_id):
+        self.ensure_one()
+        if self.message_type == 'text':
+            content = {'content': self.content}
+        else:
+            try:
+                content = json.loads(self.content)
+            except ValueError:
+                raise UserError(_("The content of a %s campaign must be JSON.") % self.message_type)
+        message_data = {'msgtype': self.message_type, 'agentid': agent_id, self.message_type: content}
+        if self.enable_duplicate_check:
+            message_data.update(enable_duplicate_check=1, duplicate_check_interval=self.duplicate_check_interval)
+        return message_data
+
+    def action_send(self):
+        """
+        Send the campaign to its queued recipients, in chunks sent concurrently
+        Recipients reported in invaliduser or invalidparty are marked invalid, the others of
+        an accepted chunk sent, and those of a failed chunk failed; send again to retry them.
+        Chunks are never re-sent automatically: a chunk failing on a timeout may have been
+        delivered, and the WeChat Work duplicate check drops it when it is retried.
+        """
+        self.ensure_one()
+        # Concurrent sends of this campaign wait here; they then fail to serialize and are
+        # retried by Odoo, finding no queued recipients
+        self.flush_recordset()
+        self.env.cr.execute("SELECT id FROM wecom_campaign WHERE id = %s FOR UPDATE", [self.id])
+        self.invalidate_recordset()
+        recipients = self._get_recipients()
+        status = self._get_status()
+        queued = [index for index, value in enumerate(status) if value == STATUS_QUEUED]
+        if not queued:
+            if self.state == 'done':
+                # Already sent by a concurrent request
+                return True
+            raise UserError(_("The campaign has no queued recipients."))
+        app = self.env['wecom.application'].search([('company_id', '=', self.company_id.id)], limit=1)
+        if not app:
+            raise UserError(_("No WeChat Work application configured for this company."))
+
+        message_data = self._prepare_message_data(app.agent_id)
+        target = 'touser' if self.recipient_type == 'user' else 'toparty'
+        invalid_key = 'invaliduser' if self.recipient_type == 'user' else 'invalidparty'
+        size = CHUNK_SIZES[self.recipient_type]
+        chunks = [queued[start:start + size] for start in range(0, len(queued), size)]
+        results = self.env['wecom.api.service'].with_context(wecom_lane=self.priority).call_api_many(app.id, [
+            ('message/send', {}, dict(message_data, **{target: '|'.join(recipients[index] for index in chunk)}))
+            for chunk in chunks
+        ], method='POST')
+
+        errors = []
+        for chunk, (result, error) in zip(chunks, results):
+            if error is not None:
+                errors.append(str(error))
+                for index in chunk:
+                    status[index] = STATUS_FAILED
+                continue
+            invalid = set((result.get(invalid_key) or '').split('|'))
+            for index in chunk:
+                status[index] = STATUS_INVALID if recipients[index] in invalid else STATUS_SENT
+        self._set_status(status, state='done', send_time=fields.Datetime.now(),
+                         error_message='\n'.join(errors) or False)
+        if errors:
+            _logger.warning(f"WeChat Work campaign {self.name}: {len(errors)} of {len(chunks)} chunks failed")
+        return True
+
+    def action_retry_failed(self):
+        """Queue the failed recipients again and send them"""
+        self.ensure_one()
+        status = self._get_status()
+        if STATUS_FAILED not in status:
+            raise UserError(_("The campaign has no failed recipients."))
+        self._set_status(bytearray(STATUS_QUEUED if value == STATUS_FAILED else value for value in status))
+        return self.action_send()
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+from collections import namedtuple
+
+from odoo import api, models, tools
+
+from .wecom_cache import response_cache
+
+DEFAULT_API_BASE_URL = 'https://qyapi.weixin.qq.com/cgi-bin/'
+
+
+def _to_bool(value):
+    return value.lower() in ('true', '1', 'yes')
+
+
+# (attribute, ir.config_parameter key, parser, default)
+CONFIG_PARAMETERS = [
+    ('corp_id', 'wecom.corp_id', str, False),
+    ('agent_id', 'wecom.agent_id', str, False),
+    ('secret', 'wecom.secret', str, False),
+    ('token', 'wecom.token', str, False),
+    ('aes_key', 'wecom.aes_key', str, False),
+    ('api_base_url', 'wecom.api_base_url', str, DEFAULT_API_BASE_URL),
+    ('enable_user_sync', 'wecom.enable_user_sync', _to_bool, False),
+    ('user_sync_interval', 'wecom.user_sync_interval', int, 24),
+    ('enable_department_sync', 'wecom.enable_department_sync', _to_bool, False),
+    ('department_sync_interval', 'wecom.department_sync_interval', int, 24),
+    ('enable_message_push', 'wecom.enable_message_push', _to_bool, False),
+    ('log_level', 'wecom.log_level', str, 'error'),
+    ('api_log_retention_days', 'wecom.api_log_retention_days', int, 30),
+    ('api_error_retention_days', 'wecom.api_error_retention_days', int, 90),
+    ('api_log_archive', 'wecom.api_log_archive', _to_bool, False),
+    ('api_rate_limit', 'wecom.api_rate_limit', int, 20),
+    ('api_max_workers', 'wecom.api_max_workers', int, 8),
+    ('api_cache_size', 'wecom.api_cache_size', int, 32),
+    ('sync_profiling', 'wecom.sync_profiling', _to_bool, False),
+    ('sync_profile_keep', 'wecom.sync_profile_keep', int, 20),
+    ('sync_chunk_size', 'wecom.sync_chunk_size', int, 500),
+    ('sync_workers', 'wecom.sync_workers', int, 4),
+    ('sync_run_retention_days', 'wecom.sync_run_retention_days', int, 90),
+]
+
+# Secrets of the snapshot, never returned to users outside base.group_system
+CREDENTIAL_PARAMETERS = ('corp_id', 'secret', 'token', 'aes_key')
+
+WeComConfigSnapshot = namedtuple('WeComConfigSnapshot', [parameter[0] for parameter in CONFIG_PARAMETERS])
+
+
+class WeComConfig(models.AbstractModel):
+    """
+    WeChat Work Configuration
+    Typed snapshot of all wecom.* system parameters, loaded in one query. The snapshot is
+    ormcached, and ir.config_parameter clears that cache whenever a parameter changes,
+    including through the settings form. Loading the snapshot also applies
+    wecom.api_cache_size to the response cache of the worker.
+    """
+    _name = 'wecom.config'
+    _description = 'WeChat Work Configuration'
+
+    @api.model
+    @tools.ormcache()
+    def _get_snapshot(self):
+        """
+        Get the WeChat Work configuration
+        :return: A WeComConfigSnapshot with every parameter converted to its type
+        """
+        self.env['ir.config_parameter'].flush_model()
+        self.env.cr.execute("SELECT key, value FROM ir_config_parameter WHERE key LIKE 'wecom.%'")
+        params = dict(self.env.cr.fetchall())
+        values = []
+        for _attribute, key, parser, default in CONFIG_PARAMETERS:
+            value = params.get(key)
+            try:
+                values.append(parser(value) if value else default)
+            except ValueError:
+                values.append(default)
+        snapshot = WeComConfigSnapshot(*values)
+        # The response cache is shared by the databases of the worker, the last loaded size applies
+        response_cache.resize(max(snapshot.api_cache_size, 0) * 1024 * 1024)
+        return snapshot
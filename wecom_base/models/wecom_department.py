@@ -4,6 +4,8 @@ from odoo import api, fields, models, _
 from odoo.exceptions import UserError
 import logging
 
+from .wecom_sync_profile import profiled
+
 _logger = logging.getLogger(__name__)
 
 
@@ -12,10 +14,12 @@ class WeComDepartment(models.Model):
     _description = 'WeChat Work Department'
     _parent_name = "parent_id"
     _parent_store = True
-    _rec_name = 'name'
+    _rec_name = 'complete_name'
     _order = 'parent_path'
 
     name = fields.Char(string='Department Name', required=True, translate=True)
+    complete_name = fields.Char(compute='_compute_complete_name', store=True,
+                                help="Full department name including parents")
     wecom_id = fields.Integer(string='WeChat Work Department ID', required=True)
     company_id = fields.Many2one('res.company', string='Company', required=True, default=lambda self: self.env.company)
     parent_id = fields.Many2one('wecom.department', string='Parent Department', index=True, ondelete='cascade')
@@ -34,94 +38,242 @@ class WeComDepartment(models.Model):
          'WeChat Work Department ID must be unique per company!')
     ]
 
+    def init(self):
+        # parent_path LIKE 'prefix%' lookups, the default btree index does not serve them
+        self.env.cr.execute("""
+            CREATE INDEX IF NOT EXISTS wecom_department_parent_path_pattern_idx
+            ON wecom_department (parent_path text_pattern_ops)
+        """)
+
+    @api.depends('name', 'parent_id.complete_name')
+    def _compute_complete_name(self):
+        """Compute the complete name of the department, recomputed for the moved or renamed subtree only"""
+        for department in self:
+            if department.parent_id:
+                department.complete_name = f"{department.parent_id.complete_name} / {department.name}"
+            else:
+                department.complete_name = department.name
+
     @api.depends('child_ids', 'child_ids.member_count')
     def _compute_member_count(self):
         for department in self:
             department.member_count = len(department.mapped('child_ids.member_count'))
 
     @api.model
+    @profiled
     def sync_departments(self):
-        api_service = self.env['wecom.api.service']
-        company = self.env.company
-
         try:
-            response = api_service.call_api(company.id, 'department/list', method='GET')
-            if response.get('errcode') == 0:
-                departments = response.get('department', [])
-                self._process_departments(departments)
-                return True
-            else:
-                raise UserError(_("WeChat Work API Error: [%(code)s] %(msg)s") % {
-                    'code': response.get('errcode'),
-                    'msg': response.get('errmsg')
-                })
+            self.env['wecom.sync.run']._execute('departments', self._fetch_departments, self._process_departments)
+            return True
         except Exception as e:
             _logger.error(f"Failed to sync WeChat Work departments: {str(e)}")
             raise UserError(_("Failed to sync departments: %s") % str(e))
 
+    @api.model
+    def _fetch_departments(self):
+        """
+        Fetch the departments of the current company
+        :return: (sort key, department data) pairs
+        """
+        api_service = self.env['wecom.api.service']
+        response = api_service.client.department_list(self.env.company._get_wecom_application().id)
+        if response.get('errcode') != 0:
+            raise UserError(_("WeChat Work API Error: [%(code)s] %(msg)s") % {
+                'code': response.get('errcode'),
+                'msg': response.get('errmsg')
+            })
+        return self._department_items(response.get('department', []))
+
+    @api.model
+    def _department_items(self, departments):
+        """
+        Key departments for a sync run
+        Sort keys put parents before their children, so a resumed run always finds the parents.
+        :param departments: Department data as returned by department/list
+        :return: (sort key, department data) pairs
+        """
+        parents = {dept_data['id']: dept_data.get('parentid') for dept_data in departments}
+        depths = {}
+        for dept_id in parents:
+            path = []
+            current = dept_id
+            while current in parents and current not in depths and current not in path:
+                path.append(current)
+                current = parents[current]
+            depth = depths.get(current, 0)
+            for ancestor in reversed(path):
+                depth += 1
+                depths[ancestor] = depth
+        return [(f"{depths[dept_data['id']]:04d}/{dept_data['id']:010d}", dept_data) for dept_data in departments]
+
     def _process_departments(self, departments):
+        company_id = self.env.company.id
+        # The departments of the chunk and their parents are loaded in one query, archived ones included.
+        # Parents come before their children, those created by the chunk are added as they are created
+        wecom_ids = {dept_data['id'] for dept_data in departments}
+        wecom_ids |= {dept_data['parentid'] for dept_data in departments if dept_data.get('parentid')}
+        known = {department.wecom_id: department for department in self.with_context(active_test=False).search(
+            [('wecom_id', 'in', list(wecom_ids)), ('company_id', '=', company_id)])}
+        to_create = []
+        queued_ids = set()
+
+        def create_pending():
+            for department in self.create(to_create):
+                known[department.wecom_id] = department
+            to_create.clear()
+            queued_ids.clear()
+
         for dept_data in departments:
-            existing_dept = self.search([('wecom_id', '=', dept_data['id']), ('company_id', '=', self.env.company.id)])
+            parent_wecom_id = dept_data.get('parentid')
+            if parent_wecom_id in queued_ids:
+                create_pending()
             vals = {
                 'name': dept_data['name'],
                 'wecom_id': dept_data['id'],
-                'company_id': self.env.company.id,
-                'parent_id': self.search(
-                    [('wecom_id', '=', dept_data.get('parentid')), ('company_id', '=', self.env.company.id)]).id,
+                'company_id': company_id,
+                'parent_id': known[parent_wecom_id].id if parent_wecom_id in known else False,
                 'wecom_order': dept_data.get('order', 0),
             }
+            existing_dept = known.get(dept_data['id'])
             if existing_dept:
                 existing_dept.write(vals)
             else:
-                self.create(vals)
+                to_create.append(vals)
+                queued_ids.add(dept_data['id'])
+        create_pending()
 
     def action_sync_to_odoo(self):
         self.ensure_one()
-        if not self.odoo_department_id:
-            odoo_dept = self.env['hr.department'].create({
-                'name': self.name,
-                'company_id': self.company_id.id,
-            })
-            self.odoo_department_id = odoo_dept.id
-        else:
-            self.odoo_department_id.write({
-                'name': self.name,
-            })
+        # Sync the whole subtree, parents first
+        self.get_descendants()._sync_odoo_departments()
+        return True
 
-        # Sync child departments
-        for child in self.child_ids:
-            child.action_sync_to_odoo()
-            child.odoo_department_id.parent_id = self.odoo_department_id.id
+    def _sync_odoo_departments(self):
+        """
+        Mirror the departments as hr.department records, in batches
+        Missing mirrors are created in one call, then names and parents are written once
+        per distinct value, and only where they differ.
+        """
+        missing = self.filtered(lambda dept: not dept.odoo_department_id)
+        odoo_depts = self.env['hr.department'].create([
+            {'name': dept.name, 'company_id': dept.company_id.id} for dept in missing
+        ])
+        for dept, odoo_dept in zip(missing, odoo_depts):
+            dept.odoo_department_id = odoo_dept
 
-        return True
+        renamed = (self - missing).filtered(lambda dept: dept.odoo_department_id.name != dept.name)
+        for name in set(renamed.mapped('name')):
+            renamed.filtered(lambda dept: dept.name == name).odoo_department_id.write({'name': name})
+
+        moved = self.filtered(
+            lambda dept: dept.odoo_department_id.parent_id != dept.parent_id.odoo_department_id)
+        for parent_id in set(moved.mapped(lambda dept: dept.parent_id.odoo_department_id.id)):
+            moved.filtered(lambda dept: dept.parent_id.odoo_department_id.id == parent_id).odoo_department_id.write(
+                {'parent_id': parent_id})
 
     @api.model
     def cron_sync_departments(self):
         companies = self.env['res.company'].search([('is_wecom_integrated', '=', True)])
-        for company in companies:
-            self.with_context(company_id=company.id).sync_departments()
-
-    def name_get(self):
-        result = []
-        for dept in self:
-            name = dept.name
-            if dept.parent_id:
-                name = f"{dept.parent_id.name} / {name}"
-            result.append((dept.id, name))
-        return result
+        self.env['wecom.sync.job'].enqueue(companies, ['departments'])
 
-    @api.model
-    def create(self, vals):
-        department = super(WeComDepartment, self).create(vals)
-        if not department.odoo_department_id:
-            department.action_sync_to_odoo()
-        return department
+    def _subtree_condition(self, alias='department'):
+        """
+        SQL condition matching the departments in the subtrees of these departments
+        :param alias: Alias of the wecom_department table in the query
+        :return: A tuple (condition, parameters), using the parent_path pattern index
+        """
+        paths = [path for path in self.mapped('parent_path') if path]
+        if not paths:
+            return 'FALSE', []
+        condition = ' OR '.join([f"{alias}.parent_path LIKE %s"] * len(paths))
+        return f"({condition})", [f"{path}%" for path in paths]
+
+    def _active_condition(self, alias='department'):
+        """SQL condition skipping archived departments, unless active_test is disabled like in search"""
+        return f"{alias}.active" if self.env.context.get('active_test', True) else 'TRUE'
+
+    def get_descendants(self, include_self=True):
+        """
+        Get the departments in the subtrees of these departments, in one query
+        Archived departments and departments hidden by record rules are skipped, as in search.
+        :param include_self: Whether these departments are included
+        :return: wecom.department records, ordered by parent_path
+        """
+        self.check_access_rights('read')
+        self.flush_model(['parent_path', 'active'])
+        condition, params = self._subtree_condition()
+        self.env.cr.execute(f"""
+            SELECT department.id FROM wecom_department department
+            WHERE {condition} AND {self._active_condition()}
+            ORDER BY department.parent_path
+        """, params)
+        descendants = self.browse([row[0] for row in self.env.cr.fetchall()])._filter_access_rules('read')
+        return descendants if include_self else descendants - self
+
+    def get_ancestors(self, include_self=False):
+        """
+        Get the ancestors of these departments, read from parent_path without any query
+        :param include_self: Whether these departments are included
+        :return: wecom.department records, roots first
+        """
+        ancestor_ids = []
+        for department in self:
+            path_ids = [int(dept_id) for dept_id in (department.parent_path or '').split('/') if dept_id]
+            if not include_self:
+                path_ids = path_ids[:-1]
+            ancestor_ids.extend(dept_id for dept_id in path_ids if dept_id not in ancestor_ids)
+        return self.browse(ancestor_ids)
+
+    def get_members(self, include_subtree=True):
+        """
+        Get the users of these departments, in one query
+        :param include_subtree: Whether the users of the sub-departments are included
+        :return: wecom.user records
+        """
+        return self._get_related_users('department_ids', include_subtree)
+
+    def get_leaders(self, include_subtree=False):
+        """
+        Get the leaders of these departments, in one query
+        :param include_subtree: Whether the leaders of the sub-departments are included
+        :return: wecom.user records
+        """
+        return self._get_related_users('leader_department_ids', include_subtree)
+
+    def _get_related_users(self, field_name, include_subtree):
+        """
+        Get the users linked to these departments through a many2many field of wecom.user
+        :param field_name: The wecom.user field, department_ids or leader_department_ids
+        :param include_subtree: Whether the users of the sub-departments are included
+        :return: wecom.user records, without those hidden by record rules
+        """
+        users = self.env['wecom.user']
+        users.check_access_rights('read')
+        field = users._fields[field_name]
+        users.flush_model([field_name])
+        self.flush_model(['parent_path', 'active'])
+        if include_subtree:
+            condition, params = self._subtree_condition()
+        else:
+            condition, params = 'department.id = ANY(%s)', [self.ids]
+        self.env.cr.execute(f"""
+            SELECT DISTINCT rel.{field.column1}
+            FROM {field.relation} rel
+            JOIN wecom_department department ON department.id = rel.{field.column2}
+            WHERE {condition} AND {self._active_condition()}
+        """, params)
+        return users.browse([row[0] for row in self.env.cr.fetchall()])._filter_access_rules('read')
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        departments = super(WeComDepartment, self).create(vals_list)
+        departments.filtered(lambda dept: not dept.odoo_department_id)._sync_odoo_departments()
+        return departments
 
     def write(self, vals):
         result = super(WeComDepartment, self).write(vals)
         if 'name' in vals or 'parent_id' in vals:
-            for department in self:
-                department.action_sync_to_odoo()
+            self._sync_odoo_departments()
         return result
 
     def unlink(self):
@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+
+import heapq
+import itertools
+import json
+import threading
+import time
+
+# requests 在首次发送请求时才导入，不处理企业微信请求的工作进程不加载它
+
+# 单次请求的超时秒数
+DEFAULT_TIMEOUT = 30
+HEADERS = {'Content-Type': 'application/json'}
+# 系统繁忙（-1，也用于网络错误）和接口调用超过频率限制（45009）时重试
+RETRYABLE_ERRCODES = (-1, 45009)
+# 每个请求最多发送的次数，以及首次重试前等待的秒数（之后每次加倍）
+RETRY_ATTEMPTS = 3
+RETRY_BACKOFF = 0.5
+# 优先级通道及其权重：排队时各通道按权重分配调用额度，空闲通道的额度由其他通道使用
+LANE_WEIGHTS = {
+    'alerting': 16,
+    'interactive': 8,
+    'sync': 2,
+    'bulk': 1,
+}
+DEFAULT_LANE = 'interactive'
+
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+
+class WeComHttpError(Exception):
+    """
+    网络错误或无法解析的响应
+    stats 为失败请求的统计信息，用于记录调用日志
+    """
+
+    def __init__(self, message, stats):
+        super().__init__(message)
+        self.stats = stats
+
+
+class WeComResponseError(Exception):
+    """企业微信返回了非 0 的 errcode"""
+
+    def __init__(self, endpoint, result):
+        self.endpoint = endpoint
+        self.errcode = result.get('errcode')
+        self.errmsg = result.get('errmsg')
+        super().__init__(f"[{self.errcode}] {self.errmsg}")
+
+
+def send_request(url, method='GET', params=None, data=None, session=None, timeout=DEFAULT_TIMEOUT):
+    """
+    发送企业微信 API 请求
+    不依赖 Odoo 环境和数据库游标，可在任意线程中调用
+    :param url: 完整 URL
+    :param method: HTTP 方法 ('GET' 或 'POST')
+    :param params: URL 参数
+    :param data: POST 数据
+    :param session: 复用连接的 requests.Session，可选
+    :param timeout: 超时秒数
+    :return: (解析后的 API 响应, 请求统计)，统计包含 errcode、duration_ms、request_bytes 和 response_bytes
+    :raise WeComHttpError: 网络错误或响应无法解析
+    """
+    import requests
+    method = method.upper()
+    body = json.dumps(data) if method == 'POST' else None
+    stats = {
+        # 解析响应前为 -1（系统繁忙），网络错误也计为错误
+        'errcode': -1,
+        'duration_ms': 0.0,
+        'request_bytes': len(body.encode()) if body else 0,
+        'response_bytes': 0,
+    }
+    http = session or requests
+    start = time.perf_counter()
+    try:
+        if method == 'GET':
+            response = http.get(url, params=params, headers=HEADERS, timeout=timeout)
+        else:
+            response = http.post(url, params=params, data=body, headers=HEADERS, timeout=timeout)
+        response.raise_for_status()
+        stats['response_bytes'] = len(response.content)
+        result = response.json()
+        stats['errcode'] = result.get('errcode')
+        return result, stats
+    except (requests.RequestException, ValueError) as e:
+        raise WeComHttpError(str(e), stats) from e
+    finally:
+        stats['duration_ms'] = (time.perf_counter() - start) * 1000
+
+
+def check_result(endpoint, result):
+    """
+    检查 API 响应的 errcode
+    :param endpoint: API 端点
+    :param result: 解析后的 API 响应
+    :return: API 响应
+    :raise WeComResponseError: errcode 不为 0
+    """
+    if result.get('errcode') != 0:
+        raise WeComResponseError(endpoint, result)
+    return result
+
+
+class RateLimiter(object):
+    """
+    带优先级通道的令牌桶限流器，线程安全
+    每秒最多 rate 次调用，空闲后可突发 burst 次。额度不足时调用排队，按加权公平队列
+    （虚拟完成时间）出队：每个通道获得与 LANE_WEIGHTS 中权重成比例的额度，
+    告警消息不会排在大批量发送之后，而没有其他通道排队时批量调用可使用全部额度。
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(rate, 1)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.condition = threading.Condition()
+        self.queue = []
+        self.sequence = itertools.count()
+        # 已出队调用的最大虚拟完成时间，以及各通道最后一个排队调用的虚拟完成时间
+        self.virtual_time = 0.0
+        self.lane_finish = {}
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, lane=DEFAULT_LANE):
+        """
+        等待一个调用额度
+        :param lane: 优先级通道，见 LANE_WEIGHTS
+        :return: 等待的秒数
+        """
+        if not self.rate:
+            return 0.0
+        start = time.monotonic()
+        with self.condition:
+            # 空闲过的通道从当前虚拟时间开始计算，不能积攒额度
+            finish = max(self.virtual_time, self.lane_finish.get(lane, 0.0)) + 1.0 / LANE_WEIGHTS.get(lane, 1)
+            self.lane_finish[lane] = finish
+            entry = (finish, next(self.sequence))
+            heapq.heappush(self.queue, entry)
+            while True:
+                if self.queue[0] == entry:
+                    self._refill()
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        heapq.heappop(self.queue)
+                        self.virtual_time = max(self.virtual_time, finish)
+                        # 唤醒下一个排队的调用
+                        self.condition.notify_all()
+                        return time.monotonic() - start
+                    self.condition.wait((1 - self.tokens) / self.rate)
+                else:
+                    self.condition.wait()
+
+
+def get_rate_limiter(key, rate):
+    """
+    获取进程内共享的限流器，同一应用（agent）的所有并发调用共用一个额度，按优先级通道公平分配
+    :param key: 限流器的键，如 (数据库名, 应用ID)
+    :param rate: 每秒最多调用次数，0 表示不限流
+    :return: RateLimiter
+    """
+    with _rate_limiters_lock:
+        limiter = _rate_limiters.get(key)
+        if limiter is None or limiter.rate != rate:
+            limiter = _rate_limiters[key] = RateLimiter(rate)
+        return limiter
+
+
+def make_session(pool_size):
+    """
+    创建连接池大小为 pool_size 的 requests.Session，供并发请求复用连接
+    :param pool_size: 连接池大小，通常等于并发数
+    :return: requests.Session
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def send_with_retry(url, method='GET', params=None, data=None, session=None, limiter=None,
+                    attempts=RETRY_ATTEMPTS, backoff=RETRY_BACKOFF, lane=DEFAULT_LANE):
+    """
+    发送请求，系统繁忙、超过频率限制和网络错误时按指数退避重试
+    不依赖 Odoo 环境，可在任意线程中调用；每次发送前都从限流器获取额度
+    只重试 GET 请求：POST（如 message/send、user/create）可能已被企业微信执行，重发会重复执行
+    :param url: 完整 URL
+    :param method: HTTP 方法 ('GET' 或 'POST')
+    :param params: URL 参数
+    :param data: POST 数据
+    :param session: 复用连接的 requests.Session，可选
+    :param limiter: RateLimiter，可选
+    :param attempts: GET 请求的最多发送次数，POST 请求只发送一次
+    :param backoff: 首次重试前等待的秒数
+    :param lane: 限流器的优先级通道
+    :return: (API 响应, 每次发送的请求统计列表, 异常)，最后一次仍为网络错误时响应为 None、异常为 WeComHttpError
+    """
+    if method != 'GET':
+        attempts = 1
+    all_stats = []
+    error = None
+    for attempt in range(attempts):
+        if attempt:
+            time.sleep(backoff * 2 ** (attempt - 1))
+        if limiter:
+            limiter.acquire(lane)
+        try:
+            result, stats = send_request(url, method, params=params, data=data, session=session)
+        except WeComHttpError as e:
+            all_stats.append(e.stats)
+            error = e
+            continue
+        all_stats.append(stats)
+        if result.get('errcode') not in RETRYABLE_ERRCODES or attempt == attempts - 1:
+            return result, all_stats, None
+    return None, all_stats, error
+
+
+def download(url, etag=None, last_modified=None, session=None, timeout=DEFAULT_TIMEOUT):
+    """
+    下载文件（头像、二维码等），带上次的 ETag / Last-Modified 时发送条件请求
+    :param url: 文件 URL
+    :param etag: 上次下载的 ETag
+    :param last_modified: 上次下载的 Last-Modified
+    :param session: 复用连接的 requests.Session，可选
+    :param timeout: 超时秒数
+    :return: (内容, ETag, Last-Modified)，未修改（304）时内容为 None
+    :raise WeComHttpError: 网络错误
+    """
+    import requests
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+    start = time.perf_counter()
+    try:
+        response = (session or requests).get(url, headers=headers, timeout=timeout)
+        if response.status_code == 304:
+            return None, etag, last_modified
+        response.raise_for_status()
+        return response.content, response.headers.get('ETag'), response.headers.get('Last-Modified')
+    except requests.RequestException as e:
+        raise WeComHttpError(str(e), {'duration_ms': (time.perf_counter() - start) * 1000}) from e
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+
+import base64
+import hashlib
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import psycopg2
+
+from odoo import api, fields, models
+
+from .wecom_api_log import _auto_commit
+from .wecom_http import download, make_session
+
+_logger = logging.getLogger(__name__)
+
+# Downloaded media are checked again for changes after this long, with a conditional request
+MEDIA_REFRESH_INTERVAL = timedelta(days=7)
+# Failed downloads are retried by the prefetch cron after this long
+MEDIA_RETRY_INTERVAL = timedelta(days=1)
+# Media downloaded per prefetch cron run
+MEDIA_PREFETCH_BATCH = 200
+# Seconds between two prefetch cron triggers for viewed media, per database and worker
+MEDIA_TRIGGER_INTERVAL = 10
+
+# Last prefetch cron trigger per database in this worker
+_last_triggers = {}
+
+
+def _fetch(job):
+    url, etag, last_modified, session = job
+    try:
+        return download(url, etag, last_modified, session=session) + (None,)
+    except Exception as e:
+        return None, None, None, str(e)
+
+
+class WeComMediaBlob(models.Model):
+    """
+    WeChat Work Media Content
+    Image content addressed by its checksum: identical images, such as the default
+    avatar, are stored once whatever the number of URLs serving them. The thumbnail
+    is generated once, when the content is stored.
+    """
+    _name = 'wecom.media.blob'
+    _description = 'WeChat Work Media Content'
+
+    checksum = fields.Char(string='Checksum', required=True, index=True, readonly=True)
+    image = fields.Image(string='Image', max_width=1024, max_height=1024, readonly=True)
+    image_128 = fields.Image(string='Thumbnail', related='image', max_width=128, max_height=128, store=True)
+
+    _sql_constraints = [
+        ('checksum_uniq', 'unique(checksum)', 'Media content must be unique!')
+    ]
+
+    @api.model
+    def _get_blob(self, content):
+        """
+        Get the blob holding some content, stored if new
+        :param content: Raw image bytes
+        :return: A wecom.media.blob record
+        """
+        checksum = hashlib.sha1(content).hexdigest()
+        blob = self.search([('checksum', '=', checksum)], limit=1)
+        if blob:
+            return blob
+        try:
+            with self.env.cr.savepoint():
+                return self.create({'checksum': checksum, 'image': base64.b64encode(content)})
+        except psycopg2.IntegrityError:
+            # Stored meanwhile by a concurrent download
+            return self.search([('checksum', '=', checksum)], limit=1)
+
+
+class WeComMedia(models.Model):
+    """
+    WeChat Work Media
+    An upstream media URL (avatar, QR code) and its downloaded content. Syncs only register
+    URLs; the content is downloaded by the bounded prefetch cron, which is triggered when
+    pending media are viewed and downloads them first.
+    """
+    _name = 'wecom.media'
+    _description = 'WeChat Work Media'
+    _rec_name = 'url'
+
+    url = fields.Char(string='URL', required=True, index=True, readonly=True)
+    blob_id = fields.Many2one('wecom.media.blob', string='Content', readonly=True, ondelete='set null')
+    state = fields.Selection([
+        ('pending', 'Pending'),
+        ('done', 'Downloaded'),
+        ('failed', 'Failed'),
+    ], string='Status', default='pending', required=True, index=True, readonly=True)
+    etag = fields.Char(string='ETag', readonly=True)
+    last_modified = fields.Char(string='Last Modified', readonly=True)
+    fetch_date = fields.Datetime(string='Last Download', readonly=True)
+    error = fields.Char(string='Error', readonly=True)
+    requested = fields.Boolean(string='Requested', readonly=True,
+                               help="Viewed before it was downloaded, the prefetch cron downloads it first")
+
+    _sql_constraints = [
+        ('url_uniq', 'unique(url)', 'Media URL must be unique!')
+    ]
+
+    @api.model
+    def _register(self, urls):
+        """
+        Get the media of URLs, creating the missing ones without downloading anything
+        :param urls: Media URLs, empty values are ignored
+        :return: A dictionary {url: wecom.media ID}
+        """
+        urls = list({url for url in urls if url})
+        if not urls:
+            return {}
+        self.flush_model(['url'])
+        # Concurrent syncs of other companies may register the same URLs
+        self.env.cr.execute("""
+            INSERT INTO wecom_media (url, state, create_uid, create_date, write_uid, write_date)
+            SELECT url, 'pending', %(uid)s, now() AT TIME ZONE 'UTC', %(uid)s, now() AT TIME ZONE 'UTC'
+            FROM unnest(%(urls)s::varchar[]) AS url
+            ON CONFLICT (url) DO NOTHING
+        """, {'uid': self.env.uid, 'urls': urls})
+        self.env.cr.execute("SELECT url, id FROM wecom_media WHERE url = ANY(%s)", [urls])
+        return dict(self.env.cr.fetchall())
+
+    def _request_content(self):
+        """
+        Queue the media that were never downloaded for the prefetch cron, used when they are viewed
+        Nothing is downloaded here: the viewer gets empty images until the cron has run.
+        """
+        pending = self.filtered(lambda media: media.state == 'pending' and not media.requested)
+        if not pending:
+            return
+        self.env.cr.execute(
+            "UPDATE wecom_media SET requested = TRUE WHERE id = ANY(%s) AND state = 'pending'", [pending.ids])
+        pending.invalidate_recordset(['requested'])
+        self._trigger_prefetch()
+
+    @api.model
+    def _trigger_prefetch(self):
+        dbname = self.env.cr.dbname
+        now = time.monotonic()
+        if now - _last_triggers.get(dbname, -MEDIA_TRIGGER_INTERVAL) < MEDIA_TRIGGER_INTERVAL:
+            return
+        cron = self.env.ref('wecom_base.ir_cron_prefetch_media', raise_if_not_found=False)
+        if cron:
+            cron.sudo()._trigger()
+            _last_triggers[dbname] = now
+
+    def _download(self):
+        """
+        Download media concurrently
+        Media already downloaded are requested conditionally, an unchanged image is not transferred again.
+        """
+        if not self:
+            return
+        workers = self.env['wecom.config']._get_snapshot().api_max_workers
+        session = make_session(workers)
+        jobs = [
+            (media.url, media.etag if media.blob_id else None, media.last_modified if media.blob_id else None, session)
+            for media in self
+        ]
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, min(workers, len(jobs)))) as executor:
+                results = list(executor.map(_fetch, jobs))
+        finally:
+            session.close()
+
+        blobs = self.env['wecom.media.blob']
+        now = fields.Datetime.now()
+        for media, (content, etag, last_modified, error) in zip(self, results):
+            if error:
+                media.write({'state': 'failed', 'error': error, 'fetch_date': now, 'requested': False})
+                continue
+            vals = {'state': 'done', 'error': False, 'fetch_date': now, 'etag': etag, 'last_modified': last_modified,
+                    'requested': False}
+            if content is not None:
+                try:
+                    vals['blob_id'] = blobs._get_blob(content).id
+                except Exception as e:
+                    # Not an image, e.g. an error page
+                    vals = {'state': 'failed', 'error': str(e), 'fetch_date': now, 'requested': False}
+            media.write(vals)
+
+    @api.model
+    def cron_prefetch_media(self):
+        """Download a batch of pending media, viewed ones first, then retry failed ones and refresh stale ones"""
+        now = fields.Datetime.now()
+        domains = [
+            [('state', '=', 'pending'), ('requested', '=', True)],
+            [('state', '=', 'pending')],
+            [('state', '=', 'failed'), ('fetch_date', '<', now - MEDIA_RETRY_INTERVAL)],
+            [('state', '=', 'done'), ('fetch_date', '<', now - MEDIA_REFRESH_INTERVAL)],
+        ]
+        remaining = MEDIA_PREFETCH_BATCH
+        for domain in domains:
+            media = self.search(domain, limit=remaining, order='id')
+            media._download()
+            _auto_commit(self.env.cr)
+            remaining -= len(media)
+            if remaining <= 0:
+                break
+
+    @api.autovacuum
+    def _gc_media(self):
+        """Delete media no user refers to any more, then unused content"""
+        self.env['wecom.user'].flush_model(['avatar_media_id', 'qr_code_media_id'])
+        self.env.cr.execute("""
+            SELECT media.id FROM wecom_media media
+            WHERE NOT EXISTS (
+                SELECT 1 FROM wecom_user u WHERE u.avatar_media_id = media.id OR u.qr_code_media_id = media.id
+            )
+        """)
+        self.browse([row[0] for row in self.env.cr.fetchall()]).unlink()
+        self.flush_model(['blob_id'])
+        self.env.cr.execute("""
+            SELECT blob.id FROM wecom_media_blob blob
+            WHERE NOT EXISTS (SELECT 1 FROM wecom_media media WHERE media.blob_id = blob.id)
+        """)
+        self.env['wecom.media.blob'].browse([row[0] for row in self.env.cr.fetchall()]).unlink()
@@ -1,12 +1,21 @@
 # -*- coding: utf-8 -*-
 
+import hashlib
 import json
 import logging
+import re
+from datetime import timedelta
 from odoo import api, fields, models, _
-from odoo.exceptions import UserError
+from odoo.exceptions import UserError, ValidationError
+
+from .wecom_callback import callback_handlers
 
 _logger = logging.getLogger(__name__)
 
+# Longest duplicate check interval accepted by message/send, in seconds
+MAX_DUPLICATE_CHECK_INTERVAL = 4 * 3600
+_RECIPIENT_SPLIT = re.compile(r'[|,\s]+')
+
 
 class WeComMessage(models.Model):
     _name = 'wecom.message'
@@ -38,24 +47,88 @@ class WeComMessage(models.Model):
     state = fields.Selection([
         ('draft', 'Draft'),
         ('sent', 'Sent'),
+        ('duplicate', 'Duplicate'),
         ('failed', 'Failed'),
     ], string='Status', default='draft', readonly=True)
     send_time = fields.Datetime(string='Send Time', readonly=True)
+    priority = fields.Selection([
+        ('alerting', 'Alert'),
+        ('interactive', 'Normal'),
+        ('bulk', 'Bulk'),
+    ], string='Priority', required=True, default='interactive',
+        help="Alerts are sent before the other API calls of the application waiting for the rate limit, "
+             "bulk messages use the capacity left by the others")
     error_message = fields.Text(string='Error Message', readonly=True)
+    enable_duplicate_check = fields.Boolean(string='Duplicate Check', default=True,
+                                            help="Do not send the message when the same content was sent to the "
+                                                 "same recipients within the duplicate check interval")
+    duplicate_check_interval = fields.Integer(string='Duplicate Check Interval (s)', default=1800)
+    fingerprint = fields.Char(string='Fingerprint', compute='_compute_fingerprint', store=True, index=True,
+                              help="Hash of the company, content and recipients of the message")
+    duplicate_of_id = fields.Many2one('wecom.message', string='Duplicate Of', readonly=True, copy=False)
+
+    @api.constrains('duplicate_check_interval')
+    def _check_duplicate_check_interval(self):
+        for message in self:
+            if not 0 < message.duplicate_check_interval <= MAX_DUPLICATE_CHECK_INTERVAL:
+                raise ValidationError(_("The duplicate check interval must be between 1 and %s seconds.")
+                                      % MAX_DUPLICATE_CHECK_INTERVAL)
+
+    @api.depends('company_id', 'message_type', 'content', 'recipient_type', 'recipient_ids')
+    def _compute_fingerprint(self):
+        for message in self:
+            recipients = sorted({recipient for recipient in _RECIPIENT_SPLIT.split(message.recipient_ids or '')
+                                 if recipient})
+            key = json.dumps([message.company_id.id, message.message_type, message.content or '',
+                              message.recipient_type, recipients])
+            message.fingerprint = hashlib.sha256(key.encode()).hexdigest()
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        unnamed = [vals for vals in vals_list if vals.get('name', 'New') == 'New']
+        for vals, name in zip(unnamed, self._next_names(len(unnamed))):
+            vals['name'] = name
+        return super(WeComMessage, self).create(vals_list)
 
     @api.model
-    def create(self, vals):
-        if vals.get('name', 'New') == 'New':
-            vals['name'] = self.env['ir.sequence'].next_by_code('wecom.message') or 'New'
-        return super(WeComMessage, self).create(vals)
+    def _next_names(self, count):
+        """
+        Get the next message names of the wecom.message sequence
+        A standard sequence hands out all the numbers in one query.
+        :param count: Number of names
+        :return: A list of names, 'New' when the sequence is missing
+        """
+        if not count:
+            return []
+        sequence = self.env['ir.sequence'].sudo().search([
+            ('code', '=', 'wecom.message'),
+            ('company_id', 'in', [self.env.company.id, False]),
+        ], order='company_id', limit=1)
+        if not sequence:
+            return ['New'] * count
+        if sequence.implementation != 'standard' or sequence.use_date_range:
+            return [sequence._next() for _index in range(count)]
+        self.env.cr.execute("SELECT nextval(%s) FROM generate_series(1, %s)",
+                            [f"ir_sequence_{sequence.id:03d}", count])
+        prefix, suffix = sequence._get_prefix_suffix()
+        return [f"{prefix}{number:0{sequence.padding}d}{suffix}" for (number,) in self.env.cr.fetchall()]
 
     def action_send(self):
         self.ensure_one()
+        # Concurrent sends of this message wait here; they then fail to serialize and are
+        # retried by Odoo, finding the message already sent
+        self.flush_recordset()
+        self.env.cr.execute("SELECT id FROM wecom_message WHERE id = %s FOR UPDATE", [self.id])
+        self.invalidate_recordset(['state'])
+        if self.state in ('sent', 'duplicate'):
+            return True
         if self.state != 'draft':
             raise UserError(_("Only draft messages can be sent."))
+        if self._check_duplicate():
+            return True
 
         try:
-            self._send_message()
+            self.with_context(wecom_lane=self.priority)._send_message()
             self.write({
                 'state': 'sent',
                 'send_time': fields.Datetime.now(),
@@ -68,14 +141,58 @@ class WeComMessage(models.Model):
             _logger.error(f"Failed to send WeChat Work message: {str(e)}")
             raise UserError(_("Failed to send message: %s") % str(e))
 
+    def _check_duplicate(self):
+        """
+        Look for the same message sent within the duplicate check interval, before any HTTP call
+        Messages with the same fingerprint are serialized by an advisory lock: while another
+        transaction sends one, this message is refused and can be sent again later.
+        :return: True when the message is a duplicate, it is then marked as such
+        """
+        self.ensure_one()
+        if not self.enable_duplicate_check:
+            return False
+        if not self._try_fingerprint_lock():
+            raise UserError(_("An identical message is being sent, please try again later."))
+        # The snapshot predates the lock: an identical message sent and committed meanwhile is
+        # invisible to the search below, but locking its row fails to serialize, and Odoo
+        # retries the send with a new snapshot that sees it
+        self.env.cr.execute("SELECT id FROM wecom_message WHERE fingerprint = %s AND id != %s FOR UPDATE",
+                            [self.fingerprint, self.id])
+        original = self.search([
+            ('fingerprint', '=', self.fingerprint),
+            ('state', '=', 'sent'),
+            ('send_time', '>=', fields.Datetime.now() - timedelta(seconds=self.duplicate_check_interval)),
+            ('id', '!=', self.id),
+        ], order='send_time desc', limit=1)
+        if not original:
+            return False
+        self.write({'state': 'duplicate', 'duplicate_of_id': original.id})
+        _logger.info(f"WeChat Work message {self.name} is a duplicate of {original.name}, not sent")
+        return True
+
+    def _try_fingerprint_lock(self):
+        """Take the transaction advisory lock of the fingerprint, without waiting"""
+        # pg_try_advisory_xact_lock takes a signed 64-bit key
+        key = int(self.fingerprint[:16], 16) - (1 << 63)
+        self.env.cr.execute("SELECT pg_try_advisory_xact_lock(%s)", [key])
+        return self.env.cr.fetchone()[0]
+
     def _send_message(self):
         self.ensure_one()
         api_service = self.env['wecom.api.service']
 
+        app = self.env['wecom.application'].search([('company_id', '=', self.company_id.id)], limit=1)
+        if not app:
+            raise UserError(_("No WeChat Work application configured for this company."))
+
         message_data = {
             'msgtype': self.message_type,
+            'agentid': app.agent_id,
             self.message_type: self._prepare_message_content(),
         }
+        if self.enable_duplicate_check:
+            # WeChat Work also drops the same message sent again within the interval, whatever sent it
+            message_data.update(enable_duplicate_check=1, duplicate_check_interval=self.duplicate_check_interval)
 
         if self.recipient_type == 'user':
             message_data['touser'] = self.recipient_ids
@@ -84,11 +201,7 @@ class WeComMessage(models.Model):
         elif self.recipient_type == 'tag':
             message_data['totag'] = self.recipient_ids
 
-        app = self.env['wecom.application'].search([('company_id', '=', self.company_id.id)], limit=1)
-        if not app:
-            raise UserError(_("No WeChat Work application configured for this company."))
-
-        response = api_service.call_api(app.id, 'message/send', method='POST', data=message_data)
+        response = api_service.client.message_send(app.id, **message_data)
         if response.get('errcode') != 0:
             raise UserError(_("WeChat Work API Error: [%(code)s] %(msg)s") % {
                 'code': response.get('errcode'),
@@ -114,6 +227,12 @@ class WeComMessage(models.Model):
         # This could involve creating a record, triggering actions, etc.
         return True
 
+    @api.model
+    def _callback_text_messages(self, messages):
+        """Handle text messages received by the callback, see wecom.callback.event"""
+        for message in messages:
+            self.process_incoming_message(message)
+
 
 class WeComMessageTemplate(models.Model):
     _name = 'wecom.message.template'
@@ -135,4 +254,7 @@ class WeComMessageTemplate(models.Model):
                 'default_content': self.content,
             },
             'target': 'new',
-        }
\ No newline at end of file
+        }
+
+
+callback_handlers.register('text', model='wecom.message', method='_callback_text_messages')
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds of the duration histogram buckets, in milliseconds
+DURATION_BUCKETS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000, 300000)
+# Upper bounds of the SQL query count histogram buckets
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000, 10000, 50000)
+PERCENTILES = (0.5, 0.95, 0.99)
+
+
+def _label_key(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(label_key, extra=()):
+    pairs = list(label_key) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in pairs) + '}'
+
+
+class Histogram(object):
+    """Cumulative histogram with fixed buckets, percentiles are interpolated within buckets"""
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.total += value
+        self.count += 1
+        self.max = max(self.max, value)
+
+    def percentile(self, q):
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = self.bounds[index - 1] if index else 0.0
+                upper = self.bounds[index] if index < len(self.bounds) else self.max
+                return min(lower + (upper - lower) * (rank - seen) / count, self.max)
+            seen += count
+        return self.max
+
+    def to_dict(self):
+        result = {'count': self.count, 'sum': round(self.total, 3), 'max': round(self.max, 3)}
+        for q in PERCENTILES:
+            value = self.percentile(q)
+            result[f"p{int(q * 100)}"] = round(value, 3) if value is not None else None
+        return result
+
+
+class MetricsRegistry(object):
+    """
+    In-process counters and histograms
+    Every worker process keeps its own metrics; a scrape of /wecom/metrics reports the
+    worker that served it, so sum counters across scrapes per instance.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._help = {}
+
+    def inc(self, name, amount=1, description=None, **labels):
+        """Increment a counter"""
+        key = _label_key(labels)
+        with self._lock:
+            self._help.setdefault(name, description)
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+
+    def observe(self, name, value, bounds=DURATION_BUCKETS_MS, description=None, **labels):
+        """Record a value in a histogram"""
+        key = _label_key(labels)
+        with self._lock:
+            self._help.setdefault(name, description)
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram(bounds)
+            histogram.observe(value)
+
+    @contextmanager
+    def track(self, prefix, cr=None, **labels):
+        """
+        Record the duration and the SQL query count of a block of code
+        Observed as <prefix>_duration_ms and <prefix>_queries, errors are counted in <prefix>_errors_total.
+        :param prefix: Name prefix of the metrics
+        :param cr: Cursor whose queries are counted, if any
+        :param labels: Labels of the metrics
+        """
+        queries = cr.sql_log_count if cr is not None else 0
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.inc(f"{prefix}_errors_total", **labels)
+            raise
+        finally:
+            self.observe(f"{prefix}_duration_ms", (time.perf_counter() - start) * 1000, **labels)
+            if cr is not None:
+                self.observe(f"{prefix}_queries", cr.sql_log_count - queries, bounds=QUERY_BUCKETS, **labels)
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def to_dict(self):
+        """Get all metrics, with percentiles for histograms"""
+        with self._lock:
+            return {
+                'counters': {
+                    name: [dict(labels=dict(key), value=value) for key, value in series.items()]
+                    for name, series in self._counters.items()
+                },
+                'histograms': {
+                    name: [dict(labels=dict(key), **histogram.to_dict()) for key, histogram in series.items()]
+                    for name, series in self._histograms.items()
+                },
+            }
+
+    def to_prometheus(self):
+        """Get all metrics in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                if self._help.get(name):
+                    lines.append(f"# HELP wecom_{name} {self._help[name]}")
+                lines.append(f"# TYPE wecom_{name} counter")
+                for key, value in series.items():
+                    lines.append(f"wecom_{name}{_format_labels(key)} {value}")
+            for name, series in sorted(self._histograms.items()):
+                if self._help.get(name):
+                    lines.append(f"# HELP wecom_{name} {self._help[name]}")
+                lines.append(f"# TYPE wecom_{name} histogram")
+                for key, histogram in series.items():
+                    cumulative = 0
+                    for bound, count in zip(list(histogram.bounds) + [math.inf], histogram.counts):
+                        cumulative += count
+                        le = '+Inf' if bound == math.inf else repr(float(bound))
+                        lines.append(f"wecom_{name}_bucket{_format_labels(key, [('le', le)])} {cumulative}")
+                    lines.append(f"wecom_{name}_sum{_format_labels(key)} {histogram.total}")
+                    lines.append(f"wecom_{name}_count{_format_labels(key)} {histogram.count}")
+        return '\n'.join(lines) + '\n'
+
+
+metrics = MetricsRegistry()
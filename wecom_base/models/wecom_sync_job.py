@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+
+import json
+import logging
+import threading
+import time
+from datetime import timedelta
+
+from odoo import api, fields, models
+
+from .wecom_api_log import _auto_commit
+from .wecom_sync_pipeline import SYNC_LANE
+from .wecom_sync_run import COMMIT_CONTEXT_KEY, JOB_CONTEXT_KEY, STALE_RUN_TIMEOUT
+
+_logger = logging.getLogger(__name__)
+
+# Synchronized entities in dependency order, with their model
+SYNC_ENTITIES = [
+    ('departments', 'wecom.department'),
+    ('users', 'wecom.user'),
+    ('tags', 'wecom.tag'),
+]
+ENTITY_SEQUENCE = {entity: sequence for sequence, (entity, _model) in enumerate(SYNC_ENTITIES)}
+ENTITY_MODELS = dict(SYNC_ENTITIES)
+
+# A worker stops claiming jobs after this many seconds, leaving the rest to the next run
+WORKER_TIME_BUDGET = 600
+# A running job without a heartbeat for this long lost its worker and is requeued,
+# the sync refreshes the heartbeat at every checkpoint of its run
+STALE_JOB_TIMEOUT = STALE_RUN_TIMEOUT
+MAX_ATTEMPTS = 3
+WORKER_CRON_CODE = 'model.cron_process_jobs()'
+
+
+class WeComSyncJob(models.Model):
+    """
+    WeChat Work Sync Job
+    One synchronization of one entity for one company. Jobs are claimed by the worker
+    crons with SELECT ... FOR UPDATE SKIP LOCKED, so several cron workers process
+    different companies at the same time. A job waits until the jobs of the earlier
+    entities of its company (departments, then users, then tags) are finished, and
+    the companies with the fewest running jobs are served first.
+    """
+    _name = 'wecom.sync.job'
+    _description = 'WeChat Work Sync Job'
+    _order = 'id desc'
+
+    entity = fields.Selection([
+        ('departments', 'Departments'),
+        ('users', 'Users'),
+        ('tags', 'Tags'),
+    ], string='Entity', required=True, readonly=True)
+    sequence = fields.Integer(string='Sequence', readonly=True, help="Dependency order of the entity")
+    company_id = fields.Many2one('res.company', string='Company', required=True, readonly=True,
+                                 ondelete='cascade')
+    state = fields.Selection([
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ], string='Status', default='pending', required=True, readonly=True)
+    attempt = fields.Integer(string='Attempts', readonly=True)
+    start_time = fields.Datetime(string='Start Time', readonly=True)
+    end_time = fields.Datetime(string='End Time', readonly=True)
+    heartbeat = fields.Datetime(string='Last Heartbeat', readonly=True,
+                                help="Last checkpoint of the running sync")
+    duration = fields.Float(string='Duration (s)', readonly=True)
+    error = fields.Text(string='Error', readonly=True)
+    run_id = fields.Many2one('wecom.sync.run', string='Sync Run', readonly=True, ondelete='set null')
+
+    def init(self):
+        self.env.cr.execute("""
+            CREATE INDEX IF NOT EXISTS wecom_sync_job_open_idx
+            ON wecom_sync_job (company_id, sequence) WHERE state IN ('pending', 'running')
+        """)
+        # One pending job per company and entity, whatever the concurrent enqueues
+        self.env.cr.execute("""
+            DELETE FROM wecom_sync_job job
+            USING wecom_sync_job other
+            WHERE job.state = 'pending' AND other.state = 'pending'
+              AND other.company_id = job.company_id AND other.entity = job.entity
+              AND other.id < job.id
+        """)
+        self.env.cr.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS wecom_sync_job_pending_uniq
+            ON wecom_sync_job (company_id, entity) WHERE state = 'pending'
+        """)
+
+    @api.model
+    def enqueue(self, companies, entities=None):
+        """
+        Queue sync jobs and wake up the workers
+        A job already pending for the same company and entity is not queued twice.
+        :param companies: res.company records to synchronize
+        :param entities: Entities to synchronize, all by default
+        :return: The queued wecom.sync.job records
+        """
+        entities = entities or [entity for entity, _model in SYNC_ENTITIES]
+        pairs = [(company.id, entity) for company in companies for entity in entities]
+        if not pairs:
+            return self.browse()
+        self.flush_model()
+        # Concurrent enqueues of the same job wait for each other, the later one inserts nothing
+        self.env.cr.execute("""
+            INSERT INTO wecom_sync_job (company_id, entity, sequence, state, attempt,
+                                        create_uid, create_date, write_uid, write_date)
+            SELECT company_id, entity, (%(sequences)s::jsonb ->> entity)::int, 'pending', 0,
+                   %(uid)s, now() AT TIME ZONE 'UTC', %(uid)s, now() AT TIME ZONE 'UTC'
+            FROM unnest(%(company_ids)s::int[], %(entities)s::varchar[]) AS job(company_id, entity)
+            ON CONFLICT (company_id, entity) WHERE state = 'pending' DO NOTHING
+            RETURNING id
+        """, {
+            'sequences': json.dumps(ENTITY_SEQUENCE),
+            'company_ids': [company_id for company_id, _entity in pairs],
+            'entities': [entity for _company_id, entity in pairs],
+            'uid': self.env.uid,
+        })
+        jobs = self.browse([row[0] for row in self.env.cr.fetchall()])
+        if jobs:
+            for cron in self._get_worker_crons().filtered('active'):
+                cron._trigger()
+        return jobs
+
+    @api.model
+    def _get_worker_crons(self):
+        return self.env['ir.cron'].sudo().with_context(active_test=False).search([
+            ('model_id.model', '=', self._name),
+            ('code', '=', WORKER_CRON_CODE),
+        ])
+
+    @api.model
+    def _setup_worker_crons(self):
+        """
+        Make wecom.sync_workers worker crons active, one cron runs one job at a time
+        Archived workers are reactivated before new ones are created; workers beyond the
+        count are archived, the most recent first. Called when the settings are saved and
+        at upgrade.
+        """
+        crons = self._get_worker_crons().sorted('id')
+        count = max(self.env['wecom.config']._get_snapshot().sync_workers, 1)
+        active = crons.filtered('active')
+        if len(active) >= count:
+            active[count:].write({'active': False})
+            return
+        archived = (crons - active)[:count - len(active)]
+        archived.write({'active': True})
+        model = self.env['ir.model']._get(self._name)
+        missing = count - len(active) - len(archived)
+        self.env['ir.cron'].sudo().create([{
+            'name': f"WeChat Work: Sync Worker {index + 1}",
+            'model_id': model.id,
+            'state': 'code',
+            'code': WORKER_CRON_CODE,
+            'interval_number': 5,
+            'interval_type': 'minutes',
+            'numbercall': -1,
+            'active': True,
+        } for index in range(len(crons), len(crons) + missing)])
+
+    @api.model
+    def _requeue_stale_jobs(self):
+        """
+        Put back the running jobs whose worker died
+        They fail after MAX_ATTEMPTS, or when the same sync is already pending again.
+        """
+        cutoff = fields.Datetime.now() - STALE_JOB_TIMEOUT
+        self.env.cr.execute("""
+            UPDATE wecom_sync_job job
+            SET state = CASE WHEN requeue THEN 'pending' ELSE 'failed' END,
+                error = CASE WHEN requeue THEN job.error ELSE 'Worker lost' END
+            FROM (
+                SELECT stale.id, stale.attempt < %s AND NOT EXISTS (
+                    SELECT 1 FROM wecom_sync_job other
+                    WHERE other.company_id = stale.company_id AND other.entity = stale.entity
+                      AND other.state = 'pending'
+                ) AS requeue
+                FROM wecom_sync_job stale
+                WHERE stale.state = 'running' AND COALESCE(stale.heartbeat, stale.start_time) < %s
+            ) stale
+            WHERE job.id = stale.id
+        """, [MAX_ATTEMPTS, cutoff])
+        if self.env.cr.rowcount:
+            _logger.warning(f"Requeued {self.env.cr.rowcount} stale WeChat Work sync jobs")
+            self.invalidate_model(['state', 'error'])
+
+    @api.model
+    def _claim_job(self):
+        """
+        Lock and start the next runnable job
+        Jobs locked by another worker are skipped. A job is runnable when no earlier entity
+        of its company is pending or running, and no job of the same entity is running.
+        :return: The claimed wecom.sync.job record, empty when there is nothing to run
+        """
+        self.flush_model()
+        self.env.cr.execute("""
+            SELECT job.id
+            FROM wecom_sync_job job
+            WHERE job.state = 'pending'
+              AND NOT EXISTS (
+                SELECT 1 FROM wecom_sync_job other
+                WHERE other.company_id = job.company_id
+                  AND other.id != job.id
+                  AND ((other.state = 'pending' AND other.sequence < job.sequence)
+                       OR (other.state = 'running' AND other.sequence <= job.sequence))
+              )
+            ORDER BY (
+                SELECT count(*) FROM wecom_sync_job running
+                WHERE running.company_id = job.company_id AND running.state = 'running'
+            ), job.id
+            LIMIT 1
+            FOR UPDATE OF job SKIP LOCKED
+        """)
+        row = self.env.cr.fetchone()
+        if not row:
+            return self.browse()
+        job = self.browse(row[0])
+        now = fields.Datetime.now()
+        job.write({
+            'state': 'running',
+            'attempt': job.attempt + 1,
+            'start_time': now,
+            'heartbeat': now,
+            'error': False,
+        })
+        # Release the row lock, the state now keeps other workers away
+        _auto_commit(self.env.cr)
+        return job
+
+    def _run(self):
+        """Run the sync of the job in the environment of its company"""
+        self.ensure_one()
+        company = self.company_id
+        start = time.perf_counter()
+        model = self.env[ENTITY_MODELS[self.entity]].with_company(company).with_context(
+            wecom_lane=SYNC_LANE, **{COMMIT_CONTEXT_KEY: True, JOB_CONTEXT_KEY: self.id})
+        try:
+            getattr(model, f"sync_{self.entity}")()
+            vals = {'state': 'done'}
+        except Exception as e:
+            if not getattr(threading.current_thread(), 'testing', False):
+                self.env.cr.rollback()
+            _logger.error(f"WeChat Work {self.entity} sync job {self.id} of {company.name} failed: {str(e)}")
+            vals = {'state': 'failed', 'error': str(e)}
+        vals.update(
+            end_time=fields.Datetime.now(),
+            duration=time.perf_counter() - start,
+            run_id=self.env['wecom.sync.run'].search([
+                ('entity', '=', self.entity), ('company_id', '=', company.id),
+            ], limit=1).id,
+        )
+        self.write(vals)
+        _auto_commit(self.env.cr)
+
+    @api.model
+    def cron_process_jobs(self):
+        """Worker cron: run the runnable jobs until none is left or the time budget is spent"""
+        self._requeue_stale_jobs()
+        deadline = time.monotonic() + WORKER_TIME_BUDGET
+        while time.monotonic() < deadline:
+            job = self._claim_job()
+            if not job:
+                break
+            job._run()
+
+    @api.autovacuum
+    def _gc_sync_jobs(self):
+        """Delete finished jobs older than the run retention period"""
+        days = self.env['wecom.config']._get_snapshot().sync_run_retention_days
+        if days <= 0:
+            return
+        cutoff = fields.Datetime.now() - timedelta(days=days)
+        self.search([('state', 'in', ('done', 'failed')), ('create_date', '<', cutoff)]).unlink()
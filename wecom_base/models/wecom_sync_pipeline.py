@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from odoo import api, fields, models, _
+from odoo.exceptions import UserError
+
+from .wecom_api_service import TOKEN_ERRCODES
+from .wecom_http import WeComResponseError, check_result, make_session, send_with_retry
+from .wecom_sync_profile import profiled
+
+_logger = logging.getLogger(__name__)
+
+# Stages in apply order: (stage, endpoint, result key, params)
+PIPELINE_STAGES = [
+    ('departments', 'department/list', 'department', {}),
+    ('users', 'user/list', 'userlist', {'department_id': 1, 'fetch_child': 1}),
+    ('tags', 'tag/list', 'taglist', {}),
+    ('tag_members', 'tag/get', None, {}),
+]
+# Fetched stages waiting to be applied; the fetcher stays at most this many stages ahead
+QUEUE_SIZE = 1
+# Priority lane of the sync API calls, behind interactive and alerting calls of the same application
+SYNC_LANE = 'sync'
+
+
+class StageFetcher(threading.Thread):
+    """
+    Fetch the pipeline stages in a background thread
+    Only talks to the API, never to the database: the fetched stages are handed to the
+    applying thread through a bounded queue, with the statistics of every call.
+    """
+
+    def __init__(self, base_url, access_token, max_workers=1, limiter=None, lane=SYNC_LANE):
+        super().__init__(name='wecom-sync-fetcher', daemon=True)
+        self.base_url = base_url.rstrip('/')
+        self.access_token = access_token
+        self.max_workers = max_workers
+        self.limiter = limiter
+        self.lane = lane
+        self.queue = queue.Queue(maxsize=QUEUE_SIZE)
+        self.cancelled = threading.Event()
+
+    def run(self):
+        session = make_session(self.max_workers)
+        tags = []
+        try:
+            for stage, endpoint, key, params in PIPELINE_STAGES:
+                start = time.perf_counter()
+                calls = []
+                try:
+                    if stage == 'tag_members':
+                        records = self._call_many(session, calls, endpoint,
+                                                  [{'tagid': tag['tagid']} for tag in tags])
+                        records = [(tag['tagid'], result) for tag, result in zip(tags, records)]
+                    else:
+                        records = self._call(session, calls, endpoint, **params).get(key, [])
+                except Exception as e:
+                    self._put({'stage': stage, 'calls': calls, 'error': e})
+                    return
+                if stage == 'tags':
+                    tags = records
+                if not self._put({
+                    'stage': stage,
+                    'records': records,
+                    'calls': calls,
+                    'fetch_time': time.perf_counter() - start,
+                }):
+                    return
+        finally:
+            session.close()
+
+    def _call(self, session, calls, endpoint, **params):
+        return self._call_many(session, calls, endpoint, [params])[0]
+
+    def _call_many(self, session, calls, endpoint, params_list):
+        """Send GET calls concurrently with the retry policy of send_with_retry, raising the first failure"""
+        url = f"{self.base_url}/{endpoint}"
+
+        def send(params):
+            return send_with_retry(url, 'GET', dict(params, access_token=self.access_token), session=session,
+                                   limiter=self.limiter, lane=self.lane)
+
+        with ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, len(params_list)))) as executor:
+            results = list(executor.map(send, params_list))
+        calls.extend((endpoint, stats) for _result, all_stats, _error in results for stats in all_stats)
+        for result, _all_stats, error in results:
+            if error is not None:
+                raise error
+            check_result(endpoint, result)
+        return [result for result, _all_stats, _error in results]
+
+    def _put(self, item):
+        while not self.cancelled.is_set():
+            try:
+                self.queue.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def next_stage(self):
+        """
+        Wait for the next fetched stage
+        :return: A dictionary with the stage, its records or error, and the call statistics
+        """
+        while True:
+            try:
+                return self.queue.get(timeout=0.5)
+            except queue.Empty:
+                if not self.is_alive() and self.queue.empty():
+                    raise UserError(_("The WeChat Work fetcher stopped unexpectedly."))
+
+
+class WeComSyncPipeline(models.AbstractModel):
+    """
+    WeChat Work Sync Pipeline
+    Full synchronization of a company: departments, users, tags and tag members. A fetcher
+    thread downloads the next stage while the current one is written to the database,
+    so the total time is close to the slowest of fetching and applying, not their sum.
+    """
+    _name = 'wecom.sync.pipeline'
+    _description = 'WeChat Work Sync Pipeline'
+
+    @api.model
+    @profiled
+    def sync_company(self, company):
+        """
+        Synchronize all the WeChat Work data of a company
+        Departments, users and tags are applied through checkpointed wecom.sync.run records.
+        :param company: The res.company record to synchronize
+        :return: A dictionary with the per-stage timings and the total wall time
+        """
+        pipeline = self.with_company(company).with_context(wecom_lane=SYNC_LANE)
+        service = pipeline.env['wecom.api.service']
+        app = company._get_wecom_application()
+        config = pipeline.env['wecom.config']._get_snapshot()
+        start = time.perf_counter()
+        fetcher = StageFetcher(
+            config.api_base_url, service._get_access_token(app.id), max_workers=config.api_max_workers,
+            limiter=service._get_rate_limiter(app.id),
+        )
+        fetcher.start()
+        stages = []
+        try:
+            for _stage in PIPELINE_STAGES:
+                item = fetcher.next_stage()
+                pipeline._log_calls(app, item['calls'])
+                if item.get('error'):
+                    pipeline._raise_fetch_error(app, item['stage'], item['error'])
+                apply_start = time.perf_counter()
+                pipeline._apply_stage(item['stage'], item['records'])
+                stages.append({
+                    'stage': item['stage'],
+                    'count': len(item['records']),
+                    'fetch_time': item['fetch_time'],
+                    'apply_time': time.perf_counter() - apply_start,
+                })
+        finally:
+            fetcher.cancelled.set()
+        company.wecom_last_sync_time = fields.Datetime.now()
+        return {'stages': stages, 'total_time': time.perf_counter() - start}
+
+    def _log_calls(self, app, calls):
+        service = self.env['wecom.api.service']
+        for endpoint, stats in calls:
+            service._record_http_call(app.id, endpoint, 'GET', stats)
+
+    def _raise_fetch_error(self, app, stage, error):
+        if isinstance(error, WeComResponseError) and error.errcode in TOKEN_ERRCODES:
+            # The next sync gets a new token
+            self.env['wecom.api.service']._invalidate_access_token([app.id])
+            app.write({'access_token': False, 'token_expiration_time': False})
+        _logger.error(f"Failed to fetch WeChat Work {stage}: {str(error)}")
+        raise UserError(_("Failed to fetch %(stage)s: %(error)s") % {'stage': stage, 'error': str(error)})
+
+    def _apply_stage(self, stage, records):
+        """
+        Write a fetched stage to the database
+        :param stage: Name of the stage
+        :param records: Records of the stage as returned by the API
+        """
+        runs = self.env['wecom.sync.run']
+        if stage == 'departments':
+            departments = self.env['wecom.department']
+            runs._execute('departments', lambda: departments._department_items(records),
+                          departments._process_departments)
+        elif stage == 'users':
+            users = self.env['wecom.user']
+            runs._execute('users', lambda: users._user_items(records), users._process_users)
+        elif stage == 'tags':
+            tags = self.env['wecom.tag']
+            runs._execute('tags', lambda: tags._tag_items(records), tags._process_tags)
+        elif stage == 'tag_members':
+            tags = self.env['wecom.tag'].search([
+                ('company_id', '=', self.env.company.id),
+                ('wecom_tagid', 'in', [tagid for tagid, _response in records]),
+            ])
+            tags._apply_members(dict(records))
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+
+import base64
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from odoo import api, fields, models
+
+_logger = logging.getLogger(__name__)
+
+# Interval between two stack samples, in seconds
+SAMPLE_INTERVAL = 0.01
+
+
+def profiled(method):
+    """
+    Profile a sync entry point when profiling is enabled, see wecom.sync.profile
+    Apply below @api.model; nested profiled calls are part of the outermost profile.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.env['wecom.sync.profile']._profile(method.__name__):
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+def _frame_label(frame):
+    filename, name = frame[0], frame[2]
+    return f"{name} ({os.path.basename(filename)})"
+
+
+def collapse_stacks(samples, interval=SAMPLE_INTERVAL):
+    """
+    Fold stack samples into the collapsed format read by flamegraph.pl and speedscope
+    Each sample is weighted by the milliseconds until the next sample.
+    :param samples: Sampler entries, dictionaries with 'start' and 'stack' (root first)
+    :param interval: Sampling interval in seconds, the weight of the last sample
+    :return: The collapsed stacks, one "frame;frame;frame weight" line each
+    """
+    weights = Counter()
+    for index, sample in enumerate(samples):
+        following = samples[index + 1]['start'] if index + 1 < len(samples) else sample['start'] + interval
+        stack = ';'.join(_frame_label(frame) for frame in sample['stack'])
+        if stack:
+            weights[stack] += max(1, round((following - sample['start']) * 1000))
+    return ''.join(f"{stack} {weight}\n" for stack, weight in sorted(weights.items()))
+
+
+class WeComSyncProfile(models.Model):
+    """
+    WeChat Work Sync Profile
+    Opt-in profile of a sync run: sampled Python stacks and every SQL query, collected
+    with the Odoo profiler collectors. Enabled per call with the context key
+    wecom_profile, or for every run with the wecom.sync_profiling parameter. Only the
+    last wecom.sync_profile_keep profiles are kept.
+    """
+    _name = 'wecom.sync.profile'
+    _description = 'WeChat Work Sync Profile'
+    _order = 'id desc'
+
+    name = fields.Char(string='Entry Point', required=True, readonly=True)
+    company_id = fields.Many2one('res.company', string='Company', readonly=True, ondelete='cascade')
+    state = fields.Selection([
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ], string='Status', readonly=True)
+    error = fields.Text(string='Error', readonly=True)
+    duration = fields.Float(string='Duration (s)', readonly=True)
+    query_count = fields.Integer(string='SQL Queries', readonly=True)
+    query_time = fields.Float(string='SQL Time (s)', readonly=True)
+    sample_count = fields.Integer(string='Samples', readonly=True)
+    flamegraph = fields.Binary(string='Flamegraph', attachment=True, readonly=True,
+                               help="Collapsed stacks, for flamegraph.pl or speedscope")
+    sql_log = fields.Binary(string='SQL Log', attachment=True, readonly=True)
+    profile_data = fields.Binary(string='Raw Profile', attachment=True, readonly=True,
+                                 help="Samples and queries as JSON")
+    run_ids = fields.One2many('wecom.sync.run', 'profile_id', string='Sync Runs', readonly=True)
+
+    @api.model
+    def _is_profiling_enabled(self):
+        if 'wecom_profile' in self.env.context:
+            return bool(self.env.context['wecom_profile'])
+        return self.env['wecom.config']._get_snapshot().sync_profiling
+
+    @api.model
+    @contextmanager
+    def _profile(self, name):
+        """
+        Profile the enclosed code when profiling is enabled
+        The profile is saved through a separate cursor, so failed runs keep theirs.
+        :param name: Name of the profiled entry point
+        """
+        thread = threading.current_thread()
+        if getattr(thread, 'wecom_profiling', False) or not self._is_profiling_enabled():
+            yield
+            return
+
+        from odoo.tools.profiler import PeriodicCollector, Profiler, SQLCollector
+        sampler = PeriodicCollector(interval=SAMPLE_INTERVAL)
+        sql = SQLCollector()
+        error = None
+        start = time.perf_counter()
+        thread.wecom_profiling = True
+        # Filled by wecom.sync.run with the runs started while profiling
+        thread.wecom_profile_run_ids = []
+        try:
+            with Profiler(collectors=[sampler, sql], db=None, description=name):
+                yield
+        except Exception as e:
+            error = str(e)
+            raise
+        finally:
+            thread.wecom_profiling = False
+            run_ids = thread.wecom_profile_run_ids
+            del thread.wecom_profile_run_ids
+            duration = time.perf_counter() - start
+            try:
+                self._save_profile(name, duration, sampler.entries, sql.entries, error, run_ids)
+            except Exception:
+                _logger.exception(f"Failed to save the WeChat Work profile of {name}")
+
+    def _save_profile(self, name, duration, samples, queries, error=None, run_ids=()):
+        """
+        Store a profile and drop the oldest ones beyond the retention count
+        :param name: Name of the profiled entry point
+        :param duration: Wall time of the run, in seconds
+        :param samples: Stack samples of the sampling collector
+        :param queries: Entries of the SQL collector
+        :param error: Error message when the run failed
+        :param run_ids: IDs of the wecom.sync.run records the profile covers
+        """
+        sql_log = ''.join(f"{entry['time'] * 1000:.3f} ms\t{entry['query']}\n" for entry in queries)
+        raw = {
+            'name': name,
+            'duration': duration,
+            'samples': [{'start': sample['start'], 'stack': sample['stack']} for sample in samples],
+            'queries': [{'start': entry['start'], 'time': entry['time'], 'query': entry['query']}
+                        for entry in queries],
+        }
+        vals = {
+            'name': name,
+            'company_id': self.env.company.id,
+            'state': 'failed' if error else 'done',
+            'error': error,
+            'duration': duration,
+            'query_count': len(queries),
+            'query_time': sum(entry['time'] for entry in queries),
+            'sample_count': len(samples),
+            'flamegraph': base64.b64encode(collapse_stacks(samples).encode()),
+            'sql_log': base64.b64encode(sql_log.encode()),
+            'profile_data': base64.b64encode(json.dumps(raw, default=str).encode()),
+        }
+        with self.pool.cursor() as cr:
+            profiles = self.with_env(self.env(cr=cr, su=True))
+            profile = profiles.create(vals)
+            # Runs are committed by their checkpoints, so they are visible to this cursor
+            profiles.env['wecom.sync.run'].browse(run_ids).exists().write({'profile_id': profile.id})
+            keep = profiles.env['wecom.config']._get_snapshot().sync_profile_keep
+            profiles.search([], offset=max(keep, 1)).unlink()
+        _logger.info(f"Saved WeChat Work profile {profile.id} of {name}: {duration:.2f}s, "
+                     f"{len(queries)} queries, {len(samples)} samples")
+
+    def action_download_flamegraph(self):
+        self.ensure_one()
+        return {
+            'type': 'ir.actions.act_url',
+            'url': f"/web/content/{self._name}/{self.id}/flamegraph"
+                   f"?download=true&filename=wecom-profile-{self.id}.folded",
+            'target': 'self',
+        }
+
+    def action_download_sql_log(self):
+        self.ensure_one()
+        return {
+            'type': 'ir.actions.act_url',
+            'url': f"/web/content/{self._name}/{self.id}/sql_log"
+                   f"?download=true&filename=wecom-profile-{self.id}-sql.log",
+            'target': 'self',
+        }
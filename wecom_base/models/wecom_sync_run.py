@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+from odoo import api, fields, models, _
+from odoo.exceptions import UserError
+
+from .wecom_api_log import _auto_commit
+from .wecom_metrics import metrics
+
+_logger = logging.getLogger(__name__)
+
+# A running run without a checkpoint for this long was killed
+STALE_RUN_TIMEOUT = timedelta(minutes=30)
+# Failed or killed runs are resumed only within this window, older ones start over
+RESUME_WINDOW = timedelta(hours=24)
+# Context key of the sync crons and jobs: progress is committed after every chunk only there,
+# an interactive request keeps its single transaction
+COMMIT_CONTEXT_KEY = 'wecom_sync_commit'
+# Context key of the sync jobs: the id of the wecom.sync.job whose heartbeat every checkpoint refreshes
+JOB_CONTEXT_KEY = 'wecom_sync_job_id'
+
+
+class WeComSyncRun(models.Model):
+    """
+    WeChat Work Sync Run
+    Ledger of the synchronization runs of one entity for one company. Fetched records
+    are applied in chunks ordered by a sort key; after each chunk the progress and the
+    last applied key (the cursor) are committed, so a failed or killed run is resumed
+    after its cursor instead of starting over. Progress is only committed when the sync
+    runs with the wecom_sync_commit context key, as the crons and sync jobs do; an
+    interactive sync is applied in the transaction of its request.
+    """
+    _name = 'wecom.sync.run'
+    _description = 'WeChat Work Sync Run'
+    _order = 'id desc'
+
+    entity = fields.Selection([
+        ('departments', 'Departments'),
+        ('users', 'Users'),
+        ('tags', 'Tags'),
+    ], string='Entity', required=True, readonly=True, index=True)
+    company_id = fields.Many2one('res.company', string='Company', required=True, readonly=True,
+                                 ondelete='cascade', index=True)
+    state = fields.Selection([
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ], string='Status', default='running', required=True, readonly=True, index=True)
+    phase = fields.Selection([
+        ('fetch', 'Fetch'),
+        ('apply', 'Apply'),
+        ('done', 'Done'),
+    ], string='Phase', readonly=True)
+    cursor = fields.Char(string='Cursor', readonly=True, help="Sort key of the last applied record")
+    attempt = fields.Integer(string='Attempts', default=1, readonly=True)
+    total_count = fields.Integer(string='Fetched Records', readonly=True)
+    processed_count = fields.Integer(string='Applied Records', readonly=True)
+    chunk_count = fields.Integer(string='Committed Chunks', readonly=True)
+    start_time = fields.Datetime(string='Start Time', default=fields.Datetime.now, readonly=True)
+    end_time = fields.Datetime(string='End Time', readonly=True)
+    fetch_duration = fields.Float(string='Fetch Duration (s)', readonly=True)
+    apply_duration = fields.Float(string='Apply Duration (s)', readonly=True)
+    duration = fields.Float(string='Duration (s)', readonly=True)
+    error = fields.Text(string='Error', readonly=True)
+    profile_id = fields.Many2one('wecom.sync.profile', string='Profile', readonly=True, ondelete='set null')
+
+    @api.model
+    def _start(self, entity):
+        """
+        Resume the last interrupted run of the current company, or start a new one
+        :param entity: The synchronized entity
+        :return: The committed wecom.sync.run record
+        """
+        company = self.env.company
+        now = fields.Datetime.now()
+        last = self.search([('entity', '=', entity), ('company_id', '=', company.id)], limit=1)
+        if last.state == 'running' and last.write_date > now - STALE_RUN_TIMEOUT:
+            raise UserError(_("A WeChat Work %(entity)s sync is already running for %(company)s.") % {
+                'entity': entity,
+                'company': company.name,
+            })
+        if last.state in ('running', 'failed') and last.write_date > now - RESUME_WINDOW:
+            _logger.info(f"Resuming WeChat Work {entity} sync {last.id} of {company.name} after {last.cursor!r}")
+            last.write({'state': 'running', 'attempt': last.attempt + 1, 'error': False})
+            run = last
+        else:
+            run = self.create({'entity': entity, 'company_id': company.id})
+        profiled_runs = getattr(threading.current_thread(), 'wecom_profile_run_ids', None)
+        if profiled_runs is not None:
+            profiled_runs.append(run.id)
+        run._checkpoint()
+        return run
+
+    @contextmanager
+    def _phase(self, phase):
+        """
+        Track a phase of the run, its duration is accumulated over attempts
+        :param phase: 'fetch' or 'apply'
+        """
+        self.ensure_one()
+        self.phase = phase
+        start = time.perf_counter()
+        with metrics.track('sync_phase', self.env.cr, phase=f"sync_{self.entity}.{phase}"):
+            yield
+        field = f"{phase}_duration"
+        self[field] += time.perf_counter() - start
+
+    def _apply_chunks(self, items, apply_chunk, chunk_size=None):
+        """
+        Apply records in key order, committing progress after every chunk
+        Records whose key is not after the cursor were applied by a previous attempt.
+        :param items: (sort key, record) pairs
+        :param apply_chunk: Callable applying a list of records
+        :param chunk_size: Number of records per commit, wecom.sync_chunk_size by default
+        """
+        self.ensure_one()
+        chunk_size = chunk_size or self.env['wecom.config']._get_snapshot().sync_chunk_size
+        items = sorted(items, key=lambda item: item[0])
+        pending = [item for item in items if not self.cursor or item[0] > self.cursor]
+        self.total_count = len(items)
+        for index in range(0, len(pending), chunk_size):
+            chunk = pending[index:index + chunk_size]
+            apply_chunk([record for _key, record in chunk])
+            # Flush the records before the checkpoint, so a failing chunk never leaves the run row locked
+            self.env.flush_all()
+            self.write({
+                'cursor': chunk[-1][0],
+                'processed_count': len(items) - len(pending) + index + len(chunk),
+                'chunk_count': self.chunk_count + 1,
+            })
+            self._checkpoint()
+
+    def _finish(self):
+        self.ensure_one()
+        end_time = fields.Datetime.now()
+        self.write({
+            'state': 'done',
+            'phase': 'done',
+            'cursor': False,
+            'end_time': end_time,
+            'duration': (end_time - self.start_time).total_seconds(),
+        })
+        self._checkpoint()
+
+    def _fail(self, error):
+        self.ensure_one()
+        self.write({'state': 'failed', 'error': error, 'end_time': fields.Datetime.now()})
+        self._checkpoint()
+
+    @api.model
+    def _execute(self, entity, fetch, apply_chunk):
+        """
+        Run a checkpointed synchronization for the current company
+        On failure the work of the current chunk is rolled back, the committed chunks are kept
+        and the run is marked failed; the next run of the entity resumes after the cursor.
+        Without the wecom_sync_commit context key nothing is committed and the error is raised
+        as is, for the caller's transaction to be rolled back.
+        :param entity: The synchronized entity
+        :param fetch: Callable returning the (sort key, record) pairs to apply
+        :param apply_chunk: Callable applying a list of records
+        :return: The wecom.sync.run record
+        """
+        run = self._start(entity)
+        try:
+            with run._phase('fetch'):
+                items = fetch()
+            with run._phase('apply'):
+                run._apply_chunks(items, apply_chunk)
+            run._finish()
+        except Exception as e:
+            if not self.env.context.get(COMMIT_CONTEXT_KEY):
+                # The request is rolled back as a whole, run included
+                raise
+            if not getattr(threading.current_thread(), 'testing', False):
+                self.env.cr.rollback()
+            run._fail(str(e))
+            raise
+        return run
+
+    def _checkpoint(self):
+        """Commit the progress of the run, in the sync crons and jobs only"""
+        job_id = self.env.context.get(JOB_CONTEXT_KEY)
+        if job_id:
+            # Tell the other workers that the job is alive, see wecom.sync.job _requeue_stale_jobs
+            self.env.cr.execute(
+                "UPDATE wecom_sync_job SET heartbeat = now() AT TIME ZONE 'UTC' WHERE id = %s", [job_id])
+        if self.env.context.get(COMMIT_CONTEXT_KEY):
+            _auto_commit(self.env.cr)
+
+    @api.autovacuum
+    def _gc_sync_runs(self):
+        """Delete finished runs older than the retention period"""
+        days = self.env['wecom.config']._get_snapshot().sync_run_retention_days
+        if days <= 0:
+            return
+        cutoff = fields.Datetime.now() - timedelta(days=days)
+        self.search([('state', '!=', 'running'), ('start_time', '<', cutoff)]).unlink()
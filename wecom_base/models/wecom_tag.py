@@ -3,9 +3,16 @@
 from odoo import api, fields, models, _
 from odoo.exceptions import UserError
 import logging
+import math
+
+from .wecom_sync_profile import profiled
 
 _logger = logging.getLogger(__name__)
 
+# WeChat Work limits of tag/addtagusers and tag/deltagusers per call
+TAG_USERS_CHUNK = 1000
+TAG_PARTIES_CHUNK = 100
+
 
 class WeComTag(models.Model):
     _name = 'wecom.tag'
@@ -31,26 +38,42 @@ class WeComTag(models.Model):
     ]
 
     @api.model
+    @profiled
     def sync_tags(self):
-        api_service = self.env['wecom.api.service']
-        company = self.env.company
-
         try:
-            response = api_service.call_api(company.id, 'tag/list', method='GET')
-            if response.get('errcode') == 0:
-                tags = response.get('taglist', [])
-                self._process_tags(tags)
-                return True
-            else:
-                raise UserError(_("WeChat Work API Error: [%(code)s] %(msg)s") % {
-                    'code': response.get('errcode'),
-                    'msg': response.get('errmsg')
-                })
+            self.env['wecom.sync.run']._execute('tags', self._fetch_tags, self._process_tags)
+            self.search([('company_id', '=', self.env.company.id)]).sync_members()
+            return True
         except Exception as e:
             _logger.error(f"Failed to sync WeChat Work tags: {str(e)}")
             raise UserError(_("Failed to sync tags: %s") % str(e))
 
+    @api.model
+    def _fetch_tags(self):
+        """
+        Fetch the tags of the current company
+        :return: (sort key, tag data) pairs
+        """
+        api_service = self.env['wecom.api.service']
+        response = api_service.client.tag_list(self.env.company._get_wecom_application().id)
+        if response.get('errcode') != 0:
+            raise UserError(_("WeChat Work API Error: [%(code)s] %(msg)s") % {
+                'code': response.get('errcode'),
+                'msg': response.get('errmsg')
+            })
+        return self._tag_items(response.get('taglist', []))
+
+    @api.model
+    def _tag_items(self, tags):
+        """
+        Key tags for a sync run
+        :param tags: Tag data as returned by tag/list
+        :return: (sort key, tag data) pairs
+        """
+        return [(f"{int(tag_data['tagid']):010d}", tag_data) for tag_data in tags]
+
     def _process_tags(self, tags):
+        to_create = []
         for tag_data in tags:
             existing_tag = self.search(
                 [('wecom_tagid', '=', tag_data['tagid']), ('company_id', '=', self.env.company.id)])
@@ -58,7 +81,8 @@ class WeComTag(models.Model):
             if existing_tag:
                 existing_tag.write(vals)
             else:
-                self.create(vals)
+                to_create.append(vals)
+        self.create(to_create)
 
     def _prepare_tag_values(self, tag_data):
         return {
@@ -72,40 +96,195 @@ class WeComTag(models.Model):
     @api.model
     def cron_sync_tags(self):
         companies = self.env['res.company'].search([('is_wecom_integrated', '=', True)])
-        for company in companies:
-            self.with_context(company_id=company.id).sync_tags()
+        self.env['wecom.sync.job'].enqueue(companies, ['tags'])
 
     def action_sync_users(self):
         self.ensure_one()
-        api_service = self.env['wecom.api.service']
+        result = self.sync_members()
+        if result['failed']:
+            raise UserError(_("Failed to sync tag members: %s") % result['failed'][self.wecom_tagid])
+        return True
 
-        try:
-            response = api_service.call_api(self.company_id.id, 'tag/get', method='GET',
-                                            params={'tagid': self.wecom_tagid})
-            if response.get('errcode') == 0:
-                user_list = response.get('userlist', [])
-                department_list = response.get('partylist', [])
-                self._update_tag_members(user_list, department_list)
-                return True
+    def sync_members(self):
+        """
+        Synchronize the members of the tags, fetching tag/get for all of them concurrently
+        Tags whose fetch failed are left unchanged.
+        :return: A dictionary with the number of synced tags and the errors by WeChat Work tag ID
+        """
+        synced = 0
+        failed = {}
+        for company in self.company_id:
+            tags = self.filtered(lambda tag: tag.company_id == company).with_company(company)
+            responses, errors = tags._fetch_members()
+            tags._apply_members(responses)
+            synced += len(responses)
+            failed.update(errors)
+        for tagid, error in failed.items():
+            _logger.warning(f"Failed to sync members of WeChat Work tag {tagid}: {error}")
+        return {'synced': synced, 'failed': failed}
+
+    def _fetch_members(self):
+        """
+        Fetch tag/get for tags of one company concurrently, within the API rate limit
+        :return: A tuple (responses by WeChat Work tag ID, error messages by WeChat Work tag ID)
+        """
+        if not self:
+            return {}, {}
+        app = self.company_id._get_wecom_application()
+        results = self.env['wecom.api.service'].call_api_many(
+            app.id, [('tag/get', {'tagid': tag.wecom_tagid}) for tag in self])
+
+        responses = {}
+        errors = {}
+        for tag, (result, error) in zip(self, results):
+            if error is None:
+                responses[tag.wecom_tagid] = result
             else:
-                raise UserError(_("WeChat Work API Error: [%(code)s] %(msg)s") % {
-                    'code': response.get('errcode'),
-                    'msg': response.get('errmsg')
-                })
-        except Exception as e:
-            _logger.error(f"Failed to sync tag members: {str(e)}")
-            raise UserError(_("Failed to sync tag members: %s") % str(e))
+                errors[tag.wecom_tagid] = str(error)
+        return responses, errors
 
-    def _update_tag_members(self, user_list, department_list):
-        users = self.env['wecom.user'].search(
-            [('wecom_userid', 'in', [u['userid'] for u in user_list]), ('company_id', '=', self.company_id.id)])
-        departments = self.env['wecom.department'].search(
-            [('wecom_id', 'in', department_list), ('company_id', '=', self.company_id.id)])
+    def _apply_members(self, responses):
+        """
+        Apply tag/get responses to tags of one company
+        Users and departments are resolved through maps loaded once for all the tags, and only
+        the relation rows that changed are added or removed.
+        :param responses: tag/get responses by WeChat Work tag ID, tags without one are skipped
+        """
+        company_id = self.env.company.id
+        userids = {user['userid'] for response in responses.values() for user in response.get('userlist', [])}
+        dept_ids = {int(dept_id) for response in responses.values() for dept_id in response.get('partylist', [])}
+        user_map = {
+            user['wecom_userid']: user['id']
+            for user in self.env['wecom.user'].search_read(
+                [('wecom_userid', 'in', list(userids)), ('company_id', '=', company_id)], ['wecom_userid'])
+        }
+        dept_map = {
+            dept['wecom_id']: dept['id']
+            for dept in self.env['wecom.department'].search_read(
+                [('wecom_id', 'in', list(dept_ids)), ('company_id', '=', company_id)], ['wecom_id'])
+        }
+        for tag in self:
+            response = responses.get(tag.wecom_tagid)
+            if response is None:
+                continue
+            wanted_users = {user_map[user['userid']] for user in response.get('userlist', [])
+                            if user['userid'] in user_map}
+            wanted_depts = {dept_map[int(dept_id)] for dept_id in response.get('partylist', [])
+                            if int(dept_id) in dept_map}
+            vals = {}
+            for field, wanted in (('user_ids', wanted_users), ('department_ids', wanted_depts)):
+                current = set(tag[field].ids)
+                commands = [(3, record_id) for record_id in current - wanted]
+                commands += [(4, record_id) for record_id in wanted - current]
+                if commands:
+                    vals[field] = commands
+            if vals:
+                tag.write(vals)
+
+    def add_members(self, users, departments=None):
+        """
+        Add users and departments to the tag in WeChat Work, then locally
+        :param users: wecom.user records
+        :param departments: wecom.department records
+        :return: The merged result, see _change_members
+        """
+        return self._change_members('tag/addtagusers', users, departments)
+
+    def remove_members(self, users, departments=None):
+        """
+        Remove users and departments from the tag in WeChat Work, then locally
+        :param users: wecom.user records
+        :param departments: wecom.department records
+        :return: The merged result, see _change_members
+        """
+        return self._change_members('tag/deltagusers', users, departments)
+
+    def _change_members(self, endpoint, users, departments=None):
+        """
+        Send tag/addtagusers or tag/deltagusers in chunks within the WeChat Work list limits
+        Chunks are sent concurrently within the API rate limit. Only the users and departments
+        accepted by WeChat Work are added to or removed from the tag locally.
+        :param endpoint: 'tag/addtagusers' or 'tag/deltagusers'
+        :param users: wecom.user records
+        :param departments: wecom.department records
+        :return: A dictionary with the invalid and the failed userids and department IDs, and the errors
+        """
+        self.ensure_one()
+        departments = departments or self.env['wecom.department']
+        userids = users.mapped('wecom_userid')
+        dept_ids = departments.mapped('wecom_id')
+        chunks = [
+            (userids[index * TAG_USERS_CHUNK:(index + 1) * TAG_USERS_CHUNK],
+             dept_ids[index * TAG_PARTIES_CHUNK:(index + 1) * TAG_PARTIES_CHUNK])
+            for index in range(max(math.ceil(len(userids) / TAG_USERS_CHUNK), math.ceil(len(dept_ids) / TAG_PARTIES_CHUNK)))
+        ]
+        result = {'invalid_users': [], 'invalid_parties': [], 'failed_users': [], 'failed_parties': [], 'errors': []}
+        if not chunks:
+            return result
 
-        self.write({
-            'user_ids': [(6, 0, users.ids)],
-            'department_ids': [(6, 0, departments.ids)]
-        })
+        app = self.company_id._get_wecom_application()
+        responses = self.env['wecom.api.service'].call_api_many(app.id, [
+            (endpoint, {}, {'tagid': self.wecom_tagid, 'userlist': chunk_users, 'partylist': chunk_depts})
+            for chunk_users, chunk_depts in chunks
+        ], method='POST')
+
+        for (chunk_users, chunk_depts), (response, error) in zip(chunks, responses):
+            if error is None:
+                result['invalid_users'] += [userid for userid in (response.get('invalidlist') or '').split('|')
+                                            if userid]
+                result['invalid_parties'] += [int(dept_id) for dept_id in response.get('invalidparty') or []]
+            else:
+                result['failed_users'] += chunk_users
+                result['failed_parties'] += chunk_depts
+                result['errors'].append(str(error))
+
+        rejected_users = set(result['invalid_users']) | set(result['failed_users'])
+        rejected_depts = set(result['invalid_parties']) | set(result['failed_parties'])
+        command = 4 if endpoint == 'tag/addtagusers' else 3
+        vals = {}
+        accepted_users = users.filtered(lambda user: user.wecom_userid not in rejected_users)
+        accepted_depts = departments.filtered(lambda dept: dept.wecom_id not in rejected_depts)
+        if accepted_users:
+            vals['user_ids'] = [(command, user.id) for user in accepted_users]
+        if accepted_depts:
+            vals['department_ids'] = [(command, dept.id) for dept in accepted_depts]
+        if vals:
+            self.write(vals)
+        if result['errors']:
+            _logger.warning(f"{endpoint} failed for {len(result['failed_users'])} users of WeChat Work tag "
+                            f"{self.wecom_tagid}: {'; '.join(result['errors'])}")
+        return result
+
+    @api.model
+    def _members_notification(self, result, title):
+        """
+        Build the wizard notification of a partial membership change
+        :param result: The result of _change_members
+        :param title: Title of the notification
+        :return: A client action, closing the wizard
+        """
+        message = _("%(invalid)s invalid and %(failed)s failed users were not changed.") % {
+            'invalid': len(result['invalid_users']),
+            'failed': len(result['failed_users']),
+        }
+        if result['errors']:
+            message += ' ' + '; '.join(result['errors'])
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': title,
+                'message': message,
+                'sticky': True,
+                'type': 'warning',
+                'next': {'type': 'ir.actions.act_window_close'},
+            }
+        }
+
+    def _update_tag_members(self, user_list, department_list):
+        self.ensure_one()
+        self.with_company(self.company_id)._apply_members(
+            {self.wecom_tagid: {'userlist': user_list, 'partylist': department_list}})
 
     def action_add_users(self):
         return {
@@ -137,24 +316,10 @@ class WeComTagAddUsersWizard(models.TransientModel):
 
     def action_add_users(self):
         self.ensure_one()
-        api_service = self.env['wecom.api.service']
-
-        try:
-            userlist = self.user_ids.mapped('wecom_userid')
-            response = api_service.call_api(self.tag_id.company_id.id, 'tag/addtagusers', method='POST', data={
-                'tagid': self.tag_id.wecom_tagid,
-                'userlist': userlist
-            })
-            if response.get('errcode') == 0:
-                self.tag_id.write({'user_ids': [(4, user.id) for user in self.user_ids]})
-                return {'type': 'ir.actions.act_window_close'}
-            else:
-                raise UserError(_("WeChat Work API Error: [%(code)s] %(msg)s") % {
-                    'code': response.get('errcode'),
-                    'msg': response.get('errmsg')
-                })
-        except Exception as e:
-            raise UserError(_("Failed to add users to tag: %s") % str(e))
+        result = self.tag_id.add_members(self.user_ids)
+        if result['invalid_users'] or result['failed_users']:
+            return self.tag_id._members_notification(result, _("Add Users to Tag"))
+        return {'type': 'ir.actions.act_window_close'}
 
 
 class WeComTagRemoveUsersWizard(models.TransientModel):
@@ -166,21 +331,7 @@ class WeComTagRemoveUsersWizard(models.TransientModel):
 
     def action_remove_users(self):
         self.ensure_one()
-        api_service = self.env['wecom.api.service']
-
-        try:
-            userlist = self.user_ids.mapped('wecom_userid')
-            response = api_service.call_api(self.tag_id.company_id.id, 'tag/deltagusers', method='POST', data={
-                'tagid': self.tag_id.wecom_tagid,
-                'userlist': userlist
-            })
-            if response.get('errcode') == 0:
-                self.tag_id.write({'user_ids': [(3, user.id) for user in self.user_ids]})
-                return {'type': 'ir.actions.act_window_close'}
-            else:
-                raise UserError(_("WeChat Work API Error: [%(code)s] %(msg)s") % {
-                    'code': response.get('errcode'),
-                    'msg': response.get('errmsg')
-                })
-        except Exception as e:
-            raise UserError(_("Failed to remove users from tag: %s") % str(e))
\ No newline at end of file
+        result = self.tag_id.remove_members(self.user_ids)
+        if result['invalid_users'] or result['failed_users']:
+            return self.tag_id._members_notification(result, _("Remove Users from Tag"))
+        return {'type': 'ir.actions.act_window_close'}
@@ -4,8 +4,21 @@ from odoo import api, fields, models, _
 from odoo.exceptions import UserError
 import logging
 
+from .wecom_callback import callback_handlers
+from .wecom_sync_profile import profiled
+
 _logger = logging.getLogger(__name__)
 
+# update_user callback fields copied as is, see _callback_user_values
+CALLBACK_USER_FIELDS = {
+    'Name': 'name',
+    'Position': 'position',
+    'Mobile': 'mobile',
+    'Email': 'email',
+    'Alias': 'alias',
+    'Telephone': 'telephone',
+}
+
 
 class WeComUser(models.Model):
     _name = 'wecom.user'
@@ -17,6 +30,8 @@ class WeComUser(models.Model):
     wecom_userid = fields.Char(string='WeChat Work UserID', required=True, index=True)
     company_id = fields.Many2one('res.company', string='Company', required=True, default=lambda self: self.env.company)
     department_ids = fields.Many2many('wecom.department', string='Departments')
+    leader_department_ids = fields.Many2many('wecom.department', 'wecom_department_leader_rel', 'user_id',
+                                             'department_id', string='Leader of Departments')
     position = fields.Char(string='Position')
     mobile = fields.Char(string='Mobile')
     gender = fields.Selection([
@@ -26,8 +41,11 @@ class WeComUser(models.Model):
     ], string='Gender')
     email = fields.Char(string='Email')
     is_leader_in_dept = fields.Char(string='Leader in Departments')
-    avatar = fields.Binary(string='Avatar')
-    thumb_avatar = fields.Binary(string='Thumb Avatar')
+    avatar_url = fields.Char(string='Avatar URL')
+    thumb_avatar_url = fields.Char(string='Thumb Avatar URL')
+    avatar_media_id = fields.Many2one('wecom.media', string='Avatar Media', ondelete='set null', index=True)
+    avatar = fields.Binary(string='Avatar', compute='_compute_media')
+    thumb_avatar = fields.Binary(string='Thumb Avatar', compute='_compute_media')
     telephone = fields.Char(string='Telephone')
     alias = fields.Char(string='Alias')
     extattr = fields.Text(string='Extended Attributes')
@@ -36,7 +54,9 @@ class WeComUser(models.Model):
         (2, 'Deactivated'),
         (4, 'Unassigned')
     ], string='Status', default=1)
-    qr_code = fields.Binary(string='QR Code')
+    qr_code_url = fields.Char(string='QR Code URL')
+    qr_code_media_id = fields.Many2one('wecom.media', string='QR Code Media', ondelete='set null', index=True)
+    qr_code = fields.Binary(string='QR Code', compute='_compute_media')
     external_profile = fields.Text(string='External Profile')
     external_position = fields.Char(string='External Position')
 
@@ -45,40 +65,90 @@ class WeComUser(models.Model):
          'WeChat Work UserID must be unique per company!')
     ]
 
+    @api.depends('avatar_media_id.blob_id', 'qr_code_media_id.blob_id')
+    def _compute_media(self):
+        # Reading never downloads: pending media show empty images and are queued for the prefetch cron.
+        # The thumbnail is the stored resized avatar
+        (self.avatar_media_id | self.qr_code_media_id)._request_content()
+        for user in self:
+            user.avatar = user.avatar_media_id.blob_id.image
+            user.thumb_avatar = user.avatar_media_id.blob_id.image_128
+            user.qr_code = user.qr_code_media_id.blob_id.image
+
     @api.model
+    @profiled
     def sync_users(self):
-        api_service = self.env['wecom.api.service']
-        company = self.env.company
-
         try:
-            response = api_service.call_api(company.id, 'user/list', method='GET',
-                                            params={'department_id': 1, 'fetch_child': 1})
-            if response.get('errcode') == 0:
-                users = response.get('userlist', [])
-                self._process_users(users)
-                return True
-            else:
-                raise UserError(_("WeChat Work API Error: [%(code)s] %(msg)s") % {
-                    'code': response.get('errcode'),
-                    'msg': response.get('errmsg')
-                })
+            self.env['wecom.sync.run']._execute('users', self._fetch_users, self._process_users)
+            return True
         except Exception as e:
             _logger.error(f"Failed to sync WeChat Work users: {str(e)}")
             raise UserError(_("Failed to sync users: %s") % str(e))
 
+    @api.model
+    def _fetch_users(self):
+        """
+        Fetch the users of the current company
+        :return: (userid, user data) pairs
+        """
+        api_service = self.env['wecom.api.service']
+        response = api_service.client.user_list(self.env.company._get_wecom_application().id,
+                                             department_id=1, fetch_child=1)
+        if response.get('errcode') != 0:
+            raise UserError(_("WeChat Work API Error: [%(code)s] %(msg)s") % {
+                'code': response.get('errcode'),
+                'msg': response.get('errmsg')
+            })
+        return self._user_items(response.get('userlist', []))
+
+    @api.model
+    def _user_items(self, users):
+        """
+        Key users for a sync run
+        :param users: User data as returned by user/list
+        :return: (userid, user data) pairs
+        """
+        return [(user_data['userid'], user_data) for user_data in users]
+
     def _process_users(self, users):
+        company_id = self.env.company.id
+        userids = [user_data['userid'] for user_data in users]
+        media_ids = self.env['wecom.media']._register(
+            [user_data.get(key) for user_data in users for key in ('avatar', 'qr_code')])
+        # Everything the chunk refers to is loaded in one query per model, then looked up in memory
+        existing_users = {user.wecom_userid: user for user in self.search(
+            [('wecom_userid', 'in', userids), ('company_id', '=', company_id)])}
+        department_ids = {department.wecom_id: department.id for department in self.env['wecom.department'].search([
+            ('wecom_id', 'in', list({dept_id for user_data in users for dept_id in user_data.get('department', [])})),
+            ('company_id', '=', company_id),
+        ])}
+        odoo_users = {user.login: user for user in self.env['res.users'].with_context(active_test=False).search(
+            [('login', 'in', userids)])}
+        to_create = []
         for user_data in users:
-            existing_user = self.search(
-                [('wecom_userid', '=', user_data['userid']), ('company_id', '=', self.env.company.id)])
-            vals = self._prepare_user_values(user_data)
+            existing_user = existing_users.get(user_data['userid'])
+            vals = self._prepare_user_values(user_data, media_ids, department_ids, odoo_users)
             if existing_user:
                 existing_user.write(vals)
             else:
-                self.create(vals)
+                to_create.append(vals)
+        self.create(to_create)
 
-    def _prepare_user_values(self, user_data):
-        departments = self.env['wecom.department'].search(
-            [('wecom_id', 'in', user_data.get('department', [])), ('company_id', '=', self.env.company.id)])
+    def _prepare_user_values(self, user_data, media_ids, department_ids, odoo_users):
+        """
+        Prepare the wecom.user values of a user, creating or updating its Odoo user
+        Images are only referenced by URL, see wecom.media.
+        :param user_data: User data as returned by user/list
+        :param media_ids: {url: wecom.media ID} of the images
+        :param department_ids: {WeChat Work department ID: wecom.department ID} of the current company
+        :param odoo_users: {login: res.users record}, archived users included; created users are added
+        :return: The wecom.user values
+        """
+        dept_wecom_ids = [dept_id for dept_id in user_data.get('department', []) if dept_id in department_ids]
+
+        # is_leader_in_dept is aligned with the department list
+        leader_flags = zip(user_data.get('department', []), user_data.get('is_leader_in_dept', []))
+        leader_of = {dept_id for dept_id, is_leader in leader_flags if is_leader}
 
         # Prepare Odoo user values
         odoo_user_vals = {
@@ -89,29 +159,33 @@ class WeComUser(models.Model):
         }
 
         # Create or update Odoo user
-        odoo_user = self.env['res.users'].search([('login', '=', user_data['userid'])], limit=1)
+        odoo_user = odoo_users.get(user_data['userid'])
         if odoo_user:
             odoo_user.write(odoo_user_vals)
         else:
-            odoo_user = self.env['res.users'].create(odoo_user_vals)
+            odoo_user = odoo_users[user_data['userid']] = self.env['res.users'].create(odoo_user_vals)
 
         return {
             'odoo_user_id': odoo_user.id,
             'wecom_userid': user_data['userid'],
             'company_id': self.env.company.id,
-            'department_ids': [(6, 0, departments.ids)],
+            'department_ids': [(6, 0, [department_ids[dept_id] for dept_id in dept_wecom_ids])],
+            'leader_department_ids': [(6, 0, [department_ids[dept_id] for dept_id in dept_wecom_ids
+                                              if dept_id in leader_of])],
             'position': user_data.get('position', ''),
             'mobile': user_data.get('mobile', ''),
             'gender': user_data.get('gender', 0),
             'email': user_data.get('email', ''),
             'is_leader_in_dept': ','.join(map(str, user_data.get('is_leader_in_dept', []))),
-            'avatar': user_data.get('avatar', ''),
-            'thumb_avatar': user_data.get('thumb_avatar', ''),
+            'avatar_url': user_data.get('avatar') or False,
+            'thumb_avatar_url': user_data.get('thumb_avatar') or False,
+            'avatar_media_id': media_ids.get(user_data.get('avatar')) or False,
             'telephone': user_data.get('telephone', ''),
             'alias': user_data.get('alias', ''),
             'extattr': str(user_data.get('extattr', {})),
             'status': user_data.get('status', 1),
-            'qr_code': user_data.get('qr_code', ''),
+            'qr_code_url': user_data.get('qr_code') or False,
+            'qr_code_media_id': media_ids.get(user_data.get('qr_code')) or False,
             'external_profile': str(user_data.get('external_profile', {})),
             'external_position': user_data.get('external_position', ''),
         }
@@ -119,31 +193,92 @@ class WeComUser(models.Model):
     @api.model
     def cron_sync_users(self):
         companies = self.env['res.company'].search([('is_wecom_integrated', '=', True)])
-        for company in companies:
-            self.with_context(company_id=company.id).sync_users()
+        self.env['wecom.sync.job'].enqueue(companies, ['users'])
 
     def action_sync_to_odoo(self):
         self.ensure_one()
-        self.odoo_user_id.write({
-            'name': self.name,
-            'email': self.email,
-            # Add other fields as needed
-        })
+        self._sync_odoo_users()
         return True
 
+    def _sync_odoo_users(self):
+        """
+        Copy the email of the users to their Odoo users, one write per distinct email
+        The name is shared with the Odoo user through _inherits.
+        """
+        users = self.filtered(lambda user: user.odoo_user_id.email != user.email)
+        for email in set(users.mapped('email')):
+            users.filtered(lambda user: user.email == email).odoo_user_id.write({'email': email})
+
     @api.model
-    def create(self, vals):
-        user = super(WeComUser, self).create(vals)
-        user.action_sync_to_odoo()
-        return user
+    def _callback_update_users(self, messages):
+        """
+        Apply update_user callbacks, merged into one per user
+        Users with the same new values, e.g. moved to the same department, are updated in one write.
+        :param messages: Callback messages, at most one per UserID
+        """
+        users = self.search([('wecom_userid', 'in', [message['UserID'] for message in messages]),
+                             ('company_id', '=', self.env.company.id)])
+        users_by_userid = {user.wecom_userid: user for user in users}
+        dept_ids = {int(dept_id) for message in messages
+                    for dept_id in (message.get('Department') or '').split(',') if dept_id}
+        departments = self.env['wecom.department'].search(
+            [('wecom_id', 'in', list(dept_ids)), ('company_id', '=', self.env.company.id)])
+        departments_by_id = {dept.wecom_id: dept.id for dept in departments}
+
+        updates = {}
+        for message in messages:
+            user = users_by_userid.get(message['UserID'])
+            if not user:
+                # Not synchronized yet, the next sync creates it
+                continue
+            vals = self._callback_user_values(message, departments_by_id)
+            if vals:
+                key = repr(sorted(vals.items()))
+                updates.setdefault(key, (vals, []))[1].append(user.id)
+        for vals, user_ids in updates.values():
+            self.browse(user_ids).write(vals)
+
+    @api.model
+    def _callback_user_values(self, message, departments_by_id):
+        """
+        Prepare the wecom.user values of an update_user callback, which only carries the changed fields
+        :param message: Callback message
+        :param departments_by_id: {department wecom_id: wecom.department ID}
+        :return: The wecom.user values
+        """
+        vals = {field: message[key] or '' for key, field in CALLBACK_USER_FIELDS.items() if key in message}
+        if message.get('NewUserID'):
+            vals['wecom_userid'] = message['NewUserID']
+        for key, field in (('Gender', 'gender'), ('Status', 'status')):
+            if message.get(key):
+                vals[field] = int(message[key])
+        if 'Department' in message:
+            dept_ids = [int(dept_id) for dept_id in (message['Department'] or '').split(',') if dept_id]
+            leader_flags = (message.get('IsLeaderInDept') or '').split(',')
+            leader_of = [dept_id for dept_id, flag in zip(dept_ids, leader_flags) if flag == '1']
+            vals['department_ids'] = [(6, 0, [departments_by_id[dept_id] for dept_id in dept_ids
+                                              if dept_id in departments_by_id])]
+            vals['leader_department_ids'] = [(6, 0, [departments_by_id[dept_id] for dept_id in leader_of
+                                                     if dept_id in departments_by_id])]
+            vals['is_leader_in_dept'] = ','.join(leader_flags[:len(dept_ids)])
+        return vals
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        users = super(WeComUser, self).create(vals_list)
+        users._sync_odoo_users()
+        return users
 
     def write(self, vals):
         result = super(WeComUser, self).write(vals)
-        for user in self:
-            user.action_sync_to_odoo()
+        self._sync_odoo_users()
         return result
 
     def unlink(self):
         for user in self:
             user.odoo_user_id.active = False
-        return super(WeComUser, self).unlink()
\ No newline at end of file
+        return super(WeComUser, self).unlink()
+
+
+callback_handlers.register('event', 'change_contact', 'update_user', model='wecom.user',
+                           method='_callback_update_users', batchable=True, entity_key='UserID')
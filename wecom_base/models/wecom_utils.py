@@ -1,18 +1,17 @@
 # -*- coding: utf-8 -*-
 
 import string
-import requests
 import hashlib
 import base64
 import json
 import time
 import random
-import xmltodict
-from Crypto.Cipher import AES
-from Crypto.Util.Padding import pad, unpad
 from odoo import _, fields
 from odoo.exceptions import ValidationError
 
+# requests、pycryptodome 和 xmltodict 在首次使用时才导入：
+# 每个 Odoo 工作进程都会导入本模块，而大部分进程从不处理企业微信消息
+
 
 def calculate_signature(token, timestamp, nonce, encrypt_msg):
     """
@@ -35,6 +34,8 @@ def encrypt_message(to_encrypt, encoding_aes_key):
     :param encoding_aes_key: 企业微信后台设置的 EncodingAESKey
     :return: 加密后的消息
     """
+    from Crypto.Cipher import AES
+    from Crypto.Util.Padding import pad
     key = base64.b64decode(encoding_aes_key + "=")
     cipher = AES.new(key, AES.MODE_CBC, key[:16])
     encrypted = cipher.encrypt(pad(to_encrypt.encode(), AES.block_size))
@@ -48,6 +49,8 @@ def decrypt_message(encrypt_msg, encoding_aes_key):
     :param encoding_aes_key: 企业微信后台设置的 EncodingAESKey
     :return: 解密后的消息
     """
+    from Crypto.Cipher import AES
+    from Crypto.Util.Padding import unpad
     key = base64.b64decode(encoding_aes_key + "=")
     cipher = AES.new(key, AES.MODE_CBC, key[:16])
     decrypted_msg = unpad(cipher.decrypt(base64.b64decode(encrypt_msg)), AES.block_size)
@@ -60,6 +63,7 @@ def parse_xml_to_dict(xml_string):
     :param xml_string: XML字符串
     :return: 解析后的字典
     """
+    import xmltodict
     return xmltodict.parse(xml_string)['xml']
 
 
@@ -128,6 +132,7 @@ def handle_wecom_error(error):
     :param error: 错误信息
     :return: 格式化的错误消息
     """
+    import requests
     error_msg = str(error)
     if isinstance(error, requests.exceptions.RequestException):
         error_msg = _("Network error: %s") % error_msg
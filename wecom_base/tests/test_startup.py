@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+import json
+import statistics
+import subprocess
+import sys
+
+from odoo.tests import TransactionCase, tagged
+from odoo.tools import config
+
+# Same budget as python -m tools.wecom_bench startup
+MAX_IMPORT_MS = 150
+MAX_RSS_MB = 15
+REPEAT = 3
+
+# Dependencies wecom_base imports on first use only, loading them at import time fails the check
+LAZY_MODULES = ('requests', 'Crypto', 'xmltodict')
+
+# Run in a fresh interpreter, so nothing is imported or cached beforehand, see tools/wecom_bench/startup.py
+PROBE = r'''
+import json
+import os
+import resource
+import sys
+import time
+
+
+def rss_kb():
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+import odoo
+from odoo.modules.module import initialize_sys_path
+
+odoo.tools.config.parse_config(sys.argv[1:])
+initialize_sys_path()
+before = set(sys.modules)
+rss = rss_kb()
+start = time.perf_counter()
+import odoo.addons.wecom_base
+import odoo.addons.wecom_base.controllers.main
+import_ms = (time.perf_counter() - start) * 1000
+print(json.dumps({
+    'import_ms': import_ms,
+    'rss_mb': (rss_kb() - rss) / 1024,
+    'modules': sorted(set(sys.modules) - before),
+}))
+'''
+
+
+@tagged('post_install', '-at_install', 'wecom_startup')
+class TestStartupBudget(TransactionCase):
+    """Import time and memory of a worker loading wecom_base, the medians of fresh interpreters"""
+
+    def _probe(self):
+        output = subprocess.check_output([sys.executable, '-c', PROBE, '--addons-path', config['addons_path']])
+        return json.loads(output.decode().strip().splitlines()[-1])
+
+    def test_startup_budget(self):
+        probes = [self._probe() for _index in range(REPEAT)]
+        eager = sorted({module.split('.')[0] for module in probes[-1]['modules']} & set(LAZY_MODULES))
+        self.assertFalse(eager, f"Imported when wecom_base is loaded: {', '.join(eager)}")
+        import_ms = statistics.median(result['import_ms'] for result in probes)
+        self.assertLessEqual(import_ms, MAX_IMPORT_MS, f"wecom_base import time {import_ms:.2f} ms")
+        rss_mb = statistics.median(result['rss_mb'] for result in probes)
+        self.assertLessEqual(rss_mb, MAX_RSS_MB, f"wecom_base resident memory {rss_mb:.2f} MB")